@@ -1,67 +1,48 @@
 # app/business_rules/__init__.py
 
 
+import os
+
 from app.business_rules.engine import business_rule_registry, business_rule_evaluator
 from app.business_rules.adapters.order_adapter import sainapsis_order_adapter
+from app.business_rules.ruleset import RuleSet, RuleSetConfigError
+from app.business_rules.batch import OrderBatch, batch_rule_evaluator
+from app.business_rules.shared_config import shared_rule_config
+
+# Catálogo de reglas específicas de Sainapsis
+from app.business_rules.rules.sainapsis_rules import SAINAPSIS_RULE_CATALOG
 
-# Importar todas las reglas específicas de Sainapsis
-from app.business_rules.rules.sainapsis_rules import (
-    SainapsisSmallOrderRule,
-    SainapsisHighValuePaymentFailedRule,
-    SainapsisUltraHighValueReviewRule,
-    SainapsisCountryTaxRule,
-    SainapsisHighRiskCountryRule,
-    SainapsisReviewingStateRule,
-    SainapsisWeekendOrderRule,
-    SainapsisWeekendOrderEnrichmentRule
+
+# Configuración de reglas (YAML/JSON); BUSINESS_RULES_CONFIG la reemplaza
+DEFAULT_RULES_CONFIG = os.path.join(
+    os.path.dirname(__file__), "config", "sainapsis_rules.yaml"
 )
 
 
+def get_rules_config_path() -> str:
+    """Ruta del archivo de configuración de reglas"""
+    return os.getenv("BUSINESS_RULES_CONFIG", DEFAULT_RULES_CONFIG)
+
+
 def initialize_sainapsis_business_rules():
     """
-    Inicializa y registra todas las reglas de negocio de Sainapsis
+    Inicializa las reglas de negocio de Sainapsis: compila la configuración
+    y la publica como la primera versión del conjunto de reglas
     """
     print("🔧 Initializing Sainapsis Business Rules System...")
     
-    # ========================================================================
-    # REGLA PRINCIPAL: Órdenes ≤ $20 no requieren verificación
-    # ========================================================================
-    business_rule_registry.register(SainapsisSmallOrderRule(threshold=20.0))
+    # Catálogo de clases disponibles para la configuración
+    for rule_class in SAINAPSIS_RULE_CATALOG.values():
+        business_rule_registry.register_rule_class(rule_class)
     
-    # ========================================================================
-    # REGLAS DE VALOR ALTO (integrando tu lógica existente)
-    # ========================================================================
-    business_rule_registry.register(SainapsisHighValuePaymentFailedRule())
-    business_rule_registry.register(SainapsisUltraHighValueReviewRule())
-    
-    # ========================================================================
-    # REGLAS DE PAÍS
-    # ========================================================================
-    business_rule_registry.register(SainapsisCountryTaxRule())
-    business_rule_registry.register(SainapsisHighRiskCountryRule())
-    
-    # ========================================================================
-    # REGLAS DE INTEGRACIÓN CON SISTEMA EXISTENTE
-    # ========================================================================
-    business_rule_registry.register(SainapsisReviewingStateRule())
-    
-    # ========================================================================
-    # REGLAS DE FIN DE SEMANA
-    # ========================================================================
-    business_rule_registry.register(SainapsisWeekendOrderEnrichmentRule(weekend_threshold=500.0))
-    
-    # ========================================================================
-    # REGLAS OPCIONALES (deshabilitadas por defecto)
-    # ========================================================================
-    weekend_rule = SainapsisWeekendOrderRule()
-    weekend_rule.disable()  # Deshabilitar por defecto
-    business_rule_registry.register(weekend_rule)
+    # Compilar y publicar la configuración
+    rule_set = business_rule_registry.load_config_file(get_rules_config_path())
     
     # ========================================================================
     # RESUMEN DE INICIALIZACIÓN
     # ========================================================================
-    registered_rules = business_rule_registry.get_all_rules()
-    print(f"✅ Successfully registered {len(registered_rules)} business rules")
+    registered_rules = rule_set.get_all_rules()
+    print(f"✅ Successfully registered {len(registered_rules)} business rules (rule set v{rule_set.version})")
     
     # Log detallado de reglas registradas
     print("📋 Registered Rules:")
@@ -100,11 +81,14 @@ def get_rule_info():
     return business_rule_registry.list_rules_info()
 
 
+def get_current_rule_set() -> RuleSet:
+    """Obtiene el conjunto de reglas vigente"""
+    return business_rule_registry.current()
+
+
 def enable_rule(rule_id: str) -> bool:
-    """Habilita una regla específica"""
-    rule = business_rule_registry.get_rule(rule_id)
-    if rule:
-        rule.enable()
+    """Habilita una regla específica (publica una nueva versión)"""
+    if business_rule_registry.set_rule_enabled(rule_id, True):
         print(f"✅ Rule {rule_id} enabled")
         return True
     else:
@@ -113,10 +97,8 @@ def enable_rule(rule_id: str) -> bool:
 
 
 def disable_rule(rule_id: str) -> bool:
-    """Deshabilita una regla específica"""
-    rule = business_rule_registry.get_rule(rule_id)
-    if rule:
-        rule.disable()
+    """Deshabilita una regla específica (publica una nueva versión)"""
+    if business_rule_registry.set_rule_enabled(rule_id, False):
         print(f"🔴 Rule {rule_id} disabled")
         return True
     else:
@@ -132,7 +114,9 @@ def change_small_order_threshold(new_threshold: float) -> bool:
     rule = business_rule_registry.get_rule("sainapsis_small_order_no_verification")
     if rule and hasattr(rule, 'threshold'):
         old_threshold = rule.threshold
-        rule.threshold = new_threshold
+        business_rule_registry.update_rule_params(
+            "sainapsis_small_order_no_verification", threshold=new_threshold
+        )
         print(f"🔧 Small order threshold changed from ${old_threshold} to ${new_threshold}")
         return True
     else:
@@ -140,6 +124,16 @@ def change_small_order_threshold(new_threshold: float) -> bool:
         return False
 
 
+def reload_business_rules(path: str = None) -> RuleSet:
+    """Recompila el archivo de configuración y publica la nueva versión"""
+    return business_rule_registry.load_config_file(path or get_rules_config_path())
+
+
+def load_business_rules_config(config: dict) -> RuleSet:
+    """Compila una configuración recibida (p.ej. por la API) y la publica"""
+    return business_rule_registry.load_config(config, source="api")
+
+
 # ============================================================================
 # AUTO-INICIALIZACIÓN
 # ============================================================================
@@ -171,9 +165,21 @@ __all__ = [
     
     # Funciones de utilidad
     'get_rule_info',
+    'get_current_rule_set',
     'enable_rule',
     'disable_rule',
     'change_small_order_threshold',
+    'reload_business_rules',
+    'load_business_rules_config',
+    
+    # Conjuntos de reglas versionados
+    'RuleSet',
+    'RuleSetConfigError',
+    'shared_rule_config',
+    
+    # Evaluación en lote
+    'OrderBatch',
+    'batch_rule_evaluator',
     
     # Estado del sistema
     'BUSINESS_RULES_INITIALIZED'
@@ -4,84 +4,131 @@
 Adaptador que integra el motor de reglas de negocio con tu OrderService existente.
 """
 
-from typing import List, Dict, Any, Optional
+import logging
+from typing import List, Dict, Any, Optional, Tuple
 from uuid import UUID
 
 from app.business_rules.base import RuleContext
+from app.business_rules.batch import OrderBatch, batch_rule_evaluator
 from app.business_rules.engine import business_rule_evaluator
+from app.business_rules.ruleset import RuleSet
+from app.business_rules.shadow import shadow_evaluator
+from app.core.exceptions import OrderConflict
+from app.core.locks import order_locks
 from app.models.domain import Order, EventType, OrderState
-from app.services.order_service import order_service
+from app.services.order_service import EVENT_CONFLICT_RETRIES, order_service
+
+logger = logging.getLogger(__name__)
 
 
 class SainapsisOrderAdapter:
     """
     Adaptador que conecta las business rules con tu sistema existente
-    sin modificar tu código actual
+    sin modificar tu código actual.
+
+    Cada operación fija un RuleSet al empezar y lo usa en todos sus pasos,
+    aunque se publique una versión nueva mientras tanto.
     """
     
     def __init__(self):
         self.rule_evaluator = business_rule_evaluator
         self.original_service = order_service
     
+    def current_rule_set(self) -> RuleSet:
+        """RuleSet vigente, para fijarlo durante toda una petición"""
+        return self.rule_evaluator.registry.current()
+    
     async def get_filtered_allowed_events(
         self, 
         order_id: UUID, 
-        user_context: Optional[Dict[str, Any]] = None
+        user_context: Optional[Dict[str, Any]] = None,
+        order: Optional[Order] = None,
+        rule_set: Optional[RuleSet] = None
     ) -> List[EventType]:
         """
         🎯 FUNCIÓN PRINCIPAL que resuelve tu problema de los $20
         
         Obtiene eventos permitidos aplicando filtros de business rules
-        sobre los eventos base de tu sistema existente
+        sobre los eventos base de tu sistema existente.
+        Si el llamador ya tiene la orden puede pasarla y no se vuelve a leer.
         """
-        # 1. Obtener eventos base usando TU servicio original
-        base_events = await self.original_service.get_allowed_events(order_id)
+        # 1. Obtener orden (una sola lectura)
+        if order is None:
+            order = await self.original_service.get_order(order_id)
         
-        # 2. Obtener orden para contexto
-        order = await self.original_service.get_order(order_id)
+        # 2. Crear contexto y filtrar eventos base
+        context = self._build_context(order, user_context)
+        _, filtered_events = await self._filter_allowed_events(
+            order, context, rule_set or self.current_rule_set()
+        )
         
-        # 3. Crear contexto para reglas
-        context = RuleContext(
+        return filtered_events
+    
+    def _build_context(
+        self, order: Order, user_context: Optional[Dict[str, Any]] = None
+    ) -> RuleContext:
+        """Contexto de reglas para una orden, construido una vez por petición"""
+        return RuleContext(
             order=order,
             user_context=user_context or {}
         )
+    
+    async def _filter_allowed_events(
+        self, order: Order, context: RuleContext, rule_set: RuleSet
+    ) -> Tuple[List[EventType], List[EventType]]:
+        """Eventos base de la máquina de estados y eventos filtrados por reglas"""
+        # 1. Eventos base usando TU servicio original (sin volver a leer la orden)
+        base_events = await self.original_service.get_allowed_events(order.id, order=order)
         
-        # 4. Aplicar filtros de business rules
-        filtered_events = self.rule_evaluator.filter_available_events(base_events, context)
+        # 2. Aplicar filtros de business rules
+        filtered_events = self.rule_evaluator.filter_available_events(base_events, context, rule_set)
+        shadow_evaluator.shadow_filter(context, base_events, filtered_events, rule_set)
         
-        # 5. Log para debugging
-        removed_events = [e for e in base_events if e not in filtered_events]
-        if removed_events:
-            print(f"🔧 Events removed by rules: {[e.value for e in removed_events]}")
+        # 3. Log para debugging (la lista solo se arma si DEBUG está activo)
+        if logger.isEnabledFor(logging.DEBUG):
+            removed_events = [e.value for e in base_events if e not in filtered_events]
+            if removed_events:
+                logger.debug("🔧 Events removed by rules: %s", removed_events)
         
-        return filtered_events
+        return base_events, filtered_events
+    
+    async def get_events_comparison(
+        self,
+        order: Order,
+        user_context: Optional[Dict[str, Any]] = None,
+        rule_set: Optional[RuleSet] = None
+    ) -> Tuple[List[EventType], List[EventType]]:
+        """Eventos base y filtrados para una orden ya cargada"""
+        context = self._build_context(order, user_context)
+        return await self._filter_allowed_events(order, context, rule_set or self.current_rule_set())
     
     async def enrich_order_data(
         self, 
         order: Order, 
-        user_context: Optional[Dict[str, Any]] = None
+        user_context: Optional[Dict[str, Any]] = None,
+        rule_set: Optional[RuleSet] = None
     ) -> Dict[str, Any]:
         """
         Enriquece datos de una orden usando business rules
         """
-        context = RuleContext(
-            order=order,
-            user_context=user_context or {}
-        )
+        context = self._build_context(order, user_context)
         
-        return self.rule_evaluator.enrich_order_data(context)
+        return self.rule_evaluator.enrich_order_data(context, rule_set)
     
     async def validate_order_before_creation(
         self,
         product_ids: List[str],
         amount: float,
         metadata: Dict[str, Any],
-        user_context: Optional[Dict[str, Any]] = None
+        user_context: Optional[Dict[str, Any]] = None,
+        rule_set: Optional[RuleSet] = None
     ) -> Dict[str, Any]:
         """
         Valida la creación de una orden usando business rules
         Retorna información sobre qué reglas se aplicarían
         """
+        rule_set = rule_set or self.current_rule_set()
+        
         # Crear orden temporal para validación
         from datetime import datetime
         temp_order = Order(
@@ -101,7 +148,7 @@ class SainapsisOrderAdapter:
         
         # Validar con reglas
         try:
-            self.rule_evaluator.validate_context(context)
+            self.rule_evaluator.validate_context(context, rule_set)
             validation_passed = True
             validation_error = None
         except Exception as e:
@@ -109,10 +156,10 @@ class SainapsisOrderAdapter:
             validation_error = str(e)
         
         # Obtener enriquecimientos que se aplicarían
-        enrichments = self.rule_evaluator.enrich_order_data(context)
+        enrichments = self.rule_evaluator.enrich_order_data(context, rule_set)
         
         # Simular qué reglas de negocio se ejecutarían
-        business_simulation = self.rule_evaluator.evaluate_business_logic(context)
+        business_simulation = self.rule_evaluator.evaluate_business_logic(context, rule_set)
         
         return {
             "validation_passed": validation_passed,
@@ -120,7 +167,8 @@ class SainapsisOrderAdapter:
             "enrichments": enrichments,
             "business_rules_preview": business_simulation,
             "would_create_tickets": len(business_simulation.get("support_tickets", [])),
-            "preview_actions": business_simulation.get("actions", [])
+            "preview_actions": business_simulation.get("actions", []),
+            "rule_set_version": rule_set.version
         }
     
     async def process_event_with_business_rules(
@@ -128,93 +176,110 @@ class SainapsisOrderAdapter:
         order_id: UUID,
         event_type: EventType,
         metadata: Optional[Dict[str, Any]] = None,
-        user_context: Optional[Dict[str, Any]] = None
+        user_context: Optional[Dict[str, Any]] = None,
+        rule_set: Optional[RuleSet] = None
     ) -> Dict[str, Any]:
         """
         Procesa un evento aplicando business rules ANTES del procesamiento
         """
-        # 1. Obtener orden actual
-        order = await self.original_service.get_order(order_id)
-        
-        # 2. Crear contexto para reglas PRE-procesamiento
-        context = RuleContext(
-            order=order,
-            event_type=event_type,
-            metadata=metadata,
-            user_context=user_context
-        )
-        
-        # 3. Evaluar reglas de negocio ANTES del procesamiento
-        business_results = self.rule_evaluator.evaluate_business_logic(context)
+        rule_set = rule_set or self.current_rule_set()
         
-        # 4. Procesar evento usando TU servicio original
-        updated_order = await self.original_service.process_event(
-            order_id=order_id,
-            event_type=event_type,
-            metadata=metadata
-        )
-        
-        # 5. Crear tickets de soporte según las reglas
-        tickets_created = []
-        for ticket_data in business_results.get("support_tickets", []):
-            try:
-                from app.repositories.support_repository import support_repository
-                ticket = await support_repository.create_support_ticket(
-                    order_id=order.id,
-                    reason=ticket_data["reason"],
-                    amount=ticket_data["amount"],
-                    metadata=ticket_data["metadata"]
+        # Los eventos de una misma orden se serializan en este worker: la
+        # orden leída, las reglas evaluadas y la escritura corresponden. Si
+        # otro worker cambia la orden entre medio (OrderConflict) se relee y
+        # se vuelven a evaluar las reglas sobre la orden nueva.
+        async with order_locks.hold(order_id):
+            for attempt in range(EVENT_CONFLICT_RETRIES + 1):
+                # 1. Obtener orden actual
+                order = await self.original_service.get_order(order_id)
+
+                # 2. Crear contexto para reglas PRE-procesamiento
+                context = RuleContext(
+                    order=order,
+                    event_type=event_type,
+                    metadata=metadata,
+                    user_context=user_context
                 )
-                tickets_created.append(ticket.id)
-                print(f"🎫 Support ticket created by business rule: {ticket.id}")
-            except Exception as e:
-                print(f"❌ Failed to create support ticket: {e}")
+
+                # 3. Evaluar reglas de negocio ANTES del procesamiento
+                #    (las reglas con I/O de una misma prioridad corren concurrentemente)
+                business_results = await self.rule_evaluator.evaluate_business_logic_async(context, rule_set)
+
+                # 4. Procesar evento usando TU servicio original: la transición, los
+                #    tickets y la metadata de las reglas se escriben de forma atómica
+                try:
+                    transition = await self.original_service.apply_event(
+                        order_id=order_id,
+                        event_type=event_type,
+                        metadata=metadata,
+                        order=order,
+                        extra_support_tickets=business_results.get("support_tickets", []),
+                        extra_metadata_updates=business_results.get("persisted_metadata_updates", {}),
+                    )
+                    break
+                except OrderConflict:
+                    if attempt == EVENT_CONFLICT_RETRIES:
+                        raise
+                    logger.info(
+                        "🔁 Order %s changed concurrently, re-evaluating business rules", order_id,
+                        extra={"order_id": str(order_id)}
+                    )
+
+        shadow_evaluator.shadow_business_logic(context, rule_set)
+        updated_order = transition.order
         
-        # 6. Obtener contexto POST-procesamiento
-        post_context = RuleContext(
-            order=updated_order,
-            user_context=user_context
-        )
+        # 5. Tickets de soporte creados junto con la transición
+        tickets_created = transition.support_ticket_ids or []
         
-        # 7. Obtener eventos permitidos filtrados
-        filtered_events = await self.get_filtered_allowed_events(order_id, user_context)
+        # 6. Contexto POST-procesamiento (reutilizado para filtros y enriquecimiento)
+        post_context = self._build_context(updated_order, user_context)
+        
+        # 7. Obtener eventos permitidos filtrados sobre la orden ya actualizada
+        _, filtered_events = await self._filter_allowed_events(updated_order, post_context, rule_set)
         
         # 8. Enriquecer datos
-        enriched_data = self.rule_evaluator.enrich_order_data(post_context)
+        enriched_data = await self.rule_evaluator.enrich_order_data_async(post_context, rule_set)
         
         return {
             "updated_order": updated_order,
             "business_rules_applied": business_results.get("executed_rules", []),
+            "business_rules_fallbacks": business_results.get("fallback_rules", []),
             "actions_executed": business_results.get("actions", []),
             "tickets_created": tickets_created,
             "filtered_events": filtered_events,
-            "enriched_data": enriched_data
+            "enriched_data": enriched_data,
+            "rule_set_version": rule_set.version
         }
     
     async def get_order_with_business_context(
         self,
         order_id: UUID,
-        user_context: Optional[Dict[str, Any]] = None
+        user_context: Optional[Dict[str, Any]] = None,
+        order: Optional[Order] = None,
+        rule_set: Optional[RuleSet] = None
     ) -> Dict[str, Any]:
         """
-        Obtiene una orden enriquecida con todo el contexto de business rules
+        Obtiene una orden enriquecida con todo el contexto de business rules.
+        La orden se lee una sola vez (o ninguna si el llamador la pasa) y el
+        mismo contexto de reglas se reutiliza en cada paso.
         """
+        rule_set = rule_set or self.current_rule_set()
+        
         # 1. Obtener orden usando TU servicio original
-        order = await self.original_service.get_order(order_id)
+        if order is None:
+            order = await self.original_service.get_order(order_id)
         
-        # 2. Obtener eventos filtrados
-        filtered_events = await self.get_filtered_allowed_events(order_id, user_context)
+        # 2. Contexto para todas las reglas
+        context = self._build_context(order, user_context)
         
-        # 3. Enriquecer datos
-        enriched_data = await self.enrich_order_data(order, user_context)
+        # 3. Obtener eventos base y filtrados
+        base_events, filtered_events = await self._filter_allowed_events(order, context, rule_set)
         
-        # 4. Crear contexto para obtener reglas aplicables
-        context = RuleContext(
-            order=order,
-            user_context=user_context or {}
-        )
+        # 4. Enriquecer datos
+        enriched_data = self.rule_evaluator.enrich_order_data(context, rule_set)
         
-        applicable_rules = self.rule_evaluator.registry.get_applicable_rules(context)
+        # 5. Reglas aplicables
+        applicable_rules = rule_set.get_applicable_rules(context)
         
         return {
             "order": {
@@ -233,9 +298,10 @@ class SainapsisOrderAdapter:
             "flagged_for_review": enriched_data.get("flagged_for_review", False),
             "rule_summary": {
                 "total_applicable_rules": len(applicable_rules),
-                "events_filtered": len(await self.original_service.get_allowed_events(order_id)) - len(filtered_events),
+                "events_filtered": len(base_events) - len(filtered_events),
                 "enrichments_applied": len(enriched_data)
-            }
+            },
+            "rule_set_version": rule_set.version
         }
     
     async def simulate_rules_for_order(
@@ -247,18 +313,16 @@ class SainapsisOrderAdapter:
         Simula la aplicación de reglas sin ejecutarlas realmente
         Útil para testing y preview
         """
+        rule_set = self.current_rule_set()
         order = await self.original_service.get_order(order_id)
         
-        context = RuleContext(
-            order=order,
-            user_context=user_context or {}
-        )
+        context = self._build_context(order, user_context)
         
         # Simular evaluación completa
-        simulation_results = self.rule_evaluator.evaluate_all_rules(context)
+        simulation_results = self.rule_evaluator.evaluate_all_rules(context, rule_set)
         
         # Obtener información de reglas aplicables
-        applicable_rules = self.rule_evaluator.registry.get_applicable_rules(context)
+        applicable_rules = rule_set.get_applicable_rules(context)
         
         return {
             "order_id": str(order_id),
@@ -276,9 +340,29 @@ class SainapsisOrderAdapter:
             ],
             "would_create_tickets": len(simulation_results.get("support_tickets", [])),
             "would_update_metadata": simulation_results.get("metadata_updates", {}),
-            "would_execute_actions": simulation_results.get("actions", [])
+            "would_execute_actions": simulation_results.get("actions", []),
+            "rule_set_version": rule_set.version
         }
 
+    
+    def simulate_rules_batch(
+        self,
+        batch: OrderBatch,
+        include_rows: bool = False,
+        rule_set: Optional[RuleSet] = None
+    ) -> Dict[str, Any]:
+        """
+        Simula el conjunto de reglas sobre un lote de órdenes (vectorizado).
+        Útil para medir el impacto de un cambio de reglas sobre muchas órdenes
+        """
+        rule_set = rule_set or self.current_rule_set()
+        evaluation = batch_rule_evaluator.evaluate(batch, rule_set)
+        
+        result = evaluation.summary()
+        if include_rows:
+            result["rows"] = evaluation.rows()
+        return result
+
 
 # Instancia global del adaptador
 sainapsis_order_adapter = SainapsisOrderAdapter()
\ No newline at end of file
@@ -0,0 +1,471 @@
+# app/business_rules/backtest.py
+
+"""
+Backtest de cambios de reglas sobre el historial de órdenes.
+
+Recorre orders y order_events con un cursor del servidor (por lotes, sin
+cargar todo en memoria), evalúa cada lote con el RuleSet vigente y con uno
+candidato usando el evaluador vectorizado (batch.py) en un pool de procesos,
+y reporta las diferencias en eventos filtrados, tickets y enriquecimientos.
+
+Uso (desde sainapsis-backend/):
+
+    python -m app.business_rules.backtest \\
+        --param sainapsis_small_order_no_verification.threshold=10 \\
+        --since 2025-01-01 --workers 4
+
+    python -m app.business_rules.backtest --candidate nuevas_reglas.yaml --json
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, Mapping, Optional, Set, Tuple, Type
+
+from app.business_rules.base import BaseBusinessRule
+from app.business_rules.batch import (
+    EVENTS,
+    NO_EVENT,
+    BatchEvaluation,
+    OrderBatch,
+    batch_rule_evaluator,
+    mask_to_events,
+)
+from app.business_rules.ruleset import (
+    RuleSet,
+    build_candidate_rule_set,
+    compile_rule_set,
+    load_rule_config,
+)
+from app.core.database import db
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - NumPy es opcional
+    np = None
+
+
+DEFAULT_BATCH_SIZE = 20000
+
+# Procesos del pool para backtests pedidos por HTTP: la evaluación nunca
+# corre en el event loop del servidor
+BACKTEST_WORKERS = max(1, int(os.getenv("BACKTEST_WORKERS", "2")))
+
+# Ejemplos de filas con diferencias incluidos en el reporte
+SAMPLE_LIMIT = 20
+
+# Lotes en vuelo por proceso del pool (acota la memoria del proceso principal)
+IN_FLIGHT_PER_WORKER = 2
+
+# Contexto de cada orden en su estado actual
+ORDERS_QUERY = """
+    SELECT o.id::text AS order_id,
+           NULL::text AS event_type,
+           o.state::text AS state,
+           o.amount::float8 AS amount,
+           o.metadata->>'country_code' AS country_code,
+           EXTRACT(ISODOW FROM o.created_at)::int - 1 AS weekday
+    FROM orders o
+    {where}
+"""
+
+# Contexto de cada evento histórico: estado previo, evento y datos de la orden
+EVENTS_QUERY = """
+    SELECT e.order_id::text AS order_id,
+           e.event_type::text AS event_type,
+           e.old_state::text AS state,
+           o.amount::float8 AS amount,
+           o.metadata->>'country_code' AS country_code,
+           EXTRACT(ISODOW FROM e.created_at)::int - 1 AS weekday
+    FROM order_events e
+    JOIN orders o ON o.id = e.order_id
+    WHERE e.old_state IS NOT NULL {where}
+"""
+
+COLUMNS = ("order_id", "event_type", "state", "amount", "country_code", "weekday")
+
+
+# ============================================================================
+# CATÁLOGO PARA LOS WORKERS
+# ============================================================================
+
+def _rule_set_catalog(
+    catalog: Mapping[str, Type[BaseBusinessRule]], *rule_sets: RuleSet
+) -> Dict[str, Type[BaseBusinessRule]]:
+    """Catálogo con todas las clases usadas por los RuleSets (para los workers)"""
+    merged = dict(catalog)
+    for rule_set in rule_sets:
+        for rule in rule_set.rules:
+            merged.setdefault(type(rule).__name__, type(rule))
+    return merged
+
+
+# ============================================================================
+# EVALUACIÓN DE UN LOTE (corre en los procesos del pool)
+# ============================================================================
+
+_worker_rule_sets: Optional[Tuple[RuleSet, RuleSet]] = None
+
+
+def _init_worker(baseline_config: Dict[str, Any], candidate_config: Dict[str, Any], catalog):
+    """Compilar ambos RuleSets una vez por proceso"""
+    global _worker_rule_sets
+    _worker_rule_sets = (
+        compile_rule_set(baseline_config, catalog, baseline_config["version"], "baseline"),
+        compile_rule_set(candidate_config, catalog, candidate_config["version"], "candidate"),
+    )
+
+
+def _evaluate_chunk(columns: Dict[str, List[Any]]) -> Dict[str, Any]:
+    baseline, candidate = _worker_rule_sets
+    return diff_chunk(columns, baseline, candidate)
+
+
+def _empty_diff() -> Dict[str, Any]:
+    return {
+        "rows": 0,
+        "filtered_events_changed": 0,
+        "events_removed": {},
+        "events_added": {},
+        "taken_events_blocked": 0,
+        "tickets": {"baseline": 0, "candidate": 0, "rows_changed": 0},
+        "tickets_by_rule": {},
+        "enrichments_by_rule": {},
+        "enrichment_rows_changed": 0,
+        "samples": [],
+    }
+
+
+def _count_by_rule(target: Dict[str, Dict[str, int]], side: str, masks: Dict[str, Any]):
+    for rule_id, mask in masks.items():
+        counts = target.setdefault(rule_id, {"baseline": 0, "candidate": 0})
+        counts[side] += int(np.count_nonzero(mask))
+
+
+def diff_chunk(columns: Dict[str, List[Any]], baseline: RuleSet, candidate: RuleSet) -> Dict[str, Any]:
+    """Diferencias entre baseline y candidate para un lote de filas"""
+    batch = OrderBatch.from_columns(
+        columns["amount"],
+        columns["state"],
+        columns["event_type"],
+        columns["country_code"],
+        columns["weekday"],
+    )
+    before = batch_rule_evaluator.evaluate(batch, baseline)
+    after = batch_rule_evaluator.evaluate(batch, candidate)
+
+    diff = _empty_diff()
+    diff["rows"] = batch.size
+
+    # Eventos filtrados
+    changed_events = before.filtered_events != after.filtered_events
+    diff["filtered_events_changed"] = int(np.count_nonzero(changed_events))
+    for code, event in enumerate(EVENTS):
+        bit = np.int64(1 << code)
+        in_before = (before.filtered_events & bit) != 0
+        in_after = (after.filtered_events & bit) != 0
+        removed = int(np.count_nonzero(in_before & ~in_after))
+        added = int(np.count_nonzero(~in_before & in_after))
+        if removed:
+            diff["events_removed"][event.value] = removed
+        if added:
+            diff["events_added"][event.value] = added
+
+    # Eventos que realmente ocurrieron y el candidato ya no ofrecería
+    taken = batch.event != NO_EVENT
+    taken_bits = np.where(taken, np.left_shift(np.int64(1), batch.event.astype(np.int64)), 0)
+    blocked = (
+        taken &
+        ((before.filtered_events & taken_bits) != 0) &
+        ((after.filtered_events & taken_bits) == 0)
+    )
+    diff["taken_events_blocked"] = int(np.count_nonzero(blocked))
+
+    # Tickets
+    changed_tickets = before.ticket_count != after.ticket_count
+    diff["tickets"] = {
+        "baseline": int(before.ticket_count.sum()),
+        "candidate": int(after.ticket_count.sum()),
+        "rows_changed": int(np.count_nonzero(changed_tickets)),
+    }
+    _count_by_rule(diff["tickets_by_rule"], "baseline", before.tickets)
+    _count_by_rule(diff["tickets_by_rule"], "candidate", after.tickets)
+
+    # Enriquecimientos
+    _count_by_rule(diff["enrichments_by_rule"], "baseline", before.enrichments)
+    _count_by_rule(diff["enrichments_by_rule"], "candidate", after.enrichments)
+    changed_enrichments = _enrichment_sets(before) != _enrichment_sets(after)
+    diff["enrichment_rows_changed"] = int(np.count_nonzero(changed_enrichments))
+
+    # Ejemplos
+    changed = changed_events | changed_tickets | changed_enrichments
+    for row in np.flatnonzero(changed)[:SAMPLE_LIMIT]:
+        row = int(row)
+        diff["samples"].append({
+            "order_id": columns["order_id"][row],
+            "event_type": columns["event_type"][row],
+            "state": columns["state"][row],
+            "amount": columns["amount"][row],
+            "country_code": columns["country_code"][row],
+            "baseline_events": [e.value for e in mask_to_events(int(before.filtered_events[row]))],
+            "candidate_events": [e.value for e in mask_to_events(int(after.filtered_events[row]))],
+            "baseline_tickets": [r for r, mask in before.tickets.items() if mask[row]],
+            "candidate_tickets": [r for r, mask in after.tickets.items() if mask[row]],
+            "baseline_enrichments": [r for r, mask in before.enrichments.items() if mask[row]],
+            "candidate_enrichments": [r for r, mask in after.enrichments.items() if mask[row]],
+        })
+
+    return diff
+
+
+def _enrichment_sets(evaluation: BatchEvaluation):
+    """Reglas de enriquecimiento aplicadas por fila, como arreglo de strings"""
+    labels = np.full(evaluation.size, "", dtype=object)
+    for rule_id in sorted(evaluation.enrichments):
+        mask = evaluation.enrichments[rule_id]
+        labels[mask] = labels[mask] + rule_id + ","
+    return labels
+
+
+def merge_diff(total: Dict[str, Any], diff: Dict[str, Any]):
+    """Acumular el diff de un lote en el total"""
+    total["rows"] += diff["rows"]
+    total["filtered_events_changed"] += diff["filtered_events_changed"]
+    total["taken_events_blocked"] += diff["taken_events_blocked"]
+    total["enrichment_rows_changed"] += diff["enrichment_rows_changed"]
+    for key in ("events_removed", "events_added"):
+        for event, count in diff[key].items():
+            total[key][event] = total[key].get(event, 0) + count
+    for key in ("baseline", "candidate", "rows_changed"):
+        total["tickets"][key] += diff["tickets"][key]
+    for key in ("tickets_by_rule", "enrichments_by_rule"):
+        for rule_id, counts in diff[key].items():
+            target = total[key].setdefault(rule_id, {"baseline": 0, "candidate": 0})
+            target["baseline"] += counts["baseline"]
+            target["candidate"] += counts["candidate"]
+    room = SAMPLE_LIMIT - len(total["samples"])
+    if room > 0:
+        total["samples"].extend(diff["samples"][:room])
+
+
+# ============================================================================
+# STREAMING DESDE POSTGRES
+# ============================================================================
+
+def _time_filter(column: str, since: Optional[datetime], until: Optional[datetime], args: List[Any], prefix: str) -> str:
+    conditions = []
+    if since is not None:
+        args.append(since)
+        conditions.append(f"{column} >= ${len(args)}")
+    if until is not None:
+        args.append(until)
+        conditions.append(f"{column} < ${len(args)}")
+    if not conditions:
+        return ""
+    return f"{prefix} {' AND '.join(conditions)}"
+
+
+def _columns(rows) -> Dict[str, List[Any]]:
+    return {name: [row[index] for row in rows] for index, name in enumerate(COLUMNS)}
+
+
+class BacktestRunner:
+    """Recorre el historial por lotes y acumula las diferencias"""
+
+    def __init__(
+        self,
+        baseline: RuleSet,
+        candidate: RuleSet,
+        catalog: Mapping[str, Type[BaseBusinessRule]],
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        workers: int = 0,
+    ):
+        self.baseline = baseline
+        self.candidate = candidate
+        self.catalog = _rule_set_catalog(catalog, baseline, candidate)
+        self.batch_size = batch_size
+        self.workers = workers
+
+    async def run(self, since: Optional[datetime] = None, until: Optional[datetime] = None) -> Dict[str, Any]:
+        """Ejecutar el backtest; retorna el reporte"""
+        if np is None:
+            raise RuntimeError("NumPy is required for rule backtests")
+
+        started = time.perf_counter()
+        pool = None
+        if self.workers > 0:
+            pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                # spawn: los procesos no heredan el event loop ni las conexiones
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.baseline.to_config(), self.candidate.to_config(), self.catalog),
+            )
+
+        report = {"orders": _empty_diff(), "events": _empty_diff()}
+        try:
+            async with db.connection() as conn:
+                # Una sola foto consistente para ambas fases
+                async with conn.transaction(isolation="repeatable_read", readonly=True):
+                    args: List[Any] = []
+                    where = _time_filter("o.created_at", since, until, args, "WHERE")
+                    await self._stream(conn, ORDERS_QUERY.format(where=where), args, report["orders"], pool)
+
+                    args = []
+                    where = _time_filter("e.created_at", since, until, args, "AND")
+                    await self._stream(conn, EVENTS_QUERY.format(where=where), args, report["events"], pool)
+        finally:
+            if pool is not None:
+                pool.shutdown(wait=True)
+
+        return {
+            "baseline_version": self.baseline.version,
+            "candidate": self.candidate.to_config(),
+            "since": since.isoformat() if since else None,
+            "until": until.isoformat() if until else None,
+            "batch_size": self.batch_size,
+            "workers": self.workers,
+            "elapsed_seconds": round(time.perf_counter() - started, 3),
+            **report,
+        }
+
+    async def _stream(self, conn, query: str, args: List[Any], total: Dict[str, Any], pool):
+        loop = asyncio.get_running_loop()
+        pending: Set[asyncio.Future] = set()
+        max_in_flight = max(1, self.workers * IN_FLIGHT_PER_WORKER)
+
+        async def drain(until_below: int):
+            nonlocal pending
+            while len(pending) >= until_below and pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    merge_diff(total, future.result())
+
+        cursor = await conn.cursor(query, *args)
+        while True:
+            rows = await cursor.fetch(self.batch_size)
+            if not rows:
+                break
+            columns = _columns(rows)
+
+            if pool is None:
+                merge_diff(total, diff_chunk(columns, self.baseline, self.candidate))
+                continue
+
+            await drain(max_in_flight)
+            pending.add(loop.run_in_executor(pool, _evaluate_chunk, columns))
+
+        await drain(1)
+
+
+async def run_backtest(
+    baseline: RuleSet,
+    candidate: RuleSet,
+    catalog: Mapping[str, Type[BaseBusinessRule]],
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    workers: int = 0,
+) -> Dict[str, Any]:
+    """Comparar baseline y candidate sobre el historial"""
+    runner = BacktestRunner(baseline, candidate, catalog, batch_size, workers)
+    return await runner.run(since, until)
+
+
+# ============================================================================
+# CLI
+# ============================================================================
+
+def _parse_param(spec: str) -> Tuple[str, str, Any]:
+    """'rule_id.param=valor' -> (rule_id, param, valor)"""
+    try:
+        target, raw_value = spec.split("=", 1)
+        rule_id, name = target.rsplit(".", 1)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Expected rule_id.param=value, got '{spec}'")
+    try:
+        value = json.loads(raw_value)
+    except ValueError:
+        value = raw_value
+    return rule_id, name, value
+
+
+def _print_phase(name: str, diff: Dict[str, Any]):
+    print(f"\n📊 {name}: {diff['rows']} rows")
+    print(f"   🔧 Filtered events changed: {diff['filtered_events_changed']}")
+    for event, count in sorted(diff["events_removed"].items()):
+        print(f"      - {event}: removed in {count}")
+    for event, count in sorted(diff["events_added"].items()):
+        print(f"      + {event}: added in {count}")
+    if diff["taken_events_blocked"]:
+        print(f"   🚫 Events taken that the candidate would not offer: {diff['taken_events_blocked']}")
+    tickets = diff["tickets"]
+    print(
+        f"   🎫 Tickets: {tickets['baseline']} -> {tickets['candidate']} "
+        f"({tickets['rows_changed']} rows changed)"
+    )
+    print(f"   ✨ Enrichment rows changed: {diff['enrichment_rows_changed']}")
+
+
+async def main(args):
+    from app.business_rules import business_rule_registry
+
+    baseline = business_rule_registry.current()
+    params: Dict[str, Dict[str, Any]] = {}
+    for rule_id, name, value in args.param:
+        params.setdefault(rule_id, {})[name] = value
+    enabled = {rule_id: True for rule_id in args.enable}
+    enabled.update({rule_id: False for rule_id in args.disable})
+
+    candidate = build_candidate_rule_set(
+        baseline,
+        business_rule_registry.rule_catalog,
+        config=load_rule_config(args.candidate) if args.candidate else None,
+        params=params,
+        enabled=enabled,
+    )
+
+    await db.connect()
+    try:
+        report = await run_backtest(
+            baseline,
+            candidate,
+            business_rule_registry.rule_catalog,
+            since=args.since,
+            until=args.until,
+            batch_size=args.batch_size,
+            workers=args.workers,
+        )
+    finally:
+        await db.disconnect()
+
+    if args.json:
+        print(json.dumps(report, indent=2, default=str))
+        return
+
+    print(f"\n🧪 Backtest: rule set v{baseline.version} vs candidate ({report['elapsed_seconds']}s)")
+    _print_phase("Orders (current state)", report["orders"])
+    _print_phase("Order events (state before each event)", report["events"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--candidate", help="Rule config (YAML/JSON) for the candidate rule set")
+    parser.add_argument(
+        "--param", type=_parse_param, action="append", default=[],
+        help="Override a rule param on the current rule set: rule_id.param=value"
+    )
+    parser.add_argument("--enable", action="append", default=[], help="Enable a rule in the candidate")
+    parser.add_argument("--disable", action="append", default=[], help="Disable a rule in the candidate")
+    parser.add_argument("--since", type=datetime.fromisoformat)
+    parser.add_argument("--until", type=datetime.fromisoformat)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--json", action="store_true", help="Print the full report as JSON")
+
+    asyncio.run(main(parser.parse_args()))
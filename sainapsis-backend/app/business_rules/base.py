@@ -4,13 +4,14 @@
 Clases base para el sistema de reglas de negocio de Sainapsis.
 """
 
+import copy
 from abc import ABC, abstractmethod
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, FrozenSet, Tuple
 from enum import Enum
 from dataclasses import dataclass
 from uuid import UUID
 
-from app.models.domain import Order, EventType
+from app.models.domain import Order, EventType, OrderState
 
 
 class RuleType(Enum):
@@ -49,6 +50,17 @@ class RuleContext:
         return None
 
 
+@dataclass(frozen=True)
+class BatchEffect:
+    """
+    Efecto de una regla expresable sobre un lote de órdenes (ver batch.py):
+    eventos que quita/agrega un filtro y si una regla de lógica crea ticket
+    """
+    remove_events: FrozenSet[EventType] = frozenset()
+    add_events: FrozenSet[EventType] = frozenset()
+    creates_ticket: bool = False
+
+
 @dataclass
 class RuleResult:
     """Resultado de la ejecución de una regla"""
@@ -71,7 +83,26 @@ class RuleResult:
 
 
 class BaseBusinessRule(ABC):
-    """Clase base para todas las reglas de negocio"""
+    """
+    Clase base para todas las reglas de negocio
+
+    applicable_states / applicable_events declaran en qué estados de orden y
+    con qué eventos puede aplicar la regla (None = cualquiera). El registro
+    los usa para indexar la regla; applies_to solo se evalúa sobre las reglas
+    candidatas para el (estado, evento) del contexto.
+
+    memo_inputs declara qué más lee la regla del contexto ("amount",
+    "country", "weekday"); None = desconocido, y el filtrado de eventos en el
+    que participe no se memoiza.
+
+    persist_metadata: los metadata_updates de la regla se guardan en la orden
+    junto con la transición (v2). Por defecto solo se reportan en la respuesta.
+    """
+    
+    applicable_states: Optional[FrozenSet[OrderState]] = None
+    applicable_events: Optional[FrozenSet[EventType]] = None
+    memo_inputs: Optional[FrozenSet[str]] = None
+    persist_metadata: bool = False
     
     def __init__(self, rule_id: str, description: str, rule_type: RuleType, priority: RulePriority = RulePriority.MEDIUM):
         self.rule_id = rule_id
@@ -80,6 +111,54 @@ class BaseBusinessRule(ABC):
         self.priority = priority
         self.enabled = True
     
+    def __setattr__(self, name: str, value: Any):
+        # Las reglas publicadas en un RuleSet son inmutables
+        if self.__dict__.get("_frozen", False):
+            raise AttributeError(
+                f"Rule '{self.rule_id}' belongs to a published rule set; "
+                "use the registry to derive a new version"
+            )
+        super().__setattr__(name, value)
+    
+    def freeze(self):
+        """Congelar la regla (la llama RuleSet al publicarla)"""
+        object.__setattr__(self, "_frozen", True)
+    
+    def clone(self) -> "BaseBusinessRule":
+        """Copia modificable de la regla"""
+        rule = copy.copy(self)
+        object.__setattr__(rule, "_frozen", False)
+        return rule
+    
+    def config_params(self) -> Dict[str, Any]:
+        """Parámetros del constructor, para reconstruir la regla desde configuración"""
+        return {}
+    
+    def amount_breakpoints(self) -> Tuple[float, ...]:
+        """Umbrales de monto en los que cambia la decisión de la regla"""
+        return ()
+    
+    def batch_applies(self, batch) -> Optional[Any]:
+        """
+        applies_to vectorizado sobre un OrderBatch (máscara booleana).
+        Estado y evento ya los filtra el evaluador; None = evaluar fila por fila
+        """
+        return None
+    
+    def batch_effect(self) -> Optional[BatchEffect]:
+        """Efecto de la regla en lote; None = ejecutar fila por fila"""
+        return None
+    
+    def config_entry(self) -> Dict[str, Any]:
+        """Entrada de configuración equivalente (formato de compile_rule_set)"""
+        entry: Dict[str, Any] = {"rule": type(self).__name__}
+        params = self.config_params()
+        if params:
+            entry["params"] = params
+        if not self.is_enabled():
+            entry["enabled"] = False
+        return entry
+    
     @abstractmethod
     def applies_to(self, context: RuleContext) -> bool:
         """Determina si esta regla aplica al contexto dado"""
@@ -136,9 +215,56 @@ class EnrichmentRule(BaseBusinessRule):
         super().__init__(rule_id, description, RuleType.ENRICHMENT, priority)
 
 
+class AsyncBusinessRule(BaseBusinessRule):
+    """
+    Clase base para reglas que necesitan I/O (consultas a la base de datos,
+    servicios externos).
+
+    El evaluador asíncrono ejecuta concurrentemente las reglas de una misma
+    prioridad, cada una con `timeout` segundos y dentro del plazo total de la
+    evaluación; si vence o falla, se usa fallback_result. Los caminos
+    síncronos (preview, simulación, lotes, backtest) no pueden esperar I/O:
+    el evaluador síncrono las omite (skipped_rules) y los lotes usan su
+    batch_effect o las omiten.
+    """
+    
+    # Tiempo máximo de execute_async (segundos)
+    timeout: float = 0.2
+    
+    def __init__(
+        self,
+        rule_id: str,
+        description: str,
+        rule_type: RuleType,
+        priority: RulePriority = RulePriority.MEDIUM,
+        timeout: Optional[float] = None
+    ):
+        super().__init__(rule_id, description, rule_type, priority)
+        if timeout is not None:
+            self.timeout = timeout
+    
+    @abstractmethod
+    async def execute_async(self, context: RuleContext) -> RuleResult:
+        """Ejecuta la regla (con I/O) y retorna el resultado"""
+        pass
+    
+    def fallback_result(self, context: RuleContext, reason: str) -> RuleResult:
+        """Resultado cuando execute_async no termina a tiempo o falla"""
+        return RuleResult(success=False, error_message=f"Fallback: {reason}")
+    
+    def execute(self, context: RuleContext) -> RuleResult:
+        """Llamada directa sin event loop: se usa fallback_result"""
+        return self.fallback_result(context, "evaluated synchronously")
+
+
 class BusinessRuleException(Exception):
     """Excepción para reglas de negocio"""
     
     def __init__(self, rule_id: str, message: str):
         self.rule_id = rule_id
-        super().__init__(f"Business rule '{rule_id}' failed: {message}")
\ No newline at end of file
+        super().__init__(f"Business rule '{rule_id}' failed: {message}")
+
+
+class RuleSetConfigError(Exception):
+    """Configuración de reglas inválida: el RuleSet actual no se modifica"""
+    pass
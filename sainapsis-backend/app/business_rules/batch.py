@@ -0,0 +1,438 @@
+# app/business_rules/batch.py
+
+"""
+Evaluación de reglas en lote con NumPy.
+
+Un OrderBatch guarda las órdenes por columnas (monto, código de estado,
+código de evento, código de país, día de la semana). Las reglas que
+implementan batch_applies/batch_effect se evalúan como máscaras vectorizadas
+sobre todas las filas a la vez; las demás se evalúan fila por fila solo
+sobre las filas candidatas para su (estado, evento).
+
+Los eventos se representan como bitmask: el bit i corresponde a
+list(EventType)[i].
+"""
+
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+from uuid import UUID
+
+from app.business_rules.base import AsyncBusinessRule, RuleContext, RuleType
+from app.business_rules.ruleset import RuleSet
+from app.models.domain import EventType, Order, OrderState
+from app.services.state_machine import StateMachine
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - NumPy es opcional
+    np = None
+
+
+STATES: List[OrderState] = list(OrderState)
+EVENTS: List[EventType] = list(EventType)
+STATE_CODES: Dict[OrderState, int] = {state: code for code, state in enumerate(STATES)}
+EVENT_CODES: Dict[EventType, int] = {event: code for code, event in enumerate(EVENTS)}
+
+# Código para "sin evento" / "país desconocido"
+NO_EVENT = -1
+UNKNOWN_COUNTRY = -1
+
+
+class BatchUnavailable(Exception):
+    """NumPy no está instalado"""
+    pass
+
+
+def _require_numpy():
+    if np is None:
+        raise BatchUnavailable("NumPy is required for batch rule evaluation")
+
+
+def events_to_mask(events: Iterable[EventType]) -> int:
+    """Lista de eventos -> bitmask"""
+    mask = 0
+    for event in events:
+        mask |= 1 << EVENT_CODES[event]
+    return mask
+
+
+def mask_to_events(mask: int) -> List[EventType]:
+    """Bitmask -> lista de eventos (en el orden de EventType)"""
+    return [event for code, event in enumerate(EVENTS) if (mask >> code) & 1]
+
+
+class OrderBatch:
+    """Órdenes en columnas para evaluar reglas de forma vectorizada"""
+
+    def __init__(
+        self,
+        amount: Sequence[float],
+        state: Sequence[int],
+        event: Optional[Sequence[int]] = None,
+        country: Optional[Sequence[int]] = None,
+        countries: Sequence[str] = (),
+        weekday: Optional[Sequence[int]] = None,
+    ):
+        """
+        amount/state/event/country son columnas de igual largo; state y event
+        usan STATE_CODES/EVENT_CODES y country es el índice en countries.
+        weekday (0=lunes) por defecto es el día actual (UTC), como en las
+        reglas de fin de semana.
+        """
+        _require_numpy()
+        self.amount = np.asarray(amount, dtype=np.float64)
+        self.size = len(self.amount)
+        self.state = np.asarray(state, dtype=np.int16)
+        self.event = (
+            np.asarray(event, dtype=np.int16) if event is not None
+            else np.full(self.size, NO_EVENT, dtype=np.int16)
+        )
+        self.country = (
+            np.asarray(country, dtype=np.int32) if country is not None
+            else np.full(self.size, UNKNOWN_COUNTRY, dtype=np.int32)
+        )
+        self.countries = tuple(countries)
+        self._country_codes = {code: index for index, code in enumerate(self.countries)}
+        self.weekday = (
+            np.asarray(weekday, dtype=np.int8) if weekday is not None
+            else np.full(self.size, datetime.utcnow().weekday(), dtype=np.int8)
+        )
+
+        for name in ("state", "event", "country", "weekday"):
+            if len(getattr(self, name)) != self.size:
+                raise ValueError(f"Column '{name}' must have {self.size} rows")
+
+    @classmethod
+    def from_columns(
+        cls,
+        amount: Sequence[float],
+        state: Sequence[Any],
+        event_type: Optional[Sequence[Any]] = None,
+        country_code: Optional[Sequence[Optional[str]]] = None,
+        weekday: Optional[Sequence[Optional[int]]] = None,
+    ) -> "OrderBatch":
+        """
+        Construir desde columnas con valores del dominio (estados y eventos
+        como enum o string, país como código ISO, None = sin evento/país)
+        """
+        # Los enums son str: el mismo dict resuelve el enum o su valor
+        try:
+            state_codes = [STATE_CODES[value] for value in state]
+            event_codes = None
+            if event_type is not None:
+                event_codes = [EVENT_CODES[value] if value else NO_EVENT for value in event_type]
+        except KeyError as e:
+            raise ValueError(f"Unknown state or event type {e}")
+
+        country_index = None
+        countries: Dict[str, int] = {}
+        if country_code is not None:
+            country_index = [
+                countries.setdefault(code, len(countries)) if code else UNKNOWN_COUNTRY
+                for code in country_code
+            ]
+
+        if weekday is not None:
+            today = datetime.utcnow().weekday()
+            weekday = [today if day is None else int(day) for day in weekday]
+
+        return cls(amount, state_codes, event_codes, country_index, list(countries), weekday)
+
+    @classmethod
+    def from_records(cls, records: Iterable[Dict[str, Any]]) -> "OrderBatch":
+        """
+        Construir desde dicts con amount, state, event_type (opcional),
+        country_code (opcional) y weekday (opcional)
+        """
+        records = list(records)
+        weekday = [record.get("weekday") for record in records]
+        return cls.from_columns(
+            [float(record["amount"]) for record in records],
+            [record["state"] for record in records],
+            [record.get("event_type") for record in records],
+            [record.get("country_code") for record in records],
+            weekday if any(day is not None for day in weekday) else None,
+        )
+
+    @classmethod
+    def from_orders(
+        cls,
+        orders: Sequence[Order],
+        event_type: Optional[EventType] = None,
+        user_context: Optional[Dict[str, Any]] = None,
+    ) -> "OrderBatch":
+        """Construir desde órdenes del dominio (país como en RuleContext)"""
+        records = []
+        for order in orders:
+            context = RuleContext(order=order, user_context=user_context)
+            records.append({
+                "amount": order.amount,
+                "state": order.state,
+                "event_type": event_type,
+                "country_code": context.get_country_code(),
+            })
+        return cls.from_records(records)
+
+    # ------------------------------------------------------------------
+    # Predicados vectorizados (los usan las reglas en batch_applies)
+    # ------------------------------------------------------------------
+
+    def all_rows(self):
+        return np.ones(self.size, dtype=bool)
+
+    def state_in(self, states: Iterable[OrderState]):
+        return np.isin(self.state, [STATE_CODES[state] for state in states])
+
+    def event_in(self, events: Iterable[Optional[EventType]]):
+        codes = [NO_EVENT if event is None else EVENT_CODES[event] for event in events]
+        return np.isin(self.event, codes)
+
+    def country_in(self, country_codes: Iterable[str]):
+        codes = [self._country_codes[c] for c in country_codes if c in self._country_codes]
+        return np.isin(self.country, codes)
+
+    def amount_compare(self, operator: str, value: float):
+        if operator == "gt":
+            return self.amount > value
+        if operator == "gte":
+            return self.amount >= value
+        if operator == "lt":
+            return self.amount < value
+        if operator == "lte":
+            return self.amount <= value
+        raise ValueError(f"Unknown amount operator '{operator}'")
+
+    def amount_in_bands(self, bands, band_mask: int):
+        """Filas cuyo tramo de monto (AmountBands de dsl.py) está en band_mask"""
+        points = np.asarray(bands.breakpoints, dtype=np.float64)
+        index = np.searchsorted(points, self.amount, side="left")
+        exact = np.zeros(self.size, dtype=bool)
+        inside = index < len(points)
+        exact[inside] = points[index[inside]] == self.amount[inside]
+        band = 2 * index + exact
+        lookup = np.array([(band_mask >> b) & 1 for b in range(bands.count)], dtype=bool)
+        return lookup[band]
+
+    def is_weekend(self):
+        return self.weekday >= 5
+
+    def without_events(self) -> "OrderBatch":
+        """Mismo lote sin evento (contexto del filtrado de eventos)"""
+        batch = object.__new__(OrderBatch)
+        batch.__dict__.update(self.__dict__)
+        batch.event = np.full(self.size, NO_EVENT, dtype=np.int16)
+        return batch
+
+    # ------------------------------------------------------------------
+    # Evaluación fila por fila (reglas no vectorizables)
+    # ------------------------------------------------------------------
+
+    def context(self, row: int) -> RuleContext:
+        """RuleContext equivalente a una fila"""
+        now = datetime.utcnow()
+        country_code = int(self.country[row])
+        metadata = {"country_code": self.countries[country_code]} if country_code != UNKNOWN_COUNTRY else {}
+        event_code = int(self.event[row])
+        order = Order(
+            id=UUID(int=row),
+            product_ids=[],
+            amount=float(self.amount[row]),
+            state=STATES[int(self.state[row])],
+            metadata=metadata,
+            created_at=now,
+            updated_at=now,
+        )
+        return RuleContext(
+            order=order,
+            event_type=EVENTS[event_code] if event_code != NO_EVENT else None,
+            metadata={},
+            user_context={}
+        )
+
+
+@dataclass
+class BatchEvaluation:
+    """Resultado de evaluar un RuleSet sobre un OrderBatch"""
+    rule_set_version: int
+    size: int
+    base_events: Any                      # int64[size], bitmask de la máquina de estados
+    filtered_events: Any                  # int64[size], bitmask tras las reglas de filtro
+    ticket_count: Any                     # int32[size]
+    applied: Dict[str, Any] = field(default_factory=dict)      # rule_id -> bool[size]
+    tickets: Dict[str, Any] = field(default_factory=dict)      # rule_id -> bool[size]
+    enrichments: Dict[str, Any] = field(default_factory=dict)  # rule_id -> bool[size]
+    row_by_row_rules: List[str] = field(default_factory=list)
+    skipped_rules: List[str] = field(default_factory=list)   # asíncronas sin batch_effect
+    errors: Dict[str, int] = field(default_factory=dict)
+
+    def filtered_events_at(self, row: int) -> List[EventType]:
+        return mask_to_events(int(self.filtered_events[row]))
+
+    def summary(self) -> Dict[str, Any]:
+        """Conteos agregados (serializable a JSON)"""
+        changed = self.base_events != self.filtered_events
+        removed_by_event = {}
+        added_by_event = {}
+        for code, event in enumerate(EVENTS):
+            bit = np.int64(1 << code)
+            in_base = (self.base_events & bit) != 0
+            in_filtered = (self.filtered_events & bit) != 0
+            removed = int(np.count_nonzero(in_base & ~in_filtered))
+            added = int(np.count_nonzero(~in_base & in_filtered))
+            if removed:
+                removed_by_event[event.value] = removed
+            if added:
+                added_by_event[event.value] = added
+
+        return {
+            "rule_set_version": self.rule_set_version,
+            "orders": self.size,
+            "orders_with_filtered_events": int(np.count_nonzero(changed)),
+            "events_removed": removed_by_event,
+            "events_added": added_by_event,
+            "orders_with_tickets": int(np.count_nonzero(self.ticket_count)),
+            "tickets_total": int(self.ticket_count.sum()),
+            "rules_applied": {rule_id: int(np.count_nonzero(mask)) for rule_id, mask in self.applied.items()},
+            "tickets_by_rule": {rule_id: int(np.count_nonzero(mask)) for rule_id, mask in self.tickets.items()},
+            "enrichments_by_rule": {rule_id: int(np.count_nonzero(mask)) for rule_id, mask in self.enrichments.items()},
+            "row_by_row_rules": self.row_by_row_rules,
+            "skipped_rules": self.skipped_rules,
+            "errors": self.errors,
+        }
+
+    def rows(self) -> List[Dict[str, Any]]:
+        """Resultado por orden (serializable a JSON)"""
+        return [
+            {
+                "filtered_events": [event.value for event in self.filtered_events_at(row)],
+                "tickets": [rule_id for rule_id, mask in self.tickets.items() if mask[row]],
+                "enrichments": [rule_id for rule_id, mask in self.enrichments.items() if mask[row]],
+            }
+            for row in range(self.size)
+        ]
+
+
+class BatchRuleEvaluator:
+    """Evalúa un RuleSet completo sobre muchas órdenes a la vez"""
+
+    def __init__(self):
+        # Eventos permitidos por estado, como bitmask indexado por código de
+        # estado, por versión de la máquina de estados
+        self._allowed_by_state: Dict[int, Any] = {}
+
+    def _allowed_events_table(self):
+        machine = StateMachine.current()
+        table = self._allowed_by_state.get(machine.version)
+        if table is None:
+            table = self._allowed_by_state[machine.version] = np.array(
+                [events_to_mask(machine.get_allowed_events(state)) for state in STATES],
+                dtype=np.int64
+            )
+        return table
+
+    def _applies(self, rule, batch: OrderBatch, evaluation: BatchEvaluation):
+        """Máscara de filas a las que aplica la regla"""
+        candidates = batch.all_rows()
+        if rule.applicable_states is not None:
+            candidates &= batch.state_in(rule.applicable_states)
+        if rule.applicable_events is not None:
+            candidates &= batch.event_in(rule.applicable_events)
+
+        vectorized = rule.batch_applies(batch)
+        if vectorized is not None:
+            return candidates & vectorized
+
+        # Fila por fila, solo sobre las candidatas
+        self._mark_row_by_row(rule, evaluation)
+        mask = np.zeros(batch.size, dtype=bool)
+        for row in np.flatnonzero(candidates):
+            try:
+                mask[row] = rule.applies_to(batch.context(int(row)))
+            except Exception:
+                evaluation.errors[rule.rule_id] = evaluation.errors.get(rule.rule_id, 0) + 1
+        return mask
+
+    def _mark_row_by_row(self, rule, evaluation: BatchEvaluation):
+        if rule.rule_id not in evaluation.row_by_row_rules:
+            evaluation.row_by_row_rules.append(rule.rule_id)
+
+    def evaluate(self, batch: OrderBatch, rule_set: RuleSet) -> BatchEvaluation:
+        """Evaluar todas las reglas habilitadas de rule_set sobre el lote"""
+        _require_numpy()
+
+        base_events = self._allowed_events_table()[batch.state]
+        evaluation = BatchEvaluation(
+            rule_set_version=rule_set.version,
+            size=batch.size,
+            base_events=base_events,
+            filtered_events=base_events.copy(),
+            ticket_count=np.zeros(batch.size, dtype=np.int32),
+        )
+
+        # Mismo orden que la tabla de despacho: prioridad y luego declaración
+        rules = sorted(rule_set.get_all_rules(), key=lambda r: r.priority.value)
+        filter_batch = batch.without_events()
+
+        for rule in rules:
+            if rule.rule_type == RuleType.EVENT_FILTER:
+                applies = self._applies(rule, filter_batch, evaluation)
+                self._apply_filter(rule, applies, filter_batch, evaluation)
+            else:
+                applies = self._applies(rule, batch, evaluation)
+                if rule.rule_type == RuleType.BUSINESS_LOGIC:
+                    self._apply_business_logic(rule, applies, batch, evaluation)
+                elif rule.rule_type == RuleType.ENRICHMENT:
+                    evaluation.enrichments[rule.rule_id] = applies
+            evaluation.applied[rule.rule_id] = applies
+
+        return evaluation
+
+    def _apply_filter(self, rule, applies, batch: OrderBatch, evaluation: BatchEvaluation):
+        effect = rule.batch_effect()
+        events = evaluation.filtered_events
+
+        if effect is not None:
+            remove = np.int64(events_to_mask(effect.remove_events))
+            add = np.int64(events_to_mask(effect.add_events))
+            events[applies] = (events[applies] & ~remove) | add
+            return
+
+        self._mark_row_by_row(rule, evaluation)
+        for row in np.flatnonzero(applies):
+            try:
+                filtered = rule.filter_events(mask_to_events(int(events[row])), batch.context(int(row)))
+                events[row] = events_to_mask(filtered)
+            except Exception:
+                evaluation.errors[rule.rule_id] = evaluation.errors.get(rule.rule_id, 0) + 1
+
+    def _apply_business_logic(self, rule, applies, batch: OrderBatch, evaluation: BatchEvaluation):
+        effect = rule.batch_effect()
+
+        if effect is not None:
+            tickets = applies if effect.creates_ticket else np.zeros(batch.size, dtype=bool)
+            evaluation.ticket_count += tickets
+        elif isinstance(rule, AsyncBusinessRule):
+            # Necesita I/O y no declara su efecto: no se puede evaluar en lote
+            if rule.rule_id not in evaluation.skipped_rules:
+                evaluation.skipped_rules.append(rule.rule_id)
+            return
+        else:
+            self._mark_row_by_row(rule, evaluation)
+            tickets = np.zeros(batch.size, dtype=bool)
+            for row in np.flatnonzero(applies):
+                try:
+                    result = rule.execute(batch.context(int(row)))
+                except Exception:
+                    evaluation.errors[rule.rule_id] = evaluation.errors.get(rule.rule_id, 0) + 1
+                    continue
+                if result.success and result.support_tickets:
+                    tickets[row] = True
+                    evaluation.ticket_count[row] += len(result.support_tickets)
+
+        if tickets.any() or (effect is not None and effect.creates_ticket):
+            evaluation.tickets[rule.rule_id] = tickets
+
+
+# Instancia global
+batch_rule_evaluator = BatchRuleEvaluator()
@@ -0,0 +1,364 @@
+# app/business_rules/dsl.py
+
+"""
+Reglas declarativas (YAML/JSON) compiladas a predicados.
+
+Una regla DSL describe condiciones de estado, evento, país y monto y el efecto
+a aplicar. Se compila una sola vez al construirse:
+
+- estados/eventos se declaran en applicable_states/applicable_events, así que
+  el registro las indexa sin evaluarlas;
+- los umbrales de monto de la regla (condición y tramos) se fusionan en un
+  arreglo ordenado de breakpoints: el tramo del monto se obtiene con bisect
+  en O(log n) y cada condición es una máscara de bits sobre los tramos.
+
+Ejemplo:
+
+    - id: sainapsis_high_value_payment_failed
+      type: business_logic
+      priority: medium
+      description: Create support ticket for high-value payment failures
+      when:
+        events: [paymentFailed]
+        amount: {gt: 1000}
+      then:
+        actions: ["Created support ticket for payment failure: ${amount}"]
+        support_ticket:
+          reason: "High amount payment failure: ${amount}"
+          metadata: {priority: medium}
+      tiers:
+        - amount: {gt: 2000}
+          ticket_metadata: {priority: high}
+"""
+
+import copy
+import string
+from bisect import bisect_left
+from typing import Any, Dict, FrozenSet, List, Optional, Sequence, Tuple
+
+from app.business_rules.base import (
+    BaseBusinessRule,
+    BatchEffect,
+    RuleContext,
+    RulePriority,
+    RuleResult,
+    RuleSetConfigError,
+    RuleType,
+)
+from app.models.domain import EventType, OrderState
+
+
+# Operadores de comparación admitidos en condiciones de monto
+AMOUNT_OPERATORS = {
+    "gt": lambda amount, threshold: amount > threshold,
+    "gte": lambda amount, threshold: amount >= threshold,
+    "lt": lambda amount, threshold: amount < threshold,
+    "lte": lambda amount, threshold: amount <= threshold,
+}
+
+DEFINITION_KEYS = {"id", "type", "priority", "description", "enabled", "when", "then", "tiers"}
+WHEN_KEYS = {"states", "events", "countries", "not_countries", "amount"}
+THEN_KEYS = {"actions", "remove_events", "add_events", "metadata", "support_ticket"}
+TIER_KEYS = {"amount", "metadata", "ticket_metadata"}
+
+# Campos de las plantillas (actions y support_ticket.reason) con valores de
+# ejemplo para probar el formato al cargar (event_type y country pueden faltar)
+TEMPLATE_SAMPLE_VALUES = {
+    "amount": 0.0,
+    "state": OrderState.PENDING.value,
+    "event_type": EventType.PAYMENT_FAILED.value,
+    "country": "CO",
+}
+TEMPLATE_MISSING_VALUES = {**TEMPLATE_SAMPLE_VALUES, "event_type": None, "country": None}
+
+
+class AmountBands:
+    """
+    Partición de los montos por un arreglo ordenado de breakpoints.
+
+    Para breakpoints b0 < b1 < ... el tramo 2*i es el intervalo abierto entre
+    b(i-1) y b(i) y el tramo 2*i + 1 es exactamente b(i). Cualquier condición
+    gt/gte/lt/lte sobre esos breakpoints es constante dentro de cada tramo.
+    """
+
+    def __init__(self, breakpoints: Sequence[float]):
+        self.breakpoints: Tuple[float, ...] = tuple(sorted(set(float(b) for b in breakpoints)))
+        self.count = 2 * len(self.breakpoints) + 1
+
+    def band_of(self, amount: float) -> int:
+        """Tramo de un monto, por búsqueda binaria"""
+        index = bisect_left(self.breakpoints, amount)
+        if index < len(self.breakpoints) and self.breakpoints[index] == amount:
+            return 2 * index + 1
+        return 2 * index
+
+    def representative(self, band: int) -> float:
+        """Un monto cualquiera dentro del tramo"""
+        index, exact = divmod(band, 2)
+        points = self.breakpoints
+        if exact:
+            return points[index]
+        if not points:
+            return 0.0
+        if index == 0:
+            return points[0] - 1.0
+        if index == len(points):
+            return points[-1] + 1.0
+        return (points[index - 1] + points[index]) / 2
+
+    def mask(self, condition: Dict[str, float]) -> int:
+        """Máscara de bits con los tramos que cumplen la condición"""
+        mask = 0
+        for band in range(self.count):
+            amount = self.representative(band)
+            if all(AMOUNT_OPERATORS[op](amount, value) for op, value in condition.items()):
+                mask |= 1 << band
+        return mask
+
+
+def _parse_amount_condition(rule_id: str, condition: Any) -> Dict[str, float]:
+    if not isinstance(condition, dict) or not condition:
+        raise RuleSetConfigError(f"Rule '{rule_id}': amount condition must be a non-empty mapping")
+    unknown = set(condition) - set(AMOUNT_OPERATORS)
+    if unknown:
+        raise RuleSetConfigError(f"Rule '{rule_id}': unknown amount operators {sorted(unknown)}")
+    try:
+        return {op: float(value) for op, value in condition.items()}
+    except (TypeError, ValueError):
+        raise RuleSetConfigError(f"Rule '{rule_id}': amount thresholds must be numbers")
+
+
+def _parse_enum_set(rule_id: str, field: str, values: Any, enum_class) -> FrozenSet:
+    if not isinstance(values, list) or not values:
+        raise RuleSetConfigError(f"Rule '{rule_id}': '{field}' must be a non-empty list")
+    try:
+        return frozenset(enum_class(value) for value in values)
+    except ValueError as e:
+        raise RuleSetConfigError(f"Rule '{rule_id}': {e}")
+
+
+def _parse_template(rule_id: str, field: str, template: Any) -> str:
+    """Validar una plantilla al cargar: solo campos conocidos y formato aplicable"""
+    if not isinstance(template, str):
+        raise RuleSetConfigError(f"Rule '{rule_id}': '{field}' must be a string")
+    try:
+        names = {name for _, name, _, _ in string.Formatter().parse(template) if name is not None}
+    except ValueError as e:
+        raise RuleSetConfigError(f"Rule '{rule_id}': invalid template in '{field}': {e}")
+
+    unknown = names - set(TEMPLATE_SAMPLE_VALUES)
+    if unknown:
+        raise RuleSetConfigError(
+            f"Rule '{rule_id}': unknown placeholders {sorted(unknown)} in '{field}', "
+            f"expected {sorted(TEMPLATE_SAMPLE_VALUES)}"
+        )
+    try:
+        template.format_map(TEMPLATE_SAMPLE_VALUES)
+        template.format_map(TEMPLATE_MISSING_VALUES)
+    except (ValueError, TypeError, KeyError) as e:
+        raise RuleSetConfigError(f"Rule '{rule_id}': invalid template in '{field}': {e}")
+    return template
+
+
+def _check_keys(rule_id: str, section: str, value: Any, allowed: set) -> Dict[str, Any]:
+    if value is None:
+        return {}
+    if not isinstance(value, dict):
+        raise RuleSetConfigError(f"Rule '{rule_id}': '{section}' must be a mapping")
+    unknown = set(value) - allowed
+    if unknown:
+        raise RuleSetConfigError(f"Rule '{rule_id}': unknown keys in '{section}': {sorted(unknown)}")
+    return value
+
+
+class DslRule(BaseBusinessRule):
+    """Regla de negocio definida por configuración"""
+
+    def __init__(self, definition: Dict[str, Any]):
+        if not isinstance(definition, dict) or not definition.get("id"):
+            raise RuleSetConfigError("DSL rule must be a mapping with an 'id'")
+        rule_id = str(definition["id"])
+        _check_keys(rule_id, "rule", definition, DEFINITION_KEYS)
+
+        try:
+            rule_type = RuleType(definition.get("type", RuleType.BUSINESS_LOGIC.value))
+            priority = RulePriority[str(definition.get("priority", "medium")).upper()]
+        except (ValueError, KeyError) as e:
+            raise RuleSetConfigError(f"Rule '{rule_id}': invalid type or priority ({e})")
+
+        super().__init__(
+            rule_id=rule_id,
+            description=definition.get("description", rule_id),
+            rule_type=rule_type,
+            priority=priority
+        )
+        self.definition = copy.deepcopy(definition)
+        self.enabled = bool(definition.get("enabled", True))
+
+        when = _check_keys(rule_id, "when", definition.get("when"), WHEN_KEYS)
+        then = _check_keys(rule_id, "then", definition.get("then"), THEN_KEYS)
+        tiers = definition.get("tiers") or []
+        if not isinstance(tiers, list):
+            raise RuleSetConfigError(f"Rule '{rule_id}': 'tiers' must be a list")
+
+        # Datos del contexto que lee la regla (memoización del filtrado)
+        memo_inputs = set()
+
+        # Estados y eventos: los indexa el registro
+        if "states" in when:
+            self.applicable_states = _parse_enum_set(rule_id, "states", when["states"], OrderState)
+        if "events" in when:
+            self.applicable_events = _parse_enum_set(rule_id, "events", when["events"], EventType)
+
+        # Países
+        self.countries: Optional[FrozenSet[str]] = (
+            frozenset(c.upper() for c in when["countries"]) if "countries" in when else None
+        )
+        self.not_countries: Optional[FrozenSet[str]] = (
+            frozenset(c.upper() for c in when["not_countries"]) if "not_countries" in when else None
+        )
+        if "countries" in when or "not_countries" in when:
+            memo_inputs.add("country")
+
+        # Montos: condición principal y tramos comparten un solo arreglo de breakpoints
+        amount_condition = (
+            _parse_amount_condition(rule_id, when["amount"]) if "amount" in when else None
+        )
+        tier_conditions = []
+        for tier in tiers:
+            tier = _check_keys(rule_id, "tiers", tier, TIER_KEYS)
+            tier_conditions.append(_parse_amount_condition(rule_id, tier.get("amount")))
+
+        conditions = [c for c in [amount_condition, *tier_conditions] if c]
+        self.bands = AmountBands([value for c in conditions for value in c.values()])
+        self.amount_mask: Optional[int] = (
+            self.bands.mask(amount_condition) if amount_condition else None
+        )
+        if conditions:
+            memo_inputs.add("amount")
+        self.memo_inputs = frozenset(memo_inputs)
+        self.tiers: Tuple[Tuple[int, Dict[str, Any], Dict[str, Any]], ...] = tuple(
+            (self.bands.mask(condition), tier.get("metadata") or {}, tier.get("ticket_metadata") or {})
+            for condition, tier in zip(tier_conditions, tiers)
+        )
+
+        # Efectos
+        if not isinstance(then.get("actions") or [], list):
+            raise RuleSetConfigError(f"Rule '{rule_id}': 'actions' must be a list")
+        self.actions: Tuple[str, ...] = tuple(
+            _parse_template(rule_id, "actions", action) for action in then.get("actions") or ()
+        )
+        self.remove_events = tuple(
+            _parse_enum_set(rule_id, "remove_events", then["remove_events"], EventType)
+        ) if "remove_events" in then else ()
+        self.add_events: Tuple[EventType, ...] = ()
+        if "add_events" in then:
+            _parse_enum_set(rule_id, "add_events", then["add_events"], EventType)
+            # Se agregan en el orden de la definición
+            self.add_events = tuple(dict.fromkeys(EventType(value) for value in then["add_events"]))
+        self.metadata_updates: Dict[str, Any] = dict(then.get("metadata") or {})
+        self.support_ticket: Optional[Dict[str, Any]] = then.get("support_ticket")
+        if self.support_ticket is not None:
+            if not isinstance(self.support_ticket, dict) or "reason" not in self.support_ticket:
+                raise RuleSetConfigError(f"Rule '{rule_id}': support_ticket requires a 'reason'")
+            _parse_template(rule_id, "support_ticket.reason", self.support_ticket["reason"])
+
+    def config_params(self) -> Dict[str, Any]:
+        return {"definition": copy.deepcopy(self.definition)}
+
+    def config_entry(self) -> Dict[str, Any]:
+        entry = copy.deepcopy(self.definition)
+        entry["enabled"] = self.is_enabled()
+        return entry
+
+    # ------------------------------------------------------------------
+    # Evaluación
+    # ------------------------------------------------------------------
+
+    def amount_breakpoints(self) -> Tuple[float, ...]:
+        return self.bands.breakpoints
+
+    def applies_to(self, context: RuleContext) -> bool:
+        # Estado y evento ya los resolvió la tabla de despacho; se revalidan
+        # por si la regla se evalúa directamente
+        if self.applicable_states is not None and context.order.state not in self.applicable_states:
+            return False
+        if self.applicable_events is not None and context.event_type not in self.applicable_events:
+            return False
+
+        if self.countries is not None or self.not_countries is not None:
+            country = context.get_country_code()
+            if self.countries is not None and country not in self.countries:
+                return False
+            if self.not_countries is not None and country in self.not_countries:
+                return False
+
+        if self.amount_mask is not None:
+            band = self.bands.band_of(context.order.amount)
+            if not (self.amount_mask >> band) & 1:
+                return False
+
+        return True
+
+    def batch_applies(self, batch):
+        mask = batch.all_rows()
+        if self.countries is not None:
+            mask &= batch.country_in(self.countries)
+        if self.not_countries is not None:
+            mask &= ~batch.country_in(self.not_countries)
+        if self.amount_mask is not None:
+            mask &= batch.amount_in_bands(self.bands, self.amount_mask)
+        return mask
+
+    def batch_effect(self) -> BatchEffect:
+        return BatchEffect(
+            remove_events=frozenset(self.remove_events),
+            add_events=frozenset(self.add_events),
+            creates_ticket=self.support_ticket is not None
+        )
+
+    def _template_values(self, context: RuleContext) -> Dict[str, Any]:
+        return {
+            "amount": context.order.amount,
+            "state": context.order.state.value,
+            "event_type": context.event_type.value if context.event_type else None,
+            "country": context.get_country_code(),
+        }
+
+    def filter_events(self, available_events: List[EventType], context: RuleContext) -> List[EventType]:
+        """Quitar/agregar eventos según la definición"""
+        events = [event for event in available_events if event not in self.remove_events]
+        for event in self.add_events:
+            if event not in events:
+                events.append(event)
+        return events
+
+    def execute(self, context: RuleContext) -> RuleResult:
+        values = self._template_values(context)
+
+        metadata_updates = dict(self.metadata_updates)
+        ticket_metadata = dict(self.support_ticket.get("metadata") or {}) if self.support_ticket else {}
+
+        if self.tiers:
+            band = self.bands.band_of(context.order.amount)
+            for mask, tier_metadata, tier_ticket_metadata in self.tiers:
+                if (mask >> band) & 1:
+                    metadata_updates.update(tier_metadata)
+                    ticket_metadata.update(tier_ticket_metadata)
+
+        support_tickets = []
+        if self.support_ticket is not None:
+            ticket_metadata.setdefault("auto_created", True)
+            ticket_metadata["rule_id"] = self.rule_id
+            support_tickets.append({
+                "reason": self.support_ticket["reason"].format_map(values),
+                "amount": context.order.amount,
+                "metadata": ticket_metadata,
+            })
+
+        return RuleResult(
+            success=True,
+            actions=[action.format_map(values) for action in self.actions],
+            metadata_updates=metadata_updates,
+            support_tickets=support_tickets
+        )
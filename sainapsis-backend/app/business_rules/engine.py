@@ -4,93 +4,204 @@
 Motor de reglas de negocio que coordina la evaluación y ejecución.
 """
 
-from typing import List, Dict, Any, Optional
-from collections import defaultdict
+from itertools import groupby
+from typing import List, Dict, Any, Optional, Sequence, Tuple, Type, Callable
+import asyncio
 import logging
+import os
+import threading
 
 from app.business_rules.base import (
+    AsyncBusinessRule,
     BaseBusinessRule, 
     RuleContext, 
     RuleResult, 
     RuleType, 
     RulePriority,
-    EventFilterRule,
     BusinessRuleException
 )
-from app.models.domain import EventType
+from app.business_rules.metrics import RuleMetrics, metrics_enabled
+from app.business_rules.ruleset import RuleSet, compile_rule_set, load_rule_config
+from app.core.cache import LRUCache
+from app.core.database import db
+from app.models.domain import EventType, OrderState
 
 logger = logging.getLogger(__name__)
 
+# Plazo total para evaluar las reglas asíncronas de una petición (segundos)
+RULES_DEADLINE_SECONDS = float(os.getenv("BUSINESS_RULES_DEADLINE_MS", "500")) / 1000
+
 
 class BusinessRuleRegistry:
-    """Registro centralizado de todas las reglas de negocio"""
+    """
+    Registro centralizado de las reglas de negocio.
+
+    Mantiene el RuleSet vigente. Las lecturas toman una referencia a él sin
+    bloqueos; cada cambio construye un RuleSet nuevo (copy-on-write) y lo
+    publica reemplazando la referencia en un solo paso.
+    """
     
     def __init__(self):
-        self._rules: Dict[str, BaseBusinessRule] = {}
-        self._rules_by_type: Dict[RuleType, List[BaseBusinessRule]] = defaultdict(list)
-        self._rules_by_priority: Dict[RulePriority, List[BaseBusinessRule]] = defaultdict(list)
+        self._rule_set = RuleSet(version=0, rules=(), source="empty")
+        self._write_lock = threading.Lock()
+        self._publish_listeners: List[Callable[[RuleSet], None]] = []
+        self.rule_catalog: Dict[str, Type[BaseBusinessRule]] = {}
+    
+    # ------------------------------------------------------------------
+    # Publicación de versiones
+    # ------------------------------------------------------------------
+    
+    def current(self) -> RuleSet:
+        """RuleSet vigente: fijarlo al inicio de una evaluación"""
+        return self._rule_set
+    
+    @property
+    def version(self) -> int:
+        return self._rule_set.version
+    
+    def on_publish(self, listener: Callable[[RuleSet], None]) -> None:
+        """Registrar una función que recibe cada RuleSet antes de publicarse"""
+        self._publish_listeners.append(listener)
+        listener(self._rule_set)
+    
+    def _publish(self, build: Callable[[RuleSet, int], RuleSet]) -> RuleSet:
+        """Construir la siguiente versión a partir de la vigente y publicarla"""
+        with self._write_lock:
+            current = self._rule_set
+            rule_set = build(current, current.version + 1)
+            for listener in self._publish_listeners:
+                listener(rule_set)
+            self._rule_set = rule_set
+        logger.info("📦 Rule set v%s published (%s)", rule_set.version, rule_set.source)
+        return rule_set
+    
+    def register_rule_class(self, rule_class: Type[BaseBusinessRule]) -> None:
+        """Agregar una clase de regla al catálogo usado por la configuración"""
+        self.rule_catalog[rule_class.__name__] = rule_class
+    
+    def load_config(self, config: Dict[str, Any], source: str = "config") -> RuleSet:
+        """Compilar configuración y publicarla como nueva versión"""
+        return self._publish(
+            lambda current, version: compile_rule_set(config, self.rule_catalog, version, source)
+        )
+    
+    def load_config_file(self, path: str) -> RuleSet:
+        """Compilar y publicar la configuración de un archivo YAML/JSON"""
+        config = load_rule_config(path)
+        return self.load_config(config, source=f"file:{os.path.basename(path)}")
     
     def register(self, rule: BaseBusinessRule) -> None:
         """Registra una nueva regla"""
-        if rule.rule_id in self._rules:
-            print(f"⚠️ Rule {rule.rule_id} is being overwritten")
+        if self._rule_set.get_rule(rule.rule_id):
+            logger.warning("⚠️ Rule %s is being overwritten", rule.rule_id)
         
-        self._rules[rule.rule_id] = rule
-        self._rules_by_type[rule.rule_type].append(rule)
-        self._rules_by_priority[rule.priority].append(rule)
+        self._publish(lambda current, version: current.with_rule(rule, version))
         
-        print(f"✅ Registered rule: {rule.rule_id} ({rule.rule_type.value})")
+        logger.info("✅ Registered rule: %s (%s)", rule.rule_id, rule.rule_type.value)
     
     def unregister(self, rule_id: str) -> bool:
         """Desregistra una regla"""
-        if rule_id not in self._rules:
+        if not self._rule_set.get_rule(rule_id):
             return False
         
-        rule = self._rules.pop(rule_id)
-        self._rules_by_type[rule.rule_type].remove(rule)
-        self._rules_by_priority[rule.priority].remove(rule)
+        self._publish(lambda current, version: current.without_rule(rule_id, version))
+        
+        logger.info("🗑️ Unregistered rule: %s", rule_id)
+        return True
+    
+    def set_rule_enabled(self, rule_id: str, enabled: bool) -> bool:
+        """Habilita/deshabilita una regla publicando una nueva versión"""
+        if not self._rule_set.get_rule(rule_id):
+            return False
+        
+        self._publish(lambda current, version: current.with_rule_enabled(rule_id, enabled, version))
+        return True
+    
+    def update_rule_params(self, rule_id: str, **params: Any) -> bool:
+        """Reconstruye una regla con parámetros nuevos publicando una nueva versión"""
+        if not self._rule_set.get_rule(rule_id):
+            return False
         
-        print(f"🗑️ Unregistered rule: {rule_id}")
+        self._publish(lambda current, version: current.with_rule_params(rule_id, params, version))
         return True
     
+    # ------------------------------------------------------------------
+    # Consultas sobre la versión vigente
+    # ------------------------------------------------------------------
+    
     def get_rule(self, rule_id: str) -> Optional[BaseBusinessRule]:
         """Obtiene una regla por ID"""
-        return self._rules.get(rule_id)
+        return self._rule_set.get_rule(rule_id)
     
     def get_rules_by_type(self, rule_type: RuleType) -> List[BaseBusinessRule]:
         """Obtiene todas las reglas de un tipo específico"""
-        return [rule for rule in self._rules_by_type[rule_type] if rule.is_enabled()]
+        return self._rule_set.get_rules_by_type(rule_type)
     
     def get_all_rules(self) -> List[BaseBusinessRule]:
         """Obtiene todas las reglas habilitadas"""
-        return [rule for rule in self._rules.values() if rule.is_enabled()]
+        return self._rule_set.get_all_rules()
+    
+    def get_candidate_rules(
+        self, 
+        state: OrderState, 
+        event_type: Optional[EventType] = None, 
+        rule_type: Optional[RuleType] = None
+    ) -> Tuple[BaseBusinessRule, ...]:
+        """Reglas habilitadas que pueden aplicar a (estado, evento), ordenadas por prioridad"""
+        return self._rule_set.get_candidate_rules(state, event_type, rule_type)
     
     def get_applicable_rules(self, context: RuleContext, rule_type: Optional[RuleType] = None) -> List[BaseBusinessRule]:
-        """Obtiene las reglas aplicables a un contexto específico"""
-        rules = self.get_rules_by_type(rule_type) if rule_type else self.get_all_rules()
-        return [rule for rule in rules if rule.applies_to(context)]
+        """Obtiene las reglas aplicables a un contexto, ordenadas por prioridad"""
+        return self._rule_set.get_applicable_rules(context, rule_type)
     
     def list_rules_info(self) -> List[Dict[str, Any]]:
         """Lista información de todas las reglas registradas"""
-        return [
-            {
-                "rule_id": rule.rule_id,
-                "description": rule.description,
-                "type": rule.rule_type.value,
-                "priority": rule.priority.value,
-                "enabled": rule.is_enabled()
-            }
-            for rule in self._rules.values()
-        ]
+        return self._rule_set.list_rules_info()
 
 
 class BusinessRuleEvaluator:
     """Evaluador principal que ejecuta las reglas de negocio"""
     
-    def __init__(self, registry: BusinessRuleRegistry):
+    def __init__(self, registry: BusinessRuleRegistry, metrics: Optional[RuleMetrics] = None):
         self.registry = registry
+        
+        # Métricas por regla (None: sin instrumentar); los contadores de cada
+        # regla se crean al publicarse el RuleSet que la contiene
+        self.metrics = metrics
+        if metrics is not None:
+            registry.on_publish(lambda rule_set: metrics.prepare(rule_set.rules))
+        
+        # Memo del filtrado de eventos; las claves incluyen la versión del
+        # conjunto, así que un cambio de reglas nunca sirve resultados viejos
+        self.filter_cache: Optional[LRUCache] = None
+        if os.getenv("EVENT_FILTER_CACHE_ENABLED", "true").lower() in ("1", "true", "yes"):
+            self.filter_cache = LRUCache(
+                max_size=int(os.getenv("EVENT_FILTER_CACHE_MAX_SIZE", 4096)),
+                ttl_seconds=float(os.getenv("EVENT_FILTER_CACHE_TTL_SECONDS", 3600)),
+            )
+        self._filter_cache_version = 0
+        self.filter_cache_bypasses = 0
+    
+    def _rule_set(self, rule_set: Optional[RuleSet]) -> RuleSet:
+        """RuleSet fijado por el llamador o, si no hay, el vigente"""
+        return rule_set if rule_set is not None else self.registry.current()
     
-    def evaluate_all_rules(self, context: RuleContext) -> Dict[str, Any]:
+    def _applicable_rules(
+        self, rule_set: RuleSet, context: RuleContext, rule_type: Optional[RuleType] = None
+    ) -> List[BaseBusinessRule]:
+        """RuleSet.get_applicable_rules, midiendo cada applies_to"""
+        if self.metrics is None:
+            return rule_set.get_applicable_rules(context, rule_type)
+        candidates = rule_set.get_candidate_rules(context.order.state, context.event_type, rule_type)
+        return [rule for rule in candidates if self.metrics.applies_to(rule, context)]
+    
+    def _call(self, rule: BaseBusinessRule, method: Callable, *args):
+        """Ejecutar un método de la regla, midiéndolo si hay métricas"""
+        if self.metrics is None:
+            return method(*args)
+        return self.metrics.call(rule, method, *args)
+    
+    def evaluate_all_rules(self, context: RuleContext, rule_set: Optional[RuleSet] = None) -> Dict[str, Any]:
         """Evalúa todas las reglas aplicables a un contexto"""
         results = {
             "success": True,
@@ -99,15 +210,18 @@ class BusinessRuleEvaluator:
             "actions": [],
             "metadata_updates": {},
             "support_tickets": [],
-            "filtered_events": None
+            "filtered_events": None,
+            "skipped_rules": []
         }
         
         # Obtener reglas aplicables ordenadas por prioridad
-        applicable_rules = self._get_ordered_applicable_rules(context)
+        applicable_rules = self._applicable_rules(self._rule_set(rule_set), context)
         
         for rule in applicable_rules:
+            if self._skip_async_rule(rule, results):
+                continue
             try:
-                rule_result = rule.execute(context)
+                rule_result = self._call(rule, rule.execute, context)
                 
                 if rule_result.success:
                     results["executed_rules"].append(rule.rule_id)
@@ -131,7 +245,7 @@ class BusinessRuleEvaluator:
                         break
                         
             except Exception as e:
-                print(f"❌ Error executing rule {rule.rule_id}: {str(e)}")
+                logger.error("❌ Error executing rule %s: %s", rule.rule_id, e, extra={"rule_id": rule.rule_id})
                 results["failed_rules"].append({
                     "rule_id": rule.rule_id,
                     "error": str(e)
@@ -143,65 +257,247 @@ class BusinessRuleEvaluator:
         
         return results
     
-    def filter_available_events(self, available_events: List[EventType], context: RuleContext) -> List[EventType]:
-        """Filtra eventos disponibles usando reglas de filtro"""
-        filtered_events = available_events.copy()
+    def filter_available_events(
+        self,
+        available_events: Sequence[EventType],
+        context: RuleContext,
+        rule_set: Optional[RuleSet] = None,
+        memoize: bool = True
+    ) -> List[EventType]:
+        """
+        Filtra eventos disponibles usando reglas de filtro.
+
+        El resultado depende solo de la versión del conjunto y de los datos
+        que declaran las reglas candidatas (tramo de monto, país, día), así
+        que se memoiza con esa clave. Los conjuntos no publicados (candidatos)
+        deben pasar memoize=False: su versión no es única.
+        """
+        rule_set = self._rule_set(rule_set)
+        
+        key = None
+        if self.filter_cache is not None and memoize:
+            key = rule_set.filter_memo_key(context, available_events)
+            if key is None:
+                self.filter_cache_bypasses += 1
+            else:
+                self._sync_filter_cache(rule_set)
+                cached = self.filter_cache.get(key)
+                if cached is not None:
+                    return list(cached)
         
-        # Obtener reglas de filtro aplicables
-        filter_rules = self.registry.get_applicable_rules(context, RuleType.EVENT_FILTER)
+        filtered_events, failed = self._run_event_filters(available_events, context, rule_set)
         
-        # Ordenar por prioridad
-        filter_rules.sort(key=lambda r: r.priority.value)
+        # Un resultado con reglas fallidas no se guarda
+        if key is not None and not failed:
+            self.filter_cache.set(key, tuple(filtered_events))
+        return filtered_events
+    
+    def _run_event_filters(
+        self, available_events: Sequence[EventType], context: RuleContext, rule_set: RuleSet
+    ) -> Tuple[List[EventType], bool]:
+        """Aplica las reglas de filtro; retorna (eventos, hubo_errores)"""
+        filtered_events = list(available_events)
+        failed = False
+        
+        # Obtener reglas de filtro aplicables (ya ordenadas por prioridad)
+        filter_rules = self._applicable_rules(rule_set, context, RuleType.EVENT_FILTER)
         
         for rule in filter_rules:
-            if isinstance(rule, EventFilterRule):
+            # EventFilterRule o regla declarativa de tipo event_filter
+            if callable(getattr(rule, "filter_events", None)):
                 try:
-                    filtered_events = rule.filter_events(filtered_events, context)
-                    print(f"🔧 Rule {rule.rule_id} applied - Events: {len(filtered_events)}")
+                    filtered_events = self._call(rule, rule.filter_events, filtered_events, context)
+                    logger.debug("🔧 Rule %s applied - Events: %d", rule.rule_id, len(filtered_events))
                 except Exception as e:
-                    print(f"❌ Error in filter rule {rule.rule_id}: {str(e)}")
+                    failed = True
+                    logger.error("❌ Error in filter rule %s: %s", rule.rule_id, e, extra={"rule_id": rule.rule_id})
         
-        return filtered_events
+        return filtered_events, failed
+    
+    def _sync_filter_cache(self, rule_set: RuleSet):
+        """Vaciar el cache de filtrado al ver una versión nueva del conjunto"""
+        if rule_set.version > self._filter_cache_version:
+            self.filter_cache.clear()
+            self._filter_cache_version = rule_set.version
     
-    def evaluate_business_logic(self, context: RuleContext) -> Dict[str, Any]:
-        """Evalúa solo reglas de lógica de negocio"""
-        business_rules = self.registry.get_applicable_rules(context, RuleType.BUSINESS_LOGIC)
+    def rule_metrics(
+        self, rule_set: Optional[RuleSet] = None, buckets: bool = False
+    ) -> Optional[List[Dict[str, Any]]]:
+        """Métricas de las reglas del conjunto (None si no hay instrumentación)"""
+        if self.metrics is None:
+            return None
+        rule_set = self._rule_set(rule_set)
+        return self.metrics.snapshot([rule.rule_id for rule in rule_set.rules], buckets)
+    
+    def filter_cache_stats(self) -> Dict[str, Any]:
+        """Contadores del cache de filtrado de eventos"""
+        if self.filter_cache is None:
+            return {"enabled": False}
+        return {
+            "enabled": True,
+            **self.filter_cache.stats(),
+            "bypasses": self.filter_cache_bypasses,
+            "rule_set_version": self._filter_cache_version,
+        }
+    
+    def evaluate_business_logic(self, context: RuleContext, rule_set: Optional[RuleSet] = None) -> Dict[str, Any]:
+        """
+        Evalúa solo reglas de lógica de negocio (en orden de prioridad).
+        Las reglas asíncronas no se ejecutan y se reportan en skipped_rules:
+        ver evaluate_business_logic_async
+        """
+        business_rules = self._applicable_rules(self._rule_set(rule_set), context, RuleType.BUSINESS_LOGIC)
         
-        results = {
+        results = self._empty_business_results()
+        results["skipped_rules"] = []
+        
+        for rule in business_rules:
+            if self._skip_async_rule(rule, results):
+                continue
+            try:
+                rule_result = self._call(rule, rule.execute, context)
+                self._merge_business_result(results, rule, rule_result)
+            except Exception as e:
+                logger.error("❌ Error executing business rule %s: %s", rule.rule_id, e, extra={"rule_id": rule.rule_id})
+        
+        return results
+    
+    async def evaluate_business_logic_async(
+        self,
+        context: RuleContext,
+        rule_set: Optional[RuleSet] = None,
+        deadline: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """
+        Evalúa reglas de lógica de negocio esperando a las reglas asíncronas.
+
+        Las reglas de una misma prioridad se ejecutan concurrentemente y los
+        resultados se combinan en el mismo orden que la versión síncrona. Las
+        que vencen su timeout o el plazo total (deadline segundos, por defecto
+        BUSINESS_RULES_DEADLINE_MS) usan su fallback_result y se reportan en
+        fallback_rules.
+        """
+        business_rules = self._applicable_rules(self._rule_set(rule_set), context, RuleType.BUSINESS_LOGIC)
+        
+        results = self._empty_business_results()
+        results["fallback_rules"] = []
+        
+        for rule, rule_result, fallback_reason in await self._execute_by_tier(business_rules, context, deadline):
+            if fallback_reason is not None:
+                results["fallback_rules"].append({"rule_id": rule.rule_id, "reason": fallback_reason})
+                if not rule_result.success:
+                    continue
+            if rule_result is not None:
+                self._merge_business_result(results, rule, rule_result)
+        
+        return results
+    
+    @staticmethod
+    def _skip_async_rule(rule: BaseBusinessRule, results: Dict[str, Any]) -> bool:
+        """
+        Los caminos síncronos (preview, simulación) no pueden esperar I/O: las
+        reglas asíncronas se omiten sin contarlas como fallo ni registrarlas
+        """
+        if not isinstance(rule, AsyncBusinessRule):
+            return False
+        results["skipped_rules"].append(rule.rule_id)
+        return True
+    
+    @staticmethod
+    def _empty_business_results() -> Dict[str, Any]:
+        return {
             "success": True,
             "executed_rules": [],
             "support_tickets": [],
             "metadata_updates": {},
+            "persisted_metadata_updates": {},
             "actions": []
         }
+    
+    @staticmethod
+    def _merge_business_result(results: Dict[str, Any], rule: BaseBusinessRule, rule_result: RuleResult):
+        if rule_result.success:
+            results["executed_rules"].append(rule.rule_id)
+            results["support_tickets"].extend(rule_result.support_tickets)
+            results["metadata_updates"].update(rule_result.metadata_updates)
+            if rule.persist_metadata:
+                results["persisted_metadata_updates"].update(rule_result.metadata_updates)
+            results["actions"].extend(rule_result.actions)
+        else:
+            logger.warning(
+                "⚠️ Business rule %s failed: %s", rule.rule_id, rule_result.error_message,
+                extra={"rule_id": rule.rule_id}
+            )
+    
+    async def _execute_by_tier(
+        self, rules: List[BaseBusinessRule], context: RuleContext, deadline: Optional[float] = None
+    ) -> List[Tuple[BaseBusinessRule, Optional[RuleResult], Optional[str]]]:
+        """
+        Ejecutar reglas ya ordenadas por prioridad: cada nivel de prioridad
+        corre concurrentemente y el siguiente empieza cuando termina. Retorna
+        (regla, resultado, motivo del fallback) en el orden de entrada; el
+        resultado es None si una regla síncrona lanzó una excepción.
+        """
+        loop = asyncio.get_running_loop()
+        deadline_at = loop.time() + (RULES_DEADLINE_SECONDS if deadline is None else deadline)
         
-        # Ordenar por prioridad
-        business_rules.sort(key=lambda r: r.priority.value)
-        
-        for rule in business_rules:
+        outcomes = []
+        for _, tier in groupby(rules, key=lambda rule: rule.priority):
+            tier = list(tier)
+            if not any(isinstance(rule, AsyncBusinessRule) for rule in tier):
+                outcomes.extend(self._execute_sync(rule, context) for rule in tier)
+                continue
+            outcomes.extend(await asyncio.gather(*(
+                self._execute_async(rule, context, deadline_at) if isinstance(rule, AsyncBusinessRule)
+                else self._execute_sync_coroutine(rule, context)
+                for rule in tier
+            )))
+        return outcomes
+    
+    def _execute_sync(
+        self, rule: BaseBusinessRule, context: RuleContext
+    ) -> Tuple[BaseBusinessRule, Optional[RuleResult], Optional[str]]:
+        try:
+            return rule, self._call(rule, rule.execute, context), None
+        except Exception as e:
+            logger.error("❌ Error executing rule %s: %s", rule.rule_id, e, extra={"rule_id": rule.rule_id})
+            return rule, None, None
+    
+    async def _execute_sync_coroutine(self, rule: BaseBusinessRule, context: RuleContext):
+        return self._execute_sync(rule, context)
+    
+    async def _execute_async(
+        self, rule: AsyncBusinessRule, context: RuleContext, deadline_at: float
+    ) -> Tuple[BaseBusinessRule, Optional[RuleResult], Optional[str]]:
+        remaining = deadline_at - asyncio.get_running_loop().time()
+        if remaining <= 0:
+            reason = "deadline exceeded"
+        else:
             try:
-                rule_result = rule.execute(context)
-                
-                if rule_result.success:
-                    results["executed_rules"].append(rule.rule_id)
-                    results["support_tickets"].extend(rule_result.support_tickets)
-                    results["metadata_updates"].update(rule_result.metadata_updates)
-                    results["actions"].extend(rule_result.actions)
-                else:
-                    print(f"⚠️ Business rule {rule.rule_id} failed: {rule_result.error_message}")
-                    
+                # Cada regla corre en su propia tarea: no puede usar la
+                # conexión fijada por la petición
+                with db.detached():
+                    if self.metrics is None:
+                        call = rule.execute_async(context)
+                    else:
+                        call = self.metrics.call_async(rule, rule.execute_async, context)
+                    result = await asyncio.wait_for(call, timeout=min(rule.timeout, remaining))
+                return rule, result, None
+            except asyncio.TimeoutError:
+                reason = "timeout" if rule.timeout < remaining else "deadline exceeded"
             except Exception as e:
-                print(f"❌ Error executing business rule {rule.rule_id}: {str(e)}")
+                reason = f"error: {e}"
         
-        return results
+        logger.warning("⏱️ Async rule %s fell back (%s)", rule.rule_id, reason, extra={"rule_id": rule.rule_id})
+        return rule, rule.fallback_result(context, reason), reason
     
-    def validate_context(self, context: RuleContext) -> bool:
+    def validate_context(self, context: RuleContext, rule_set: Optional[RuleSet] = None) -> bool:
         """Valida un contexto usando reglas de validación"""
-        validation_rules = self.registry.get_applicable_rules(context, RuleType.VALIDATION)
+        validation_rules = self._applicable_rules(self._rule_set(rule_set), context, RuleType.VALIDATION)
         
         for rule in validation_rules:
             try:
-                result = rule.execute(context)
+                result = self._call(rule, rule.execute, context)
                 if not result.success:
                     raise BusinessRuleException(rule.rule_id, result.error_message or "Validation failed")
             except BusinessRuleException:
@@ -211,28 +507,41 @@ class BusinessRuleEvaluator:
         
         return True
     
-    def enrich_order_data(self, context: RuleContext) -> Dict[str, Any]:
+    def enrich_order_data(self, context: RuleContext, rule_set: Optional[RuleSet] = None) -> Dict[str, Any]:
         """Enriquece datos de la orden usando reglas de enriquecimiento"""
-        enrichment_rules = self.registry.get_applicable_rules(context, RuleType.ENRICHMENT)
+        enrichment_rules = self._applicable_rules(self._rule_set(rule_set), context, RuleType.ENRICHMENT)
         
         enriched_data = {}
         
         for rule in enrichment_rules:
             try:
-                result = rule.execute(context)
+                result = self._call(rule, rule.execute, context)
                 if result.success:
                     enriched_data.update(result.metadata_updates)
             except Exception as e:
-                print(f"⚠️ Error in enrichment rule {rule.rule_id}: {str(e)}")
+                logger.warning("⚠️ Error in enrichment rule %s: %s", rule.rule_id, e, extra={"rule_id": rule.rule_id})
         
         return enriched_data
     
-    def _get_ordered_applicable_rules(self, context: RuleContext) -> List[BaseBusinessRule]:
-        """Obtiene reglas aplicables ordenadas por prioridad"""
-        applicable_rules = self.registry.get_applicable_rules(context)
-        return sorted(applicable_rules, key=lambda r: r.priority.value)
+    async def enrich_order_data_async(
+        self,
+        context: RuleContext,
+        rule_set: Optional[RuleSet] = None,
+        deadline: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """Como enrich_order_data, esperando a las reglas asíncronas (ver _execute_by_tier)"""
+        enrichment_rules = self._applicable_rules(self._rule_set(rule_set), context, RuleType.ENRICHMENT)
+        
+        enriched_data = {}
+        for _, result, _ in await self._execute_by_tier(enrichment_rules, context, deadline):
+            if result is not None and result.success:
+                enriched_data.update(result.metadata_updates)
+        
+        return enriched_data
 
 
 # Instancias globales
 business_rule_registry = BusinessRuleRegistry()
-business_rule_evaluator = BusinessRuleEvaluator(business_rule_registry)
\ No newline at end of file
+business_rule_evaluator = BusinessRuleEvaluator(
+    business_rule_registry, RuleMetrics() if metrics_enabled() else None
+)
\ No newline at end of file
@@ -0,0 +1,185 @@
+# app/business_rules/metrics.py
+
+"""
+Métricas por regla del evaluador: llamadas a applies_to, coincidencias,
+ejecuciones, fallos e histogramas de latencia.
+
+Cada regla tiene un RuleStats con contadores enteros e histogramas de largo
+fijo, creado al publicarse el RuleSet que la contiene; el camino caliente
+solo hace una búsqueda en un dict y sumas, sin asignar memoria.
+"""
+
+import os
+from bisect import bisect_left
+from time import perf_counter_ns
+from typing import Any, Dict, Iterable, List, Optional
+
+from app.business_rules.base import BaseBusinessRule
+
+
+# Límites superiores de los buckets de latencia (microsegundos); el último
+# bucket, sin límite, acumula lo que los supera
+LATENCY_BUCKETS_US = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 50000)
+_BUCKET_BOUNDS_NS = tuple(bound * 1000 for bound in LATENCY_BUCKETS_US)
+
+PERCENTILES = (0.5, 0.95, 0.99)
+
+
+class LatencyHistogram:
+    """Histograma de latencias con buckets fijos"""
+
+    __slots__ = ("counts", "count", "total_ns", "max_ns")
+
+    def __init__(self):
+        self.counts = [0] * (len(_BUCKET_BOUNDS_NS) + 1)
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+
+    def observe(self, elapsed_ns: int):
+        self.counts[bisect_left(_BUCKET_BOUNDS_NS, elapsed_ns)] += 1
+        self.count += 1
+        self.total_ns += elapsed_ns
+        if elapsed_ns > self.max_ns:
+            self.max_ns = elapsed_ns
+
+    def percentile_us(self, quantile: float) -> Optional[float]:
+        """Límite superior del bucket que contiene el percentil"""
+        if not self.count:
+            return None
+        target = quantile * self.count
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= target:
+                if index < len(LATENCY_BUCKETS_US):
+                    return float(LATENCY_BUCKETS_US[index])
+                return round(self.max_ns / 1000, 1)
+        return round(self.max_ns / 1000, 1)
+
+    def snapshot(self, buckets: bool = False) -> Dict[str, Any]:
+        data = {
+            "count": self.count,
+            "avg_us": round(self.total_ns / self.count / 1000, 2) if self.count else None,
+            "max_us": round(self.max_ns / 1000, 1) if self.count else None,
+            **{f"p{int(q * 100)}_us": self.percentile_us(q) for q in PERCENTILES},
+        }
+        if buckets:
+            labels = [f"le_{bound}" for bound in LATENCY_BUCKETS_US] + ["inf"]
+            data["buckets"] = dict(zip(labels, self.counts))
+        return data
+
+
+class RuleStats:
+    """Contadores e histogramas de una regla"""
+
+    __slots__ = (
+        "rule_id", "applies_calls", "matches", "executions", "failures",
+        "applies_latency", "execution_latency",
+    )
+
+    def __init__(self, rule_id: str):
+        self.rule_id = rule_id
+        self.applies_calls = 0
+        self.matches = 0
+        self.executions = 0
+        self.failures = 0
+        self.applies_latency = LatencyHistogram()
+        self.execution_latency = LatencyHistogram()
+
+    def observe_applies(self, matched: bool, elapsed_ns: int):
+        self.applies_calls += 1
+        if matched:
+            self.matches += 1
+        self.applies_latency.observe(elapsed_ns)
+
+    def observe_execution(self, success: bool, elapsed_ns: int):
+        self.executions += 1
+        if not success:
+            self.failures += 1
+        self.execution_latency.observe(elapsed_ns)
+
+    def snapshot(self, buckets: bool = False) -> Dict[str, Any]:
+        return {
+            "rule_id": self.rule_id,
+            "applies_calls": self.applies_calls,
+            "matches": self.matches,
+            "hit_rate": round(self.matches / self.applies_calls, 4) if self.applies_calls else None,
+            "executions": self.executions,
+            "failures": self.failures,
+            "applies_latency": self.applies_latency.snapshot(buckets),
+            "execution_latency": self.execution_latency.snapshot(buckets),
+        }
+
+
+class RuleMetrics:
+    """Métricas de todas las reglas, por rule_id (sobreviven a nuevas versiones)"""
+
+    def __init__(self):
+        self._stats: Dict[str, RuleStats] = {}
+
+    def prepare(self, rules: Iterable[BaseBusinessRule]):
+        """Crear de antemano los contadores de las reglas de un RuleSet"""
+        for rule in rules:
+            if rule.rule_id not in self._stats:
+                self._stats[rule.rule_id] = RuleStats(rule.rule_id)
+
+    def slot(self, rule_id: str) -> RuleStats:
+        stats = self._stats.get(rule_id)
+        if stats is None:
+            stats = self._stats[rule_id] = RuleStats(rule_id)
+        return stats
+
+    def applies_to(self, rule: BaseBusinessRule, context) -> bool:
+        """rule.applies_to(context), medido"""
+        started = perf_counter_ns()
+        matched = rule.applies_to(context)
+        self.slot(rule.rule_id).observe_applies(matched, perf_counter_ns() - started)
+        return matched
+
+    def call(self, rule: BaseBusinessRule, method, *args):
+        """
+        Ejecutar un método de la regla (execute, filter_events) midiendo su
+        latencia. Un RuleResult con success=False o una excepción cuentan
+        como fallo; la excepción se propaga.
+        """
+        stats = self.slot(rule.rule_id)
+        started = perf_counter_ns()
+        try:
+            result = method(*args)
+        except Exception:
+            stats.observe_execution(False, perf_counter_ns() - started)
+            raise
+        stats.observe_execution(getattr(result, "success", True), perf_counter_ns() - started)
+        return result
+
+    async def call_async(self, rule: BaseBusinessRule, method, *args):
+        """Como call, para execute_async (un timeout/cancelación cuenta como fallo)"""
+        stats = self.slot(rule.rule_id)
+        started = perf_counter_ns()
+        try:
+            result = await method(*args)
+        except BaseException:
+            stats.observe_execution(False, perf_counter_ns() - started)
+            raise
+        stats.observe_execution(getattr(result, "success", True), perf_counter_ns() - started)
+        return result
+
+    def reset(self):
+        """Reiniciar todos los contadores"""
+        for rule_id in list(self._stats):
+            self._stats[rule_id] = RuleStats(rule_id)
+
+    def snapshot(self, rule_ids: Optional[Iterable[str]] = None, buckets: bool = False) -> List[Dict[str, Any]]:
+        """Métricas por regla, de la más costosa a la más barata (tiempo total)"""
+        ids = list(rule_ids) if rule_ids is not None else list(self._stats)
+        stats = [self.slot(rule_id) for rule_id in ids]
+        stats.sort(
+            key=lambda s: s.applies_latency.total_ns + s.execution_latency.total_ns,
+            reverse=True
+        )
+        return [s.snapshot(buckets) for s in stats]
+
+
+def metrics_enabled() -> bool:
+    return os.getenv("RULE_METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
@@ -4,16 +4,27 @@
 Reglas de negocio específicas para el sistema Sainapsis.
 """
 
-from typing import List
+import logging
+from typing import List, Dict, Any, Tuple
 from app.business_rules.base import (
+    AsyncBusinessRule,
     EventFilterRule, 
     BusinessLogicRule,
     EnrichmentRule,
     RuleContext, 
     RuleResult, 
-    RulePriority
+    RulePriority,
+    RuleType,
+    BatchEffect
 )
 from app.models.domain import EventType, OrderState
+from app.repositories.support_repository import support_repository
+from app.utils.logger import sampler
+
+logger = logging.getLogger(__name__)
+
+# Muestreo del aviso de país de alto riesgo (se repite en cada petición)
+_log_high_risk = sampler()
 
 
 # =============================================================================
@@ -26,6 +37,9 @@ class SainapsisSmallOrderRule(EventFilterRule):
     Órdenes de $20 o menos no requieren verificación biométrica
     """
     
+    applicable_states = frozenset({OrderState.PENDING})
+    memo_inputs = frozenset({"amount"})
+    
     def __init__(self, threshold: float = 20.0):
         super().__init__(
             rule_id="sainapsis_small_order_no_verification",
@@ -34,6 +48,18 @@ class SainapsisSmallOrderRule(EventFilterRule):
         )
         self.threshold = threshold
     
+    def config_params(self) -> Dict[str, Any]:
+        return {"threshold": self.threshold}
+    
+    def amount_breakpoints(self) -> Tuple[float, ...]:
+        return (self.threshold,)
+    
+    def batch_applies(self, batch):
+        return batch.amount_compare("lte", self.threshold)
+    
+    def batch_effect(self) -> BatchEffect:
+        return BatchEffect(remove_events=frozenset({EventType.PENDING_BIOMETRICAL_VERIFICATION}))
+    
     def applies_to(self, context: RuleContext) -> bool:
         """Solo aplica a órdenes PENDING con monto pequeño"""
         return (
@@ -53,8 +79,7 @@ class SainapsisSmallOrderRule(EventFilterRule):
         
         # Log para debugging
         if EventType.PENDING_BIOMETRICAL_VERIFICATION in available_events:
-            was_removed = EventType.PENDING_BIOMETRICAL_VERIFICATION not in filtered
-            print(f"🔍 Small order rule: ${context.order.amount} - Verification {'removed' if was_removed else 'kept'}")
+            logger.debug("🔍 Small order rule: $%s - Verification removed", context.order.amount)
         
         return filtered
 
@@ -68,6 +93,8 @@ class SainapsisHighValuePaymentFailedRule(BusinessLogicRule):
     Integra tu regla existente: Órdenes > $1000 con pago fallido crean ticket
     """
     
+    applicable_events = frozenset({EventType.PAYMENT_FAILED})
+    
     def __init__(self):
         super().__init__(
             rule_id="sainapsis_high_value_payment_failed",
@@ -81,6 +108,12 @@ class SainapsisHighValuePaymentFailedRule(BusinessLogicRule):
             context.order.amount > 1000.0
         )
     
+    def batch_applies(self, batch):
+        return batch.amount_compare("gt", 1000.0)
+    
+    def batch_effect(self) -> BatchEffect:
+        return BatchEffect(creates_ticket=True)
+    
     def execute(self, context: RuleContext) -> RuleResult:
         priority = "high" if context.order.amount > 2000 else "medium"
         
@@ -108,6 +141,8 @@ class SainapsisUltraHighValueReviewRule(BusinessLogicRule):
     Integra tu regla existente: Órdenes > $5000 requieren revisión manual
     """
     
+    applicable_events = frozenset({EventType.PAYMENT_SUCCESSFUL})
+    
     def __init__(self):
         super().__init__(
             rule_id="sainapsis_ultra_high_value_review",
@@ -121,6 +156,12 @@ class SainapsisUltraHighValueReviewRule(BusinessLogicRule):
             context.order.amount > 5000.0
         )
     
+    def batch_applies(self, batch):
+        return batch.amount_compare("gt", 5000.0)
+    
+    def batch_effect(self) -> BatchEffect:
+        return BatchEffect(creates_ticket=True)
+    
     def execute(self, context: RuleContext) -> RuleResult:
         requires_manager = context.order.amount > 10000
         
@@ -182,6 +223,12 @@ class SainapsisCountryTaxRule(EnrichmentRule):
         country_code = context.get_country_code()
         return country_code is not None and country_code in self.TAX_RATES
     
+    def batch_applies(self, batch):
+        return batch.country_in(self.TAX_RATES)
+    
+    def batch_effect(self) -> BatchEffect:
+        return BatchEffect()
+    
     def execute(self, context: RuleContext) -> RuleResult:
         country_code = context.get_country_code()
         tax_config = self.TAX_RATES[country_code]
@@ -214,6 +261,8 @@ class SainapsisHighRiskCountryRule(EventFilterRule):
     
     HIGH_RISK_COUNTRIES = {"VE", "AF", "IQ", "SY", "KP"}  # Ejemplo
     
+    applicable_states = frozenset({OrderState.PENDING})
+    
     def __init__(self):
         super().__init__(
             rule_id="sainapsis_high_risk_country_verification",
@@ -228,6 +277,15 @@ class SainapsisHighRiskCountryRule(EventFilterRule):
             context.order.state == OrderState.PENDING
         )
     
+    def batch_applies(self, batch):
+        return batch.country_in(self.HIGH_RISK_COUNTRIES)
+    
+    def batch_effect(self) -> BatchEffect:
+        return BatchEffect(
+            remove_events=frozenset({EventType.NO_VERIFICATION_NEEDED}),
+            add_events=frozenset({EventType.PENDING_BIOMETRICAL_VERIFICATION})
+        )
+    
     def filter_events(self, available_events: List[EventType], context: RuleContext) -> List[EventType]:
         """
         Para países de alto riesgo, siempre requerir verificación
@@ -243,8 +301,11 @@ class SainapsisHighRiskCountryRule(EventFilterRule):
             if event != EventType.NO_VERIFICATION_NEEDED
         ]
         
-        country_code = context.get_country_code()
-        print(f"🚨 High-risk country {country_code}: Verification required regardless of amount")
+        if _log_high_risk():
+            logger.info(
+                "🚨 High-risk country %s: Verification required regardless of amount",
+                context.get_country_code()
+            )
         
         return filtered
 
@@ -271,6 +332,15 @@ class SainapsisReviewingStateRule(BusinessLogicRule):
             context.order.state == OrderState.REVIEWING
         )
     
+    def batch_applies(self, batch):
+        return (
+            batch.event_in({EventType.MANUAL_REVIEW_REQUIRED}) |
+            batch.state_in({OrderState.REVIEWING})
+        )
+    
+    def batch_effect(self) -> BatchEffect:
+        return BatchEffect()
+    
     def execute(self, context: RuleContext) -> RuleResult:
         actions = []
         metadata_updates = {}
@@ -306,6 +376,9 @@ class SainapsisWeekendOrderRule(EventFilterRule):
     Ejemplo: Los fines de semana solo se permiten órdenes pequeñas
     """
     
+    applicable_states = frozenset({OrderState.PENDING})
+    memo_inputs = frozenset({"amount", "weekday"})
+    
     def __init__(self, weekend_threshold: float = 500.0):
         super().__init__(
             rule_id="sainapsis_weekend_order_restriction",
@@ -315,6 +388,12 @@ class SainapsisWeekendOrderRule(EventFilterRule):
         self.weekend_threshold = weekend_threshold
         self.enabled = False  # Deshabilitada por defecto
     
+    def config_params(self) -> Dict[str, Any]:
+        return {"weekend_threshold": self.weekend_threshold}
+    
+    def amount_breakpoints(self) -> Tuple[float, ...]:
+        return (self.weekend_threshold,)
+    
     def applies_to(self, context: RuleContext) -> bool:
         from datetime import datetime
         now = datetime.utcnow()
@@ -323,6 +402,16 @@ class SainapsisWeekendOrderRule(EventFilterRule):
         
         return is_weekend and is_large_order and context.order.state == OrderState.PENDING
     
+    def batch_applies(self, batch):
+        return batch.is_weekend() & batch.amount_compare("gt", self.weekend_threshold)
+    
+    def batch_effect(self) -> BatchEffect:
+        # Solo queda la cancelación por el usuario
+        return BatchEffect(
+            remove_events=frozenset(EventType),
+            add_events=frozenset({EventType.ORDER_CANCELLED_BY_USER})
+        )
+    
     def filter_events(self, available_events: List[EventType], context: RuleContext) -> List[EventType]:
         # Solo permitir cancelación los fines de semana para órdenes grandes
         return [EventType.ORDER_CANCELLED_BY_USER]
@@ -337,6 +426,9 @@ class SainapsisWeekendOrderEnrichmentRule(EnrichmentRule):
     Enriquecimiento para órdenes grandes en fines de semana
     """
     
+    applicable_states = frozenset({OrderState.PENDING})
+    memo_inputs = frozenset({"amount", "weekday"})
+    
     def __init__(self, weekend_threshold: float = 500.0):
         super().__init__(
             rule_id="sainapsis_weekend_order_enrichment", 
@@ -345,6 +437,12 @@ class SainapsisWeekendOrderEnrichmentRule(EnrichmentRule):
         )
         self.weekend_threshold = weekend_threshold
     
+    def config_params(self) -> Dict[str, Any]:
+        return {"weekend_threshold": self.weekend_threshold}
+    
+    def amount_breakpoints(self) -> Tuple[float, ...]:
+        return (self.weekend_threshold,)
+    
     def applies_to(self, context: RuleContext) -> bool:
         from datetime import datetime
         now = datetime.utcnow()
@@ -356,6 +454,12 @@ class SainapsisWeekendOrderEnrichmentRule(EnrichmentRule):
             context.order.state == OrderState.PENDING
         )
     
+    def batch_applies(self, batch):
+        return batch.is_weekend() & batch.amount_compare("gt", self.weekend_threshold)
+    
+    def batch_effect(self) -> BatchEffect:
+        return BatchEffect()
+    
     def execute(self, context: RuleContext) -> RuleResult:
         metadata_updates = {
             "weekend_order": True,
@@ -368,5 +472,76 @@ class SainapsisWeekendOrderEnrichmentRule(EnrichmentRule):
             actions=["Enriched weekend order with additional metadata"],
             metadata_updates=metadata_updates
         )
+
+
+# =============================================================================
+# REGLAS CON I/O (asíncronas)
+# =============================================================================
+
+class SainapsisOpenTicketsFollowUpRule(AsyncBusinessRule):
+    """
+    Órdenes que se confirman con tickets de soporte abiertos: marcar para
+    seguimiento. Consulta support_tickets; si la consulta no responde a
+    tiempo, la orden se confirma sin la marca (fallback).
+    """
+    
+    applicable_events = frozenset({EventType.PAYMENT_SUCCESSFUL})
+    # La marca de seguimiento se guarda en la orden
+    persist_metadata = True
+    
+    def __init__(self, timeout: float = 0.2):
+        super().__init__(
+            rule_id="sainapsis_open_tickets_follow_up",
+            description="Flag confirmed orders that still have open support tickets",
+            rule_type=RuleType.BUSINESS_LOGIC,
+            priority=RulePriority.MEDIUM,
+            timeout=timeout
+        )
+    
+    def config_params(self) -> Dict[str, Any]:
+        return {"timeout": self.timeout}
+    
+    def applies_to(self, context: RuleContext) -> bool:
+        return context.event_type == EventType.PAYMENT_SUCCESSFUL
+    
+    def batch_applies(self, batch):
+        # El evento ya lo filtra el evaluador
+        return batch.all_rows()
+    
+    def batch_effect(self) -> BatchEffect:
+        # Solo marca metadata: nunca crea tickets ni cambia eventos
+        return BatchEffect()
+    
+    async def execute_async(self, context: RuleContext) -> RuleResult:
+        open_tickets = await support_repository.count_open_tickets(context.order.id)
+        if not open_tickets:
+            return RuleResult(success=True)
         
-    
\ No newline at end of file
+        return RuleResult(
+            success=True,
+            actions=[f"Order confirmed with {open_tickets} open support ticket(s)"],
+            metadata_updates={
+                "open_support_tickets": open_tickets,
+                "requires_support_follow_up": True
+            }
+        )
+
+
+# =============================================================================
+# CATÁLOGO: nombre de clase -> clase, para compilar reglas desde configuración
+# =============================================================================
+
+SAINAPSIS_RULE_CATALOG = {
+    rule_class.__name__: rule_class
+    for rule_class in (
+        SainapsisSmallOrderRule,
+        SainapsisHighValuePaymentFailedRule,
+        SainapsisUltraHighValueReviewRule,
+        SainapsisCountryTaxRule,
+        SainapsisHighRiskCountryRule,
+        SainapsisReviewingStateRule,
+        SainapsisWeekendOrderRule,
+        SainapsisWeekendOrderEnrichmentRule,
+        SainapsisOpenTicketsFollowUpRule,
+    )
+}
@@ -0,0 +1,318 @@
+# app/business_rules/ruleset.py
+
+"""
+Conjuntos de reglas inmutables y versionados.
+
+Un RuleSet es una foto fija de las reglas: sus reglas quedan congeladas y la
+tabla de despacho se calcula una sola vez al construirlo. Los cambios
+(habilitar, ajustar parámetros, cargar configuración) construyen un RuleSet
+nuevo con otra versión (copy-on-write) y el registro lo publica de forma
+atómica; cada evaluación usa de principio a fin el RuleSet que tomó.
+"""
+
+import json
+import os
+from datetime import datetime
+from types import MappingProxyType
+from typing import Any, Dict, FrozenSet, Iterable, List, Mapping, Optional, Tuple, Type
+
+from app.business_rules.base import BaseBusinessRule, RuleContext, RuleType, RuleSetConfigError
+from app.business_rules.dsl import AmountBands, DslRule
+from app.models.domain import EventType, OrderState
+
+try:
+    import yaml
+except ImportError:  # pragma: no cover - PyYAML es opcional
+    yaml = None
+
+
+# Clave de la tabla de despacho: (tipo de regla o None, estado, evento o None)
+DispatchKey = Tuple[Optional[RuleType], OrderState, Optional[EventType]]
+
+
+def _build_dispatch(rules: Iterable[BaseBusinessRule]) -> Dict[DispatchKey, Tuple[BaseBusinessRule, ...]]:
+    """
+    Para cada (tipo, estado, evento), las reglas habilitadas candidatas
+    ordenadas por prioridad (orden de declaración en empates)
+    """
+    enabled_rules = sorted(
+        (rule for rule in rules if rule.is_enabled()),
+        key=lambda r: r.priority.value
+    )
+    rule_types = [None, *RuleType]
+    events = [None, *EventType]
+
+    dispatch = {}
+    for state in OrderState:
+        state_rules = [
+            rule for rule in enabled_rules
+            if rule.applicable_states is None or state in rule.applicable_states
+        ]
+        for event in events:
+            event_rules = [
+                rule for rule in state_rules
+                if rule.applicable_events is None or event in rule.applicable_events
+            ]
+            for rule_type in rule_types:
+                dispatch[(rule_type, state, event)] = tuple(
+                    rule for rule in event_rules
+                    if rule_type is None or rule.rule_type == rule_type
+                )
+    return dispatch
+
+
+# Plan de memoización del filtrado: datos del contexto que lo determinan y
+# tramos de monto; None si alguna regla candidata no declara memo_inputs
+FilterMemoPlan = Optional[Tuple[FrozenSet[str], AmountBands]]
+
+
+def _build_filter_plans(
+    dispatch: Dict[DispatchKey, Tuple[BaseBusinessRule, ...]]
+) -> Dict[Tuple[OrderState, Optional[EventType]], FilterMemoPlan]:
+    """Para cada (estado, evento), qué determina el resultado de las reglas de filtro"""
+    plans = {}
+    for (rule_type, state, event), rules in dispatch.items():
+        if rule_type is not RuleType.EVENT_FILTER:
+            continue
+        if any(rule.memo_inputs is None for rule in rules):
+            plans[(state, event)] = None
+            continue
+        inputs = frozenset().union(*(rule.memo_inputs for rule in rules))
+        bands = AmountBands([b for rule in rules for b in rule.amount_breakpoints()])
+        plans[(state, event)] = (inputs, bands)
+    return plans
+
+
+class RuleSet:
+    """Foto inmutable y versionada de las reglas de negocio"""
+
+    def __init__(self, version: int, rules: Iterable[BaseBusinessRule], source: str = "manual"):
+        rules = tuple(rules)
+
+        rules_by_id = {}
+        for rule in rules:
+            if rule.rule_id in rules_by_id:
+                raise RuleSetConfigError(f"Duplicate rule id '{rule.rule_id}'")
+            rules_by_id[rule.rule_id] = rule
+            rule.freeze()
+
+        self.version = version
+        self.source = source
+        self.created_at = datetime.utcnow()
+        self.rules = rules
+        self._rules_by_id: Mapping[str, BaseBusinessRule] = MappingProxyType(rules_by_id)
+        self._dispatch = _build_dispatch(rules)
+        self._filter_plans = _build_filter_plans(self._dispatch)
+
+    # ------------------------------------------------------------------
+    # Consultas
+    # ------------------------------------------------------------------
+
+    def get_rule(self, rule_id: str) -> Optional[BaseBusinessRule]:
+        """Regla por ID (habilitada o no)"""
+        return self._rules_by_id.get(rule_id)
+
+    def get_all_rules(self) -> List[BaseBusinessRule]:
+        """Reglas habilitadas"""
+        return [rule for rule in self.rules if rule.is_enabled()]
+
+    def get_rules_by_type(self, rule_type: RuleType) -> List[BaseBusinessRule]:
+        """Reglas habilitadas de un tipo"""
+        return [rule for rule in self.rules if rule.is_enabled() and rule.rule_type == rule_type]
+
+    def get_candidate_rules(
+        self,
+        state: OrderState,
+        event_type: Optional[EventType] = None,
+        rule_type: Optional[RuleType] = None
+    ) -> Tuple[BaseBusinessRule, ...]:
+        """Reglas habilitadas que pueden aplicar a (estado, evento), ordenadas por prioridad"""
+        return self._dispatch[(rule_type, state, event_type)]
+
+    def get_applicable_rules(self, context: RuleContext, rule_type: Optional[RuleType] = None) -> List[BaseBusinessRule]:
+        """Reglas aplicables a un contexto, ordenadas por prioridad"""
+        candidates = self.get_candidate_rules(context.order.state, context.event_type, rule_type)
+        return [rule for rule in candidates if rule.applies_to(context)]
+
+    def filter_memo_key(self, context: RuleContext, available_events: List[EventType]) -> Optional[Tuple]:
+        """
+        Clave compacta que determina el resultado del filtrado de eventos
+        (None si alguna regla candidata no es memoizable).
+
+        El monto entra como tramo entre los umbrales de las reglas candidatas,
+        no como valor, así órdenes distintas comparten la entrada.
+        """
+        plan = self._filter_plans[(context.order.state, context.event_type)]
+        if plan is None:
+            return None
+        inputs, bands = plan
+        return (
+            self.version,
+            context.order.state,
+            context.event_type,
+            bands.band_of(context.order.amount) if "amount" in inputs else None,
+            context.get_country_code() if "country" in inputs else None,
+            datetime.utcnow().weekday() if "weekday" in inputs else None,
+            tuple(available_events),
+        )
+
+    def list_rules_info(self) -> List[Dict[str, Any]]:
+        """Información de todas las reglas del conjunto"""
+        return [
+            {
+                "rule_id": rule.rule_id,
+                "description": rule.description,
+                "type": rule.rule_type.value,
+                "priority": rule.priority.value,
+                "enabled": rule.is_enabled()
+            }
+            for rule in self.rules
+        ]
+
+    def to_config(self) -> Dict[str, Any]:
+        """Configuración equivalente (formato de compile_rule_set)"""
+        return {"version": self.version, "rules": [rule.config_entry() for rule in self.rules]}
+
+    # ------------------------------------------------------------------
+    # Copy-on-write: cada cambio produce un RuleSet nuevo
+    # ------------------------------------------------------------------
+
+    def _require(self, rule_id: str) -> BaseBusinessRule:
+        rule = self.get_rule(rule_id)
+        if rule is None:
+            raise KeyError(rule_id)
+        return rule
+
+    def with_rule(self, rule: BaseBusinessRule, version: int, source: str = "register") -> "RuleSet":
+        """Agregar (o reemplazar) una regla"""
+        if rule.rule_id in self._rules_by_id:
+            rules = [rule if r.rule_id == rule.rule_id else r for r in self.rules]
+        else:
+            rules = [*self.rules, rule]
+        return RuleSet(version, rules, source)
+
+    def without_rule(self, rule_id: str, version: int, source: str = "unregister") -> "RuleSet":
+        """Quitar una regla"""
+        self._require(rule_id)
+        return RuleSet(version, [r for r in self.rules if r.rule_id != rule_id], source)
+
+    def with_rule_enabled(self, rule_id: str, enabled: bool, version: int) -> "RuleSet":
+        """Habilitar/deshabilitar una regla sin tocar la instancia publicada"""
+        rule = self._require(rule_id).clone()
+        rule.enabled = enabled
+        action = "enable" if enabled else "disable"
+        return self.with_rule(rule, version, source=f"{action}:{rule_id}")
+
+    def with_rule_params(self, rule_id: str, params: Dict[str, Any], version: int) -> "RuleSet":
+        """Reconstruir una regla con parámetros nuevos"""
+        current = self._require(rule_id)
+        if isinstance(current, DslRule):
+            definition = {**current.definition, **params.get("definition", params)}
+            rule = DslRule(definition)
+            rule.enabled = current.enabled
+            return self.with_rule(rule, version, source=f"params:{rule_id}")
+        rule = _instantiate(type(current), {**current.config_params(), **params}, current.enabled)
+        return self.with_rule(rule, version, source=f"params:{rule_id}")
+
+
+def _instantiate(rule_class: Type[BaseBusinessRule], params: Dict[str, Any], enabled: bool) -> BaseBusinessRule:
+    try:
+        rule = rule_class(**params)
+    except TypeError as e:
+        raise RuleSetConfigError(f"Invalid params for {rule_class.__name__}: {e}")
+    rule.enabled = enabled
+    return rule
+
+
+def compile_rule_set(
+    config: Dict[str, Any],
+    catalog: Mapping[str, Type[BaseBusinessRule]],
+    version: int,
+    source: str = "config"
+) -> RuleSet:
+    """
+    Compilar un RuleSet desde configuración:
+
+        rules:
+          - rule: SainapsisSmallOrderRule   # clase registrada en el catálogo
+            params: {threshold: 20.0}       # argumentos del constructor
+            enabled: true                   # opcional (por defecto el de la clase)
+
+          - id: mi_regla                    # regla declarativa (ver dsl.py)
+            when: {...}
+            then: {...}
+    """
+    if not isinstance(config, dict) or not isinstance(config.get("rules"), list):
+        raise RuleSetConfigError("Config must be a mapping with a 'rules' list")
+
+    rules = []
+    for index, entry in enumerate(config["rules"]):
+        if isinstance(entry, dict) and "id" in entry and "rule" not in entry:
+            rules.append(DslRule(entry))
+            continue
+
+        if not isinstance(entry, dict) or "rule" not in entry:
+            raise RuleSetConfigError(f"Rule #{index} must be a mapping with a 'rule' or 'id' key")
+
+        unknown_keys = set(entry) - {"rule", "params", "enabled"}
+        if unknown_keys:
+            raise RuleSetConfigError(f"Rule #{index} has unknown keys: {sorted(unknown_keys)}")
+
+        rule_class = catalog.get(entry["rule"])
+        if rule_class is None:
+            raise RuleSetConfigError(f"Unknown rule '{entry['rule']}'")
+
+        params = entry.get("params") or {}
+        if not isinstance(params, dict):
+            raise RuleSetConfigError(f"Rule #{index} params must be a mapping")
+
+        rule = _instantiate(rule_class, params, enabled=True)
+        if "enabled" in entry:
+            rule.enabled = bool(entry["enabled"])
+        rules.append(rule)
+
+    return RuleSet(version, rules, source)
+
+
+def build_candidate_rule_set(
+    baseline: RuleSet,
+    catalog: Mapping[str, Type[BaseBusinessRule]],
+    config: Optional[Dict[str, Any]] = None,
+    params: Optional[Dict[str, Dict[str, Any]]] = None,
+    enabled: Optional[Dict[str, bool]] = None,
+) -> RuleSet:
+    """
+    RuleSet candidato: una configuración completa y/o cambios sobre el vigente
+    (params por regla, reglas habilitadas/deshabilitadas). No se publica
+    """
+    version = baseline.version + 1
+    if config is not None:
+        candidate = compile_rule_set(config, catalog, version, source="candidate")
+    else:
+        # Las reglas publicadas son inmutables: se comparten
+        candidate = RuleSet(version, baseline.rules, source="candidate")
+
+    for rule_id, rule_params in (params or {}).items():
+        candidate = candidate.with_rule_params(rule_id, rule_params, version)
+    for rule_id, rule_enabled in (enabled or {}).items():
+        candidate = candidate.with_rule_enabled(rule_id, rule_enabled, version)
+    return candidate
+
+
+def load_rule_config(path: str) -> Dict[str, Any]:
+    """Leer configuración de reglas desde un archivo YAML o JSON"""
+    if not os.path.exists(path):
+        raise RuleSetConfigError(f"Rules config file not found: {path}")
+
+    with open(path, "r", encoding="utf-8") as config_file:
+        if path.endswith((".yaml", ".yml")):
+            if yaml is None:
+                raise RuleSetConfigError("PyYAML is required to load YAML rule configs")
+            try:
+                return yaml.safe_load(config_file)
+            except yaml.YAMLError as e:
+                raise RuleSetConfigError(f"Invalid YAML in {path}: {e}")
+        try:
+            return json.load(config_file)
+        except ValueError as e:
+            raise RuleSetConfigError(f"Invalid JSON in {path}: {e}")
@@ -0,0 +1,316 @@
+# app/business_rules/shadow.py
+
+"""
+Evaluación en sombra de un RuleSet candidato sobre el tráfico real.
+
+Las peticiones v2 solo encolan lo que decidió el RuleSet vigente (eventos
+filtrados) o el contexto de las reglas de negocio; un worker en segundo plano evalúa
+el candidato sobre el mismo contexto y compara. La cola está acotada: si el
+worker se atrasa, las muestras se descartan en lugar de acumularse, así que
+la sombra nunca añade latencia ni memoria sin límite a la petición.
+
+Las reglas de negocio se comparan sin las reglas asíncronas: consultan la
+base, y cuando el worker evalúa la muestra la transición ya hizo commit, así
+que verían un estado distinto al de la petición. El worker evalúa ambos
+RuleSets por el camino síncrono (puro sobre el contexto) y compara eso.
+
+Los desacuerdos se guardan en un log compacto (últimos N) y en contadores
+por regla.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional, Sequence
+
+from app.business_rules.base import AsyncBusinessRule, BaseBusinessRule, RuleContext, RuleType
+from app.business_rules.engine import BusinessRuleEvaluator, business_rule_registry
+from app.business_rules.ruleset import RuleSet
+from app.models.domain import EventType
+
+logger = logging.getLogger(__name__)
+
+
+# Muestras pendientes como máximo; las que no caben se descartan
+SHADOW_QUEUE_SIZE = int(os.getenv("SHADOW_QUEUE_SIZE", "1000"))
+
+# Fracción del tráfico que se evalúa en sombra (0.0 - 1.0)
+SHADOW_SAMPLE_RATE = float(os.getenv("SHADOW_SAMPLE_RATE", "1.0"))
+
+# Desacuerdos recientes que se conservan en el log
+SHADOW_LOG_SIZE = int(os.getenv("SHADOW_LOG_SIZE", "200"))
+
+
+def _same_rule(a: Optional[BaseBusinessRule], b: Optional[BaseBusinessRule]) -> bool:
+    """Misma regla con la misma configuración en ambos RuleSets"""
+    if a is b:
+        return True
+    if a is None or b is None:
+        return False
+    return type(a) is type(b) and a.config_entry() == b.config_entry()
+
+
+def _business_signature(results: Dict[str, Any]) -> Dict[str, Any]:
+    """Resumen comparable del resultado de evaluate_business_logic"""
+    return {
+        "executed_rules": sorted(results.get("executed_rules", [])),
+        "tickets": sorted(ticket.get("reason", "") for ticket in results.get("support_tickets", [])),
+        "metadata_updates": json.loads(
+            json.dumps(results.get("metadata_updates", {}), sort_keys=True, default=str)
+        ),
+    }
+
+
+class ShadowEvaluator:
+    """Evalúa un RuleSet candidato fuera del camino de la petición"""
+
+    def __init__(
+        self,
+        evaluator: BusinessRuleEvaluator,
+        queue_size: int = SHADOW_QUEUE_SIZE,
+        sample_rate: float = SHADOW_SAMPLE_RATE,
+        log_size: int = SHADOW_LOG_SIZE,
+    ):
+        self.evaluator = evaluator
+        self.queue_size = queue_size
+        self.sample_rate = sample_rate
+        self.candidate: Optional[RuleSet] = None
+        # Versión vigente sobre la que se construyó el candidato
+        self.candidate_baseline_version: Optional[int] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self.log: Deque[Dict[str, Any]] = deque(maxlen=log_size)
+        self._reset()
+
+    def _reset(self):
+        """Reiniciar contadores y log (al cambiar de candidato)"""
+        self.started_at = datetime.utcnow()
+        self.submitted = 0
+        self.sampled_out = 0
+        self.dropped = 0
+        self.evaluated = 0
+        self.agreements = 0
+        self.disagreements = 0
+        self.errors = 0
+        self.rule_disagreements: Dict[str, int] = {}
+        self.log.clear()
+
+    def _drain(self):
+        """Descartar las muestras pendientes del candidato anterior"""
+        if self._queue is None:
+            return
+        while not self._queue.empty():
+            self._queue.get_nowait()
+            self._queue.task_done()
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    @property
+    def active(self) -> bool:
+        return self.running and self.candidate is not None
+
+    # ------------------------------------------------------------------
+    # Candidato
+    # ------------------------------------------------------------------
+
+    def set_candidate(self, rule_set: RuleSet, baseline_version: int):
+        """
+        Empezar a evaluar un candidato construido sobre la versión
+        baseline_version (reinicia las estadísticas). Cada muestra se compara
+        con la versión que usó su petición, que puede ser posterior
+        """
+        self._drain()
+        self.candidate = rule_set
+        self.candidate_baseline_version = baseline_version
+        self._reset()
+        logger.info(
+            "👥 Shadow evaluation started for candidate rule set (%s, built on v%s)",
+            rule_set.source, baseline_version
+        )
+
+    def clear_candidate(self):
+        """Dejar de evaluar en sombra"""
+        self._drain()
+        self.candidate = None
+        self.candidate_baseline_version = None
+        logger.info("👥 Shadow evaluation stopped")
+
+    # ------------------------------------------------------------------
+    # Muestras (camino de la petición: sin evaluar nada)
+    # ------------------------------------------------------------------
+
+    def _offer(self, sample: tuple):
+        if not self.active:
+            return
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            self.sampled_out += 1
+            return
+        try:
+            self._queue.put_nowait((self.candidate, *sample))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return
+        self.submitted += 1
+
+    def shadow_filter(
+        self,
+        context: RuleContext,
+        base_events: Sequence[EventType],
+        filtered_events: Sequence[EventType],
+        rule_set: RuleSet,
+    ):
+        """Encolar el filtrado de eventos que decidió el RuleSet vigente"""
+        self._offer(("filter", context, tuple(base_events), tuple(filtered_events), rule_set))
+
+    def shadow_business_logic(self, context: RuleContext, rule_set: RuleSet):
+        """
+        Encolar el contexto de las reglas de negocio: el worker evalúa el
+        RuleSet vigente y el candidato sin reglas asíncronas
+        """
+        self._offer(("business_logic", context, None, None, rule_set))
+
+    # ------------------------------------------------------------------
+    # Worker
+    # ------------------------------------------------------------------
+
+    async def start(self):
+        """Iniciar el worker de la sombra"""
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Detener el worker y descartar lo pendiente"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._queue = None
+
+    async def _run(self):
+        while True:
+            sample = await self._queue.get()
+            try:
+                await self._evaluate(*sample)
+            except Exception as e:
+                self.errors += 1
+                logger.warning("⚠️ Shadow evaluation failed: %s", e)
+            finally:
+                self._queue.task_done()
+            # Ceder el loop entre muestras aunque la cola esté llena
+            await asyncio.sleep(0)
+
+    async def _evaluate(
+        self,
+        candidate: RuleSet,
+        kind: str,
+        context: RuleContext,
+        base_events: Optional[tuple],
+        baseline: Any,
+        baseline_rule_set: RuleSet,
+    ):
+        if kind == "filter":
+            # El candidato no está publicado: no usar el cache de filtrado
+            events = self.evaluator.filter_available_events(
+                list(base_events), context, candidate, memoize=False
+            )
+            agree = set(events) == set(baseline)
+            rule_type = RuleType.EVENT_FILTER
+            baseline_view = [e.value for e in baseline]
+            candidate_view = [e.value for e in events]
+        else:
+            baseline = _business_signature(
+                self.evaluator.evaluate_business_logic(context, baseline_rule_set)
+            )
+            result = _business_signature(self.evaluator.evaluate_business_logic(context, candidate))
+            agree = result == baseline
+            rule_type = RuleType.BUSINESS_LOGIC
+            baseline_view = baseline
+            candidate_view = result
+
+        self.evaluated += 1
+        if agree:
+            self.agreements += 1
+            return
+
+        self.disagreements += 1
+        rules = self._rules_involved(context, baseline_rule_set, candidate, rule_type)
+        for rule_id in rules:
+            self.rule_disagreements[rule_id] = self.rule_disagreements.get(rule_id, 0) + 1
+
+        order = context.order
+        self.log.append({
+            "at": datetime.utcnow().isoformat(),
+            "kind": kind,
+            "order_id": str(order.id),
+            "state": order.state.value,
+            "event_type": context.event_type.value if context.event_type else None,
+            "amount": order.amount,
+            "baseline_version": baseline_rule_set.version,
+            "rules": rules,
+            "baseline": baseline_view,
+            "candidate": candidate_view,
+        })
+
+    @staticmethod
+    def _rules_involved(
+        context: RuleContext, baseline: RuleSet, candidate: RuleSet, rule_type: RuleType
+    ) -> List[str]:
+        """Reglas aplicables en algún lado que no son iguales en ambos RuleSets (sin las asíncronas)"""
+        before = {
+            rule.rule_id: rule for rule in baseline.get_applicable_rules(context, rule_type)
+            if not isinstance(rule, AsyncBusinessRule)
+        }
+        after = {
+            rule.rule_id: rule for rule in candidate.get_applicable_rules(context, rule_type)
+            if not isinstance(rule, AsyncBusinessRule)
+        }
+        return sorted(
+            rule_id for rule_id in before.keys() | after.keys()
+            if not _same_rule(before.get(rule_id), after.get(rule_id))
+        )
+
+    # ------------------------------------------------------------------
+    # Estado
+    # ------------------------------------------------------------------
+
+    def stats(self) -> Dict[str, Any]:
+        """Estado de la sombra y contadores desde que se fijó el candidato"""
+        return {
+            "running": self.running,
+            "active": self.active,
+            "sample_rate": self.sample_rate,
+            "queue_size": self._queue.qsize() if self._queue is not None else 0,
+            "queue_max_size": self.queue_size,
+            "since": self.started_at.isoformat(),
+            "candidate_baseline_version": self.candidate_baseline_version,
+            "submitted": self.submitted,
+            "sampled_out": self.sampled_out,
+            "dropped": self.dropped,
+            "evaluated": self.evaluated,
+            "agreements": self.agreements,
+            "disagreements": self.disagreements,
+            "errors": self.errors,
+            "rule_disagreements": dict(
+                sorted(self.rule_disagreements.items(), key=lambda item: -item[1])
+            ),
+        }
+
+    def recent_disagreements(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """Últimos desacuerdos, del más reciente al más antiguo"""
+        return list(reversed(self.log))[:limit]
+
+
+# Instancia global; su evaluador no registra métricas, así el candidato no
+# se mezcla con las de las reglas vigentes
+shadow_evaluator = ShadowEvaluator(BusinessRuleEvaluator(business_rule_registry))
@@ -0,0 +1,88 @@
+# app/business_rules/shared_config.py
+
+"""
+Conjunto de reglas compartido entre workers.
+
+Cada worker tiene su propio registro y sus versiones son locales: un cambio
+por la API (configuración nueva, recarga del archivo, toggle, parámetros)
+solo cambia el proceso que atendió la petición. Para que todos apliquen el
+mismo conjunto, el worker que publica guarda la configuración completa en
+business_rule_configs y avisa por el bus de invalidación (namespace "rules");
+los demás cargan la última guardada. Al iniciar, cada worker carga también
+la última guardada, si existe, en lugar del archivo.
+"""
+
+import asyncio
+import logging
+from typing import Optional, Set
+
+from app.business_rules.engine import BusinessRuleRegistry, business_rule_registry
+from app.business_rules.ruleset import RuleSet, RuleSetConfigError
+from app.core.database import db
+from app.core.invalidation import invalidation_bus
+from app.repositories.rule_config_repository import rule_config_repository
+
+logger = logging.getLogger(__name__)
+
+NAMESPACE = "rules"
+
+
+class SharedRuleConfig:
+    """Guarda y carga la configuración de reglas compartida"""
+
+    def __init__(self, registry: BusinessRuleRegistry):
+        self.registry = registry
+        # Id de la última configuración compartida aplicada en este worker
+        self.loaded_id: Optional[int] = None
+        self._tasks: Set[asyncio.Task] = set()
+        invalidation_bus.subscribe(
+            NAMESPACE,
+            lambda key: self._schedule_refresh(),
+            self._schedule_refresh,
+        )
+
+    async def share(self, rule_set: RuleSet) -> int:
+        """
+        Guardar el conjunto publicado en este worker y avisar a los demás
+        (el aviso sale con el commit). Retorna el id de la configuración
+        """
+        async with db.unit_of_work(transactional=True):
+            config_id = await rule_config_repository.save_config(rule_set.to_config(), rule_set.source)
+            await invalidation_bus.publish(NAMESPACE, config_id)
+        self.loaded_id = max(self.loaded_id or 0, config_id)
+        return config_id
+
+    async def refresh(self) -> Optional[RuleSet]:
+        """
+        Cargar la última configuración guardada si es más nueva que la
+        aplicada. Una configuración inválida se registra y se conserva el
+        conjunto vigente
+        """
+        row = await rule_config_repository.get_latest_config()
+        # Avisos que llegan desordenados: no volver a una configuración anterior
+        if row is None or (self.loaded_id is not None and row["id"] <= self.loaded_id):
+            return None
+
+        try:
+            rule_set = self.registry.load_config(row["config"], source=f"shared:{row['id']}")
+        except RuleSetConfigError as e:
+            logger.error("❌ Could not load shared rule config %s: %s", row["id"], e)
+            return None
+        self.loaded_id = row["id"]
+        return rule_set
+
+    def _schedule_refresh(self):
+        """refresh() para avisos del bus (el callback es síncrono)"""
+        task = asyncio.get_running_loop().create_task(self._refresh_logged())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _refresh_logged(self):
+        try:
+            await self.refresh()
+        except Exception as e:
+            logger.error("❌ Could not refresh shared rule config: %s", e)
+
+
+# Instancia global
+shared_rule_config = SharedRuleConfig(business_rule_registry)
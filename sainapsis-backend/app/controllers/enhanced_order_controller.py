@@ -9,17 +9,32 @@ from pydantic import BaseModel, Field
 
 # Importaciones del sistema existente
 from app.models.schemas import CreateOrderRequest, ProcessEventRequest
-from app.models.domain import EventType
+from app.models.domain import EventType, OrderState
 from app.services.order_service import order_service
 from app.core.database import db
 from app.core.exceptions import (
     OrderNotFound,
     InvalidTransition,
     InvalidOrderData,
+    OrderConflict,
+    DatabaseError,
 )
 
 # Importaciones del sistema de business rules
-from app.business_rules import get_sainapsis_order_adapter, get_rule_info
+from app.business_rules import (
+    get_sainapsis_order_adapter,
+    get_rule_info,
+    get_current_rule_set,
+    get_business_rule_evaluator,
+    RuleSetConfigError,
+)
+from app.business_rules.batch import OrderBatch, BatchUnavailable
+from app.business_rules.metrics import LATENCY_BUCKETS_US
+from app.business_rules.backtest import BACKTEST_WORKERS, run_backtest
+from app.business_rules.ruleset import build_candidate_rule_set
+from app.business_rules.shadow import shadow_evaluator
+from app.business_rules.shared_config import shared_rule_config
+from app.services.state_machine import state_machine_registry, StateMachineConfigError
 
 
 # Router para endpoints mejorados
@@ -50,6 +65,7 @@ class EnhancedOrderResponse(BaseModel):
     requires_manual_review: bool
     flagged_for_review: bool
     rule_summary: Dict[str, Any]
+    rule_set_version: int
 
 
 class BusinessRulesInfoResponse(BaseModel):
@@ -58,6 +74,35 @@ class BusinessRulesInfoResponse(BaseModel):
     total_count: int
     by_type: Dict[str, int]
     system_status: str
+    rule_set_version: int
+    filter_cache: Dict[str, Any]
+    rule_metrics: Optional[List[Dict[str, Any]]] = None
+
+
+class BatchSimulationRequest(BaseModel):
+    """Lote de órdenes en columnas (todas del mismo largo)"""
+    amount: List[float] = Field(..., min_length=1)
+    state: List[OrderState]
+    event_type: Optional[List[Optional[EventType]]] = None
+    country_code: Optional[List[Optional[str]]] = None
+    weekday: Optional[List[Optional[int]]] = None
+    include_rows: bool = False
+
+
+class CandidateRuleSetRequest(BaseModel):
+    """RuleSet candidato: config completa y/o cambios sobre el vigente"""
+    config: Optional[Dict[str, Any]] = None
+    params: Optional[Dict[str, Dict[str, Any]]] = None
+    enabled: Optional[Dict[str, bool]] = None
+
+
+class BacktestRequest(CandidateRuleSetRequest):
+    """RuleSet candidato y rango del historial"""
+    since: Optional[datetime] = None
+    until: Optional[datetime] = None
+    batch_size: int = Field(default=20000, ge=100, le=200000)
+    # Siempre con pool de procesos: en el proceso del servidor bloquearía el event loop
+    workers: int = Field(default=BACKTEST_WORKERS, ge=1, le=32)
 
 
 # ============================================================================
@@ -65,10 +110,11 @@ class BusinessRulesInfoResponse(BaseModel):
 # ============================================================================
 
 async def get_db():
-    """Dependency para conexión a DB"""
+    """Dependency: conexión a DB fijada para toda la petición (unit-of-work)"""
     if not db.pool:
         await db.connect()
-    return db
+    async with db.unit_of_work():
+        yield db
 
 
 def get_user_context(
@@ -111,6 +157,7 @@ async def create_enhanced_order(
     """
     try:
         adapter = get_sainapsis_order_adapter()
+        rule_set = adapter.current_rule_set()
         
         # Agregar country_code al contexto si viene en el request
         if request.country_code:
@@ -126,7 +173,8 @@ async def create_enhanced_order(
             product_ids=request.product_ids,
             amount=request.amount,
             metadata=metadata,
-            user_context=user_context
+            user_context=user_context,
+            rule_set=rule_set
         )
         
         if not validation_result["validation_passed"]:
@@ -142,9 +190,9 @@ async def create_enhanced_order(
             metadata=metadata,
         )
         
-        # Obtener orden con contexto de business rules
+        # Obtener orden con contexto de business rules (sin volver a leerla)
         order_with_context = await adapter.get_order_with_business_context(
-            order.id, user_context
+            order.id, user_context, order=order, rule_set=rule_set
         )
         
         return EnhancedOrderResponse(**order_with_context)
@@ -189,12 +237,13 @@ async def get_filtered_allowed_events(
     try:
         adapter = get_sainapsis_order_adapter()
         
-        # Obtener orden y eventos base
-        order = await order_service.get_order(order_id)
-        base_events = await order_service.get_allowed_events(order_id)
+        rule_set = adapter.current_rule_set()
         
-        # Aplicar filtros
-        filtered_events = await adapter.get_filtered_allowed_events(order_id, user_context)
+        # Obtener orden una vez, eventos base y filtros
+        order = await order_service.get_order(order_id)
+        base_events, filtered_events = await adapter.get_events_comparison(
+            order, user_context, rule_set=rule_set
+        )
         
         # Calcular diferencias
         removed_events = [e for e in base_events if e not in filtered_events]
@@ -212,7 +261,8 @@ async def get_filtered_allowed_events(
                 EventType.PENDING_BIOMETRICAL_VERIFICATION in base_events and
                 EventType.PENDING_BIOMETRICAL_VERIFICATION not in filtered_events
             ),
-            "threshold": 20.0
+            "threshold": 20.0,
+            "rule_set_version": rule_set.version
         }
         
     except OrderNotFound:
@@ -247,13 +297,17 @@ async def process_event_enhanced(
             "event_type": request.event_type.value,
             "processed_at": order.updated_at.isoformat(),
             "business_rules_applied": result["business_rules_applied"],
-            "allowed_events": [e.value for e in result["filtered_events"]]
+            "business_rules_fallbacks": result["business_rules_fallbacks"],
+            "allowed_events": [e.value for e in result["filtered_events"]],
+            "rule_set_version": result["rule_set_version"]
         }
         
     except OrderNotFound:
         raise HTTPException(status_code=404, detail="Order not found")
     except InvalidTransition as e:
         raise HTTPException(status_code=400, detail=str(e))
+    except OrderConflict as e:
+        raise HTTPException(status_code=409, detail=e.message)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
@@ -266,7 +320,8 @@ async def process_event_enhanced(
 async def get_business_rules_info():
     """📋 Información sobre reglas registradas"""
     try:
-        rules_info = get_rule_info()
+        rule_set = get_current_rule_set()
+        rules_info = rule_set.list_rules_info()
         
         by_type = {}
         for rule in rules_info:
@@ -277,39 +332,84 @@ async def get_business_rules_info():
             rules=rules_info,
             total_count=len(rules_info),
             by_type=by_type,
-            system_status="active"
+            system_status="active",
+            rule_set_version=rule_set.version,
+            filter_cache=get_business_rule_evaluator().filter_cache_stats(),
+            rule_metrics=get_business_rule_evaluator().rule_metrics(rule_set)
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
 
+@enhanced_router.get("/admin/rules/metrics")
+async def get_business_rule_metrics():
+    """
+    ⏱️ Métricas por regla: llamadas a applies_to, coincidencias, ejecuciones,
+    fallos e histogramas de latencia (de la regla más costosa a la más barata)
+    """
+    evaluator = get_business_rule_evaluator()
+    rule_set = get_current_rule_set()
+    metrics = evaluator.rule_metrics(rule_set, buckets=True)
+    if metrics is None:
+        raise HTTPException(status_code=404, detail="Rule metrics are disabled (RULE_METRICS_ENABLED=false)")
+    
+    return {
+        "rule_set_version": rule_set.version,
+        "latency_buckets_us": list(LATENCY_BUCKETS_US),
+        "rules": metrics
+    }
+
+
+@enhanced_router.delete("/admin/rules/metrics")
+async def reset_business_rule_metrics():
+    """⏱️ Reiniciar las métricas por regla"""
+    evaluator = get_business_rule_evaluator()
+    if evaluator.metrics is None:
+        raise HTTPException(status_code=404, detail="Rule metrics are disabled (RULE_METRICS_ENABLED=false)")
+    evaluator.metrics.reset()
+    return {"message": "Rule metrics reset"}
+
+
+async def _share_rule_set() -> int:
+    """Guardar el conjunto vigente y avisar a los demás workers (ver shared_config)"""
+    try:
+        return await shared_rule_config.share(get_current_rule_set())
+    except DatabaseError as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Rule set published in this worker but not shared with the others: {e.message}"
+        )
+
+
 @enhanced_router.post("/admin/rules/{rule_id}/toggle")
 async def toggle_business_rule(
     rule_id: str, 
     enable: bool = Query(default=True, description="Enable or disable the rule")
 ):
-    """🔧 Habilitar/deshabilitar una regla"""
+    """🔧 Habilitar/deshabilitar una regla (publica una nueva versión en todos los workers)"""
+    from app.business_rules import enable_rule, disable_rule
+    
     try:
-        from app.business_rules import enable_rule, disable_rule
-        
         if enable:
             success = enable_rule(rule_id)
             action = "enabled"
         else:
             success = disable_rule(rule_id)
             action = "disabled"
-        
-        if success:
-            return {
-                "message": f"Rule {rule_id} {action} successfully",
-                "rule_id": rule_id,
-                "enabled": enable
-            }
-        else:
-            raise HTTPException(status_code=404, detail=f"Rule {rule_id} not found")
-        
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+    
+    if not success:
+        raise HTTPException(status_code=404, detail=f"Rule {rule_id} not found")
+    shared_config_id = await _share_rule_set()
+    
+    return {
+        "message": f"Rule {rule_id} {action} successfully",
+        "rule_id": rule_id,
+        "enabled": enable,
+        "rule_set_version": get_current_rule_set().version,
+        "shared_config_id": shared_config_id
+    }
 
 
 @enhanced_router.post("/admin/small-order-threshold")
@@ -321,29 +421,234 @@ async def update_small_order_threshold(
     
     Cambia el límite de $20 a otro valor
     """
+    from app.business_rules import change_small_order_threshold
+    
+    rule = get_current_rule_set().get_rule("sainapsis_small_order_no_verification")
+    old_threshold = getattr(rule, "threshold", None)
+    
     try:
-        from app.business_rules import change_small_order_threshold
-        
         success = change_small_order_threshold(new_threshold)
-        
-        if success:
-            return {
-                "message": f"Small order threshold updated to ${new_threshold}",
-                "old_threshold": 20.0,
-                "new_threshold": new_threshold,
-                "effect": f"Orders ${new_threshold} or less will not require verification"
-            }
-        else:
-            raise HTTPException(status_code=500, detail="Failed to update threshold")
-        
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+    
+    if not success:
+        raise HTTPException(status_code=500, detail="Failed to update threshold")
+    shared_config_id = await _share_rule_set()
+    
+    return {
+        "message": f"Small order threshold updated to ${new_threshold}",
+        "old_threshold": old_threshold,
+        "new_threshold": new_threshold,
+        "effect": f"Orders ${new_threshold} or less will not require verification",
+        "rule_set_version": get_current_rule_set().version,
+        "shared_config_id": shared_config_id
+    }
+
+
+@enhanced_router.get("/admin/rules/config")
+async def get_rules_config():
+    """📄 Configuración del conjunto de reglas vigente"""
+    rule_set = get_current_rule_set()
+    return {
+        **rule_set.to_config(),
+        "source": rule_set.source,
+        "published_at": rule_set.created_at.isoformat()
+    }
+
+
+@enhanced_router.put("/admin/rules/config")
+async def replace_rules_config(config: Dict[str, Any]):
+    """
+    📦 Publicar un conjunto de reglas nuevo desde configuración
+    
+    Se compila completo antes de publicarse: si es inválido, la versión
+    vigente no cambia. Las evaluaciones en curso terminan con la anterior.
+    Los demás workers cargan la configuración guardada al recibir el aviso.
+    """
+    from app.business_rules import load_business_rules_config
+    
+    try:
+        rule_set = load_business_rules_config(config)
+    except RuleSetConfigError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    shared_config_id = await _share_rule_set()
+    
+    return {
+        "message": f"Rule set v{rule_set.version} published",
+        "rule_set_version": rule_set.version,
+        "shared_config_id": shared_config_id,
+        "total_count": len(rule_set.rules),
+        "enabled_count": len(rule_set.get_all_rules())
+    }
+
+
+@enhanced_router.post("/admin/rules/reload")
+async def reload_rules_config():
+    """🔄 Recompilar el archivo de configuración de reglas y publicarlo en todos los workers"""
+    from app.business_rules import reload_business_rules
+    
+    try:
+        rule_set = reload_business_rules()
+    except RuleSetConfigError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    shared_config_id = await _share_rule_set()
+    
+    return {
+        "message": f"Rule set v{rule_set.version} published",
+        "rule_set_version": rule_set.version,
+        "shared_config_id": shared_config_id,
+        "source": rule_set.source,
+        "total_count": len(rule_set.rules),
+        "enabled_count": len(rule_set.get_all_rules())
+    }
+
+
+@enhanced_router.get("/admin/state-machine")
+async def get_state_machine(version: Optional[int] = Query(default=None, ge=1)):
+    """🔀 Definición de la máquina de estados (vigente o una versión concreta)"""
+    try:
+        machine = state_machine_registry.get(version)
+    except StateMachineConfigError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    
+    return {
+        **machine.to_definition(),
+        "current": machine is state_machine_registry.current(),
+        "loaded_versions": state_machine_registry.versions()
+    }
+
+
+@enhanced_router.post("/admin/state-machine/reload")
+async def reload_state_machine():
+    """
+    🔄 Releer las definiciones de la máquina de estados y publicarlas
+    
+    Las órdenes nuevas usan la versión más alta; las existentes siguen con
+    la suya. Si alguna definición es inválida no cambia nada.
+    """
+    try:
+        if not db.pool:
+            await db.connect()
+        stats = await order_service.reload_state_machines()
+    except StateMachineConfigError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return {
+        "message": f"State machine v{stats['current_version']} is current",
+        **stats
+    }
 
 
 # ============================================================================
 # ENDPOINTS DE TESTING Y DEBUG
 # ============================================================================
 
+@enhanced_router.post("/admin/rules/simulate-batch")
+async def simulate_business_rules_batch(request: BatchSimulationRequest):
+    """🧮 Simular las reglas vigentes sobre un lote de órdenes (vectorizado)"""
+    try:
+        batch = OrderBatch.from_columns(
+            request.amount,
+            request.state,
+            request.event_type,
+            request.country_code,
+            request.weekday
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except BatchUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    
+    try:
+        adapter = get_sainapsis_order_adapter()
+        return adapter.simulate_rules_batch(batch, include_rows=request.include_rows)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+
+def _build_candidate(baseline, request: CandidateRuleSetRequest):
+    """Compilar el RuleSet candidato de la petición (400/404 si no es válido)"""
+    from app.business_rules import business_rule_registry
+    
+    try:
+        return build_candidate_rule_set(
+            baseline,
+            business_rule_registry.rule_catalog,
+            config=request.config,
+            params=request.params,
+            enabled=request.enabled
+        )
+    except RuleSetConfigError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=f"Rule {e} not found")
+
+
+@enhanced_router.post("/admin/rules/backtest")
+async def backtest_business_rules(request: BacktestRequest):
+    """
+    🧪 Comparar las reglas vigentes con un candidato sobre el historial
+    (orders y order_events), sin publicar nada
+    """
+    from app.business_rules import business_rule_registry
+    
+    baseline = get_current_rule_set()
+    candidate = _build_candidate(baseline, request)
+    
+    try:
+        if not db.pool:
+            await db.connect()
+        return await run_backtest(
+            baseline,
+            candidate,
+            business_rule_registry.rule_catalog,
+            since=request.since,
+            until=request.until,
+            batch_size=request.batch_size,
+            workers=request.workers
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+
+@enhanced_router.put("/admin/rules/shadow")
+async def start_shadow_rules(request: CandidateRuleSetRequest):
+    """
+    👥 Evaluar un candidato en sombra sobre el tráfico v2, fuera del camino
+    de la petición (reemplaza al candidato anterior)
+    """
+    if not shadow_evaluator.running:
+        raise HTTPException(status_code=503, detail="Shadow evaluation worker is not running")
+    
+    baseline = get_current_rule_set()
+    candidate = _build_candidate(baseline, request)
+    shadow_evaluator.set_candidate(candidate, baseline.version)
+    return {
+        "message": "Shadow evaluation started",
+        "stats": shadow_evaluator.stats()
+    }
+
+
+@enhanced_router.get("/admin/rules/shadow")
+async def get_shadow_rules(limit: int = Query(default=50, ge=1, le=500)):
+    """👥 Contadores de la sombra y desacuerdos recientes"""
+    return {
+        "stats": shadow_evaluator.stats(),
+        "recent_disagreements": shadow_evaluator.recent_disagreements(limit)
+    }
+
+
+@enhanced_router.delete("/admin/rules/shadow")
+async def stop_shadow_rules():
+    """👥 Dejar de evaluar el candidato en sombra"""
+    stats = shadow_evaluator.stats()
+    shadow_evaluator.clear_candidate()
+    return {
+        "message": "Shadow evaluation stopped",
+        "stats": stats
+    }
+
+
 @enhanced_router.get("/test/small-order-rule")
 async def test_small_order_rule():
     """🧪 Test de la regla de órdenes pequeñas"""
@@ -434,11 +739,13 @@ async def get_business_rules_preview(
     """🔍 Preview de reglas aplicables a una orden"""
     try:
         adapter = get_sainapsis_order_adapter()
+        rule_set = adapter.current_rule_set()
         order = await order_service.get_order(order_id)
         
         # Obtener eventos filtrados
-        base_events = await order_service.get_allowed_events(order_id)
-        filtered_events = await adapter.get_filtered_allowed_events(order_id, user_context)
+        base_events, filtered_events = await adapter.get_events_comparison(
+            order, user_context, rule_set=rule_set
+        )
         
         # Mensajes de preview
         preview_messages = []
@@ -461,7 +768,8 @@ async def get_business_rules_preview(
                 "base_events": [e.value for e in base_events],
                 "filtered_events": [e.value for e in filtered_events],
                 "removed": [e.value for e in base_events if e not in filtered_events]
-            }
+            },
+            "rule_set_version": rule_set.version
         }
         
     except OrderNotFound:
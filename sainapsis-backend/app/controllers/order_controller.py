@@ -1,7 +1,7 @@
 
 # File: app/controllers/order_controller.py
-from fastapi import APIRouter, HTTPException, Depends
-from typing import List
+from fastapi import APIRouter, HTTPException, Depends, Query, Request, Response
+from typing import List, Optional
 from uuid import UUID
 from datetime import datetime
 
@@ -10,9 +10,13 @@ from app.models.schemas import (
     ProcessEventRequest,
     OrderResponse,
     EventResponse,
+    BulkProcessEventsRequest,
+    BulkProcessEventsResponse,
+    BulkEventResult,
 )
 from app.models.domain import OrderState, EventType
-from app.services.order_service import order_service
+from app.services.order_service import order_service, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from app.services.order_import import run_order_import, iter_byte_lines
 from app.core.database import db
 from app.core.exceptions import (
     OrderException,
@@ -26,10 +30,11 @@ router = APIRouter(prefix="/orders", tags=["orders"])
 
 
 async def get_db():
-    """Dependency para asegurar conexión a DB"""
+    """Dependency: asegura conexión a DB y fija una conexión para toda la petición"""
     if not db.pool:
         await db.connect()
-    return db
+    async with db.unit_of_work():
+        yield db
 
 
 @router.post("/", response_model=OrderResponse, status_code=201)
@@ -66,6 +71,35 @@ async def create_order(request: CreateOrderRequest, db_conn=Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 
+@router.post("/bulk")
+async def create_orders_bulk(
+    request: Request,
+    fmt: Optional[str] = Query(
+        default=None, alias="format", description="ndjson | csv (por defecto según Content-Type)"
+    ),
+):
+    """
+    Crear órdenes en lote (migraciones, lotes de marketplaces)
+
+    El cuerpo es NDJSON (un objeto con product_ids, amount y metadata por
+    línea) o CSV con encabezado; se lee como stream y se carga con COPY, una
+    transacción por lote. Retorna creadas, rechazadas por línea y throughput.
+    """
+    if fmt is None:
+        fmt = "csv" if "csv" in request.headers.get("content-type", "") else "ndjson"
+
+    try:
+        if not db.pool:
+            await db.connect()
+        return await run_order_import(iter_byte_lines(request.stream()), fmt)
+    except InvalidOrderData as e:
+        raise HTTPException(status_code=400, detail=e.message)
+    except OrderException as e:
+        raise HTTPException(status_code=e.status_code, detail=e.message)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+
 @router.post("/{order_id}/events", response_model=EventResponse)
 async def process_event(
     order_id: UUID, request: ProcessEventRequest, db_conn=Depends(get_db)
@@ -78,19 +112,16 @@ async def process_event(
     - **metadata**: Metadatos del evento (opcional)
     """
     try:
-        old_order = await order_service.get_order(order_id)
-        old_state = old_order.state
-
-        updated_order = await order_service.process_event(
+        transition = await order_service.apply_event(
             order_id=order_id, event_type=request.event_type, metadata=request.metadata
         )
 
         return EventResponse(
-            order_id=updated_order.id,
-            old_state=old_state,
-            new_state=updated_order.state,
+            order_id=transition.order.id,
+            old_state=transition.old_state,
+            new_state=transition.new_state,
             event_type=request.event_type,
-            processed_at=updated_order.updated_at,
+            processed_at=transition.order.updated_at,
         )
 
     except OrderNotFound as e:
@@ -103,6 +134,48 @@ async def process_event(
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 
+@router.post("/events/bulk", response_model=BulkProcessEventsResponse)
+async def process_events_bulk(request: BulkProcessEventsRequest):
+    """
+    Procesar un lote de eventos (integraciones de bodega y pagos, conciliación)
+
+    - **events**: Lista de eventos (order_id, event_type, metadata)
+
+    Los eventos de una misma orden se aplican en el orden recibido; órdenes
+    distintas se procesan en paralelo. Cada evento tiene su resultado: un
+    evento inválido no detiene a los demás.
+    """
+    try:
+        results = await order_service.process_events(
+            [(item.order_id, item.event_type, item.metadata) for item in request.events]
+        )
+    except OrderException as e:
+        raise HTTPException(status_code=e.status_code, detail=e.message)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+    applied = sum(1 for result in results if result.applied)
+    return BulkProcessEventsResponse(
+        total=len(results),
+        applied=applied,
+        failed=len(results) - applied,
+        results=[
+            BulkEventResult(
+                index=index,
+                order_id=result.order_id,
+                event_type=result.event_type,
+                applied=result.applied,
+                old_state=result.old_state,
+                new_state=result.new_state,
+                support_ticket_ids=result.support_ticket_ids or [],
+                error=result.error,
+                status_code=result.status_code,
+            )
+            for index, result in enumerate(results)
+        ],
+    )
+
+
 @router.get("/{order_id}", response_model=OrderResponse)
 async def get_order(order_id: UUID, db_conn=Depends(get_db)):
     """
@@ -132,12 +205,39 @@ async def get_order(order_id: UUID, db_conn=Depends(get_db)):
 
 
 @router.get("/", response_model=List[OrderResponse])
-async def get_all_orders(db_conn=Depends(get_db)):
+async def get_all_orders(
+    response: Response,
+    limit: int = Query(default=DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(default=None, description="Cursor de X-Next-Cursor"),
+    state: Optional[OrderState] = None,
+    min_amount: Optional[float] = Query(default=None, ge=0),
+    max_amount: Optional[float] = Query(default=None, ge=0),
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    db_conn=Depends(get_db),
+):
     """
-    Obtener todas las órdenes
+    Listar órdenes (más recientes primero) con paginación por cursor
+
+    - **limit**: Tamaño de página (máximo 500)
+    - **cursor**: Cursor de la página siguiente (header X-Next-Cursor de la respuesta anterior)
+    - **state**: Filtrar por estado
+    - **min_amount** / **max_amount**: Rango de monto
+    - **created_after** / **created_before**: Ventana de fecha de creación
     """
     try:
-        orders = await order_service.get_all_orders()
+        page = await order_service.list_orders(
+            limit=limit,
+            cursor=cursor,
+            state=state,
+            min_amount=min_amount,
+            max_amount=max_amount,
+            created_after=created_after,
+            created_before=created_before,
+        )
+
+        if page.next_cursor:
+            response.headers["X-Next-Cursor"] = page.next_cursor
 
         return [
             OrderResponse(
@@ -149,9 +249,11 @@ async def get_all_orders(db_conn=Depends(get_db)):
                 created_at=order.created_at,
                 updated_at=order.updated_at,
             )
-            for order in orders
+            for order in page.orders
         ]
 
+    except InvalidOrderData as e:
+        raise HTTPException(status_code=400, detail=e.message)
     except OrderException as e:
         raise HTTPException(status_code=e.status_code, detail=e.message)
     except Exception as e:
@@ -1,24 +1,57 @@
-from fastapi import APIRouter, HTTPException, Depends
-from typing import Dict, Any
+from fastapi import APIRouter, HTTPException, Depends, Query, Response
+from typing import Dict, Any, List, Optional
 from uuid import UUID
 
-from app.services.order_service import order_service
+from app.services.order_service import order_service, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
 from app.models.domain import EventType
+from app.models.schemas import OrderResponse
 from app.core.database import db
+from app.core.exceptions import OrderException
 
 router = APIRouter(prefix="/reviews", tags=["Order Reviews"])
 
-@router.get("/pending")
-async def get_orders_pending_review():
-    """Obtener órdenes pendientes de revisión"""
-    orders = await order_service.get_all_orders()
+
+async def get_db():
+    """Dependency: asegura conexión a DB y fija una conexión para toda la petición"""
+    if not db.pool:
+        await db.connect()
+    async with db.unit_of_work():
+        yield db
+
+
+@router.get("/pending", response_model=List[OrderResponse])
+async def get_orders_pending_review(
+    response: Response,
+    limit: int = Query(default=DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(default=None, description="Cursor de X-Next-Cursor"),
+    db_conn=Depends(get_db),
+):
+    """Obtener órdenes pendientes de revisión (más antiguas primero, paginado por cursor)"""
+    try:
+        page = await order_service.list_pending_reviews(limit=limit, cursor=cursor)
+    except OrderException as e:
+        raise HTTPException(status_code=e.status_code, detail=e.message)
+
+    if page.next_cursor:
+        response.headers["X-Next-Cursor"] = page.next_cursor
+
     return [
-        order for order in orders 
-        if order.state == "reviewing"
+        OrderResponse(
+            id=order.id,
+            product_ids=order.product_ids,
+            amount=order.amount,
+            state=order.state,
+            metadata=order.metadata,
+            created_at=order.created_at,
+            updated_at=order.updated_at,
+        )
+        for order in page.orders
     ]
 
 @router.post("/{order_id}/approve")
-async def approve_review(order_id: UUID, notes: Dict[str, Any] = None):
+async def approve_review(
+    order_id: UUID, notes: Dict[str, Any] = None, db_conn=Depends(get_db)
+):
     """Aprobar revisión de una orden"""
     try:
         metadata = notes or {}
@@ -40,7 +73,9 @@ async def approve_review(order_id: UUID, notes: Dict[str, Any] = None):
         raise HTTPException(status_code=400, detail=str(e))
 
 @router.post("/{order_id}/reject")
-async def reject_review(order_id: UUID, reason: Dict[str, str]):
+async def reject_review(
+    order_id: UUID, reason: Dict[str, str], db_conn=Depends(get_db)
+):
     """Rechazar revisión de una orden"""
     try:
         metadata = {
@@ -12,10 +12,11 @@ router = APIRouter(prefix="/support", tags=["Support Tickets"])
 
 
 async def get_db():
-    """Dependency para asegurar conexión a DB"""
+    """Dependency: asegura conexión a DB y fija una conexión para toda la petición"""
     if not db.pool:
         await db.connect()
-    return db
+    async with db.unit_of_work():
+        yield db
 
 
 @router.get("/tickets", response_model=List[SupportTicketResponse])
@@ -0,0 +1,119 @@
+# File: app/core/cache.py
+
+"""
+Cache en proceso con política LRU y expiración por TTL.
+Lo usan los repositories para evitar lecturas repetidas a la base de datos.
+"""
+
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+
+class LRUCache:
+    """Cache LRU acotado con TTL por entrada y contadores de uso"""
+
+    def __init__(self, max_size: int, ttl_seconds: float):
+        if max_size <= 0:
+            raise ValueError("max_size must be greater than 0")
+        if ttl_seconds <= 0:
+            raise ValueError("ttl_seconds must be greater than 0")
+
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+
+        # Generación de la última invalidación por clave (acotado a max_size;
+        # las claves descartadas quedan cubiertas por _generation_floor)
+        self._generation = 0
+        self._generation_floor = 0
+        self._invalidated: "OrderedDict[Hashable, int]" = OrderedDict()
+
+        # Contadores
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Valor en cache o None si no existe o expiró"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def generation(self) -> int:
+        """Marca a tomar antes de leer el valor de la fuente (ver set)"""
+        return self._generation
+
+    def set(self, key: Hashable, value: Any, generation: Optional[int] = None):
+        """
+        Guardar valor, desalojando el menos usado si se supera max_size.
+        Con generation (tomada antes de leer el valor) no se guarda si la
+        clave se invalidó después: el valor leído puede ser anterior a la
+        escritura que la invalidó.
+        """
+        if generation is not None and self._invalidated_since(key, generation):
+            return
+
+        self._entries[key] = (value, time.monotonic() + self.ttl_seconds)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        """Eliminar una entrada (si existe) y avanzar su generación"""
+        self._generation += 1
+        self._invalidated[key] = self._generation
+        self._invalidated.move_to_end(key)
+        while len(self._invalidated) > self.max_size:
+            _, generation = self._invalidated.popitem(last=False)
+            self._generation_floor = generation
+
+        if self._entries.pop(key, None) is not None:
+            self.invalidations += 1
+
+    def clear(self):
+        """Vaciar el cache completo (todas las claves cambian de generación)"""
+        self._generation += 1
+        self._generation_floor = self._generation
+        self._invalidated.clear()
+
+        self.invalidations += len(self._entries)
+        self._entries.clear()
+
+    def _invalidated_since(self, key: Hashable, generation: int) -> bool:
+        """True si la clave se invalidó después de la generación dada"""
+        return self._invalidated.get(key, self._generation_floor) > generation
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        """Contadores de uso del cache"""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
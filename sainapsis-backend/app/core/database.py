@@ -1,11 +1,98 @@
-# Database 
+# Database
 import asyncpg
+import json
 import os
-from typing import Optional, List, Dict, Any
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import Optional, List, Dict, Any, AsyncIterator, Callable
 from dotenv import load_dotenv
 
 load_dotenv()
 
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson es opcional
+    orjson = None
+
+
+# Modos de cache de statements
+#   disabled -> sin cache (cada query se parsea y planifica de nuevo)
+#   direct   -> cache LRU de asyncpg, para conexiones directas a Postgres
+#   pooler   -> el mismo cache (statements nombrados preparados una vez por
+#               conexión, re-preparados si el plan queda obsoleto) detrás de un
+#               pooler en modo transacción: pgbouncer >= 1.21 con
+#               max_prepared_statements >= DB_STATEMENT_CACHE_SIZE
+STATEMENT_CACHE_MODES = ("disabled", "direct", "pooler")
+
+# Columnas que el código necesita y que las bases creadas con versiones
+# anteriores del schema no tienen: (tabla, columna) -> migración a aplicar
+REQUIRED_COLUMNS = {
+    ("order_events", "seq"): "ALTER TABLE order_events ADD COLUMN seq BIGINT GENERATED ALWAYS AS IDENTITY;",
+    ("business_rule_configs", "config"): (
+        "CREATE TABLE business_rule_configs (id BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY, "
+        "config JSONB NOT NULL, source TEXT NOT NULL, created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW());"
+    ),
+}
+
+# Conexión fijada por el unit-of-work de la petición actual (si hay uno)
+_current_connection: ContextVar[Optional[asyncpg.Connection]] = ContextVar(
+    "sainapsis_current_connection", default=None
+)
+
+# Callbacks a ejecutar cuando la transacción más externa haga commit
+_commit_callbacks: ContextVar[Optional[List[Callable[[], None]]]] = ContextVar(
+    "sainapsis_commit_callbacks", default=None
+)
+
+
+def _json_dumps(value: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value).encode()
+
+
+def _json_loads(data) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(bytes(data))
+
+
+def _encode_jsonb(value: Any) -> bytes:
+    # Formato binario de jsonb: byte de versión (1) + texto JSON
+    return b"\x01" + _json_dumps(value)
+
+
+def _decode_jsonb(data: bytes) -> Any:
+    return _json_loads(memoryview(data)[1:])
+
+
+async def init_connection(conn: asyncpg.Connection):
+    """
+    Registrar codecs una sola vez por conexión del pool:
+    jsonb/json <-> dict y numeric -> float, sin parseo en los repositories
+    """
+    await conn.set_type_codec(
+        "jsonb",
+        schema="pg_catalog",
+        encoder=_encode_jsonb,
+        decoder=_decode_jsonb,
+        format="binary",
+    )
+    await conn.set_type_codec(
+        "json",
+        schema="pg_catalog",
+        encoder=_json_dumps,
+        decoder=_json_loads,
+        format="binary",
+    )
+    await conn.set_type_codec(
+        "numeric",
+        schema="pg_catalog",
+        encoder=str,
+        decoder=float,
+        format="text",
+    )
+
 
 class Database:
     def __init__(self):
@@ -18,10 +105,23 @@ class Database:
         self.password = os.getenv("SUPABASE_PASSWORD")
         self.database = os.getenv("SUPABASE_DATABASE")
 
+        # Cache de statements
+        self.statement_cache_mode = os.getenv("DB_STATEMENT_CACHE_MODE", "disabled").lower()
+        self.statement_cache_size = int(os.getenv("DB_STATEMENT_CACHE_SIZE", 256))
+
+        # Puerto para conexiones LISTEN (los poolers en modo transacción no lo soportan)
+        self.listen_port = int(os.getenv("DB_LISTEN_PORT", self.port))
+
         # Validar que tenemos todas las credenciales
         if not all([self.host, self.user, self.password, self.database]):
             raise ValueError("Missing database credentials in .env file")
 
+        if self.statement_cache_mode not in STATEMENT_CACHE_MODES:
+            raise ValueError(
+                f"Invalid DB_STATEMENT_CACHE_MODE '{self.statement_cache_mode}', "
+                f"expected one of {STATEMENT_CACHE_MODES}"
+            )
+
     async def connect(self):
         """Crear pool de conexiones"""
         try:
@@ -36,34 +136,180 @@ class Database:
                 max_size=10,
                 command_timeout=60,
                 server_settings={"jit": "off"},
-                statement_cache_size=0  
+                statement_cache_size=(
+                    0 if self.statement_cache_mode == "disabled"
+                    else self.statement_cache_size
+                ),
+                init=init_connection,
+            )
+            print(
+                f"✅ Database connected to {self.host} "
+                f"(statement cache: {self.statement_cache_mode})"
             )
-            print(f"✅ Database connected to {self.host}")
         except Exception as e:
             print(f"❌ Database connection failed: {e}")
             raise
 
+    async def check_schema(self):
+        """
+        Verificar al iniciar que existen las columnas de REQUIRED_COLUMNS: si
+        falta alguna la app no arranca y el error indica la migración (no se
+        aplican automáticamente: agregar una columna identity reescribe la tabla)
+        """
+        required = list(REQUIRED_COLUMNS)
+        rows = await self.fetch(
+            """
+            SELECT table_name, column_name
+            FROM information_schema.columns
+            WHERE table_schema = current_schema()
+              AND (table_name, column_name) IN (
+                  SELECT * FROM unnest($1::text[], $2::text[])
+              )
+            """,
+            [table for table, _ in required],
+            [column for _, column in required],
+        )
+        present = {(row["table_name"], row["column_name"]) for row in rows}
+        missing = [key for key in required if key not in present]
+        if missing:
+            raise RuntimeError(
+                "Database schema is out of date, apply: "
+                + " ".join(REQUIRED_COLUMNS[key] for key in missing)
+            )
+
+    async def connect_listener(self) -> asyncpg.Connection:
+        """Conexión dedicada (fuera del pool) para LISTEN/NOTIFY"""
+        return await asyncpg.connect(
+            host=self.host,
+            port=self.listen_port,
+            user=self.user,
+            password=self.password,
+            database=self.database,
+            ssl="require",
+            statement_cache_size=0,
+        )
+
     async def disconnect(self):
         """Cerrar pool de conexiones"""
         if self.pool:
             await self.pool.close()
             print("❌ Database disconnected")
 
-    async def execute_query(self, query: str, *args) -> List[Dict[str, Any]]:
-        """Ejecutar query y retornar resultados"""
+    @asynccontextmanager
+    async def unit_of_work(self, transactional: bool = False) -> AsyncIterator[asyncpg.Connection]:
+        """
+        Fijar una sola conexión del pool para todo el bloque.
+
+        Todas las llamadas a fetch/execute_* dentro del bloque (y de las
+        funciones que llame) reutilizan esa conexión. Con transactional=True
+        el bloque corre en una transacción; si ya hay un unit-of-work abierto
+        se reutiliza su conexión y la transacción se anida (savepoint).
+        La conexión no admite operaciones concurrentes: no usar asyncio.gather
+        sobre queries dentro del mismo unit-of-work.
+        """
+        conn = _current_connection.get()
+        if conn is not None:
+            if transactional:
+                async with self._transaction(conn):
+                    yield conn
+            else:
+                yield conn
+            return
+
         if not self.pool:
             raise Exception("Database not connected")
 
         async with self.pool.acquire() as conn:
-            rows = await conn.fetch(query, *args)
-            return [dict(row) for row in rows]
+            token = _current_connection.set(conn)
+            try:
+                if transactional:
+                    async with self._transaction(conn):
+                        yield conn
+                else:
+                    yield conn
+            finally:
+                _current_connection.reset(token)
+
+    @asynccontextmanager
+    async def _transaction(self, conn: asyncpg.Connection) -> AsyncIterator[None]:
+        """Transacción (o savepoint si ya hay una) que dispara on_commit al confirmar"""
+        if _commit_callbacks.get() is not None:
+            async with conn.transaction():
+                yield
+            return
+
+        callbacks: List[Callable[[], None]] = []
+        token = _commit_callbacks.set(callbacks)
+        try:
+            async with conn.transaction():
+                yield
+        finally:
+            _commit_callbacks.reset(token)
+
+        for callback in callbacks:
+            callback()
+
+    def on_commit(self, callback: Callable[[], None]):
+        """
+        Ejecutar callback cuando la transacción actual haga commit
+        (de inmediato si no hay transacción). Si hace rollback, se descarta.
+        """
+        callbacks = _commit_callbacks.get()
+        if callbacks is None:
+            callback()
+        else:
+            callbacks.append(callback)
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncIterator[asyncpg.Connection]:
+        """Conexión del unit-of-work actual o, si no hay, una prestada del pool"""
+        conn = _current_connection.get()
+        if conn is not None:
+            yield conn
+            return
 
-    async def execute_command(self, command: str, *args) -> str:
-        """Ejecutar comando (INSERT/UPDATE/DELETE)"""
         if not self.pool:
             raise Exception("Database not connected")
 
         async with self.pool.acquire() as conn:
+            yield conn
+
+    @contextmanager
+    def detached(self):
+        """
+        Ignorar el unit-of-work actual dentro del bloque: cada query toma su
+        propia conexión del pool. Lo usan las tareas concurrentes (reglas
+        asíncronas), que no pueden compartir la conexión fijada; sus lecturas
+        no ven lo escrito por una transacción abierta de la petición.
+        """
+        token = _current_connection.set(None)
+        try:
+            yield
+        finally:
+            _current_connection.reset(token)
+
+    def in_transaction(self) -> bool:
+        """Indica si el unit-of-work actual tiene una transacción abierta"""
+        conn = _current_connection.get()
+        return conn is not None and conn.is_in_transaction()
+
+    async def fetch(self, query: str, *args) -> List[asyncpg.Record]:
+        """Ejecutar query y retornar los Record de asyncpg sin copiarlos a dicts"""
+        async with self.connection() as conn:
+            return await conn.fetch(query, *args)
+
+    async def fetchrow(self, query: str, *args) -> Optional[asyncpg.Record]:
+        """Ejecutar query y retornar el primer Record (o None)"""
+        rows = await self.fetch(query, *args)
+        return rows[0] if rows else None
+
+    async def execute_query(self, query: str, *args) -> List[Dict[str, Any]]:
+        """Ejecutar query y retornar resultados"""
+        return [dict(row) for row in await self.fetch(query, *args)]
+
+    async def execute_command(self, command: str, *args) -> str:
+        """Ejecutar comando (INSERT/UPDATE/DELETE)"""
+        async with self.connection() as conn:
             return await conn.execute(command, *args)
 
 
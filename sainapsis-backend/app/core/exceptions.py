@@ -19,6 +19,22 @@ class InvalidTransition(OrderException):
         )
 
 
+class OrderConflict(OrderException):
+    """Excepción cuando otra operación cambió la orden de forma concurrente"""
+    def __init__(self, order_id: str, expected_state: str):
+        super().__init__(
+            f"Order {order_id} is no longer in state {expected_state}", 409
+        )
+
+
+class UnknownStateMachineVersion(OrderException):
+    """Excepción cuando la orden referencia una versión de la máquina de estados que no está cargada"""
+    def __init__(self, order_id: str, version):
+        super().__init__(
+            f"Order {order_id} uses state machine version {version!r}, which is not loaded", 409
+        )
+
+
 class InvalidOrderData(OrderException):
     def __init__(self, message: str):
         super().__init__(message, 400)
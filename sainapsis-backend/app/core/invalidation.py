@@ -0,0 +1,223 @@
+# File: app/core/invalidation.py
+
+"""
+Bus de invalidación entre workers sobre LISTEN/NOTIFY de Postgres.
+
+Cada escritura publica (namespace, key) en el canal con pg_notify, en la misma
+conexión y transacción de la escritura: Postgres solo entrega el mensaje si la
+transacción hace commit. Las escrituras de órdenes notifican dentro de su
+propio statement (ver channel_for) para no sumar un round trip. Cada worker mantiene una conexión dedicada escuchando
+el canal y desaloja las claves afectadas de sus caches en proceso.
+"""
+
+import asyncio
+import json
+import logging
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from uuid import uuid4
+
+import asyncpg
+
+from app.core.database import Database, db
+
+logger = logging.getLogger(__name__)
+
+# Canal de Postgres usado por el bus
+CHANNEL = "sainapsis_invalidation"
+
+# Cada cuánto se verifica que la conexión del listener siga viva (segundos)
+HEALTH_CHECK_INTERVAL = 30
+
+# Espera máxima entre reintentos de conexión (segundos)
+MAX_RECONNECT_DELAY = 30
+
+
+class InvalidationBus:
+    """Publica y recibe invalidaciones de cache entre workers"""
+
+    def __init__(self, database: Database):
+        self.database = database
+        # Identificador de este worker: sus propios mensajes se ignoran
+        self.origin = uuid4().hex
+        self._subscribers: Dict[str, List[Tuple[Callable[[str], None], Callable[[], None]]]] = {}
+        self._conn: Optional[asyncpg.Connection] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+        # Contadores
+        self.published = 0
+        self.received = 0
+        self.reconnects = 0
+        self.resets = 0
+
+    def subscribe(
+        self,
+        namespace: str,
+        on_invalidate: Callable[[str], None],
+        on_reset: Callable[[], None],
+    ):
+        """
+        Registrar un cache para un namespace.
+
+        on_invalidate recibe la clave a desalojar; on_reset se llama cuando el
+        listener pudo perder mensajes (reconexión) y el cache debe vaciarse.
+        """
+        self._subscribers.setdefault(namespace, []).append((on_invalidate, on_reset))
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    @property
+    def connected(self) -> bool:
+        return self._conn is not None and not self._conn.is_closed()
+
+    def channel_for(self, namespace: str) -> Optional[str]:
+        """
+        Canal a notificar para el namespace, o None si no hace falta: el bus
+        no corre o ningún cache de este worker usa el namespace (todos los
+        workers comparten la configuración). Los statements que notifican
+        por su cuenta lo reciben como parámetro
+        """
+        if self.running and namespace in self._subscribers:
+            return CHANNEL
+        return None
+
+    def count_published(self, count: int):
+        """Contar mensajes enviados por un statement que notificó por su cuenta"""
+        self.published += count
+
+    async def publish(self, namespace: str, key: Any):
+        """
+        Notificar a los demás workers que la clave cambió.
+
+        Se ejecuta en la conexión del unit-of-work actual, así que dentro de
+        una transacción el mensaje sale solo si hace commit.
+        """
+        await self.publish_many(namespace, [key])
+
+    async def publish_many(self, namespace: str, keys: Iterable[Any]):
+        """Como publish, para muchas claves en un solo round trip (un mensaje por clave)"""
+        if self.channel_for(namespace) is None:
+            return
+
+        payloads = [
+            json.dumps({"origin": self.origin, "ns": namespace, "key": str(key)})
+            for key in keys
+        ]
+        if not payloads:
+            return
+        try:
+            await self.database.execute_command(
+                "SELECT pg_notify($1, payload) FROM unnest($2::text[]) AS payload",
+                CHANNEL, payloads
+            )
+        except Exception as e:
+            # Dentro de una transacción el error la abortó: propagarlo
+            if self.database.in_transaction():
+                raise
+            # Fuera de ella la escritura ya se confirmó; los demás workers
+            # verán el cambio al expirar el TTL
+            logger.warning(
+                "⚠️ Failed to publish %d invalidation(s) for %s: %s", len(payloads), namespace, e
+            )
+            return
+        self.published += len(payloads)
+
+    async def start(self):
+        """Iniciar el listener si hay algún cache suscrito"""
+        if self.running or not self._subscribers:
+            return
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Detener el listener y cerrar su conexión"""
+        self._stopping = True
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _on_notification(self, conn, pid, channel, payload):
+        try:
+            message = json.loads(payload)
+        except ValueError:
+            return
+
+        if message.get("origin") == self.origin:
+            return
+
+        self.received += 1
+        for on_invalidate, _ in self._subscribers.get(message.get("ns"), []):
+            on_invalidate(message.get("key"))
+
+    def _reset_all(self):
+        """Vaciar todos los caches suscritos"""
+        self.resets += 1
+        for subscribers in self._subscribers.values():
+            for _, on_reset in subscribers:
+                on_reset()
+
+    async def _run(self):
+        delay = 1
+        while not self._stopping:
+            try:
+                conn = await self.database.connect_listener()
+                await conn.add_listener(CHANNEL, self._on_notification)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("⚠️ Invalidation listener connection failed: %s", e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_RECONNECT_DELAY)
+                continue
+
+            delay = 1
+            self._conn = conn
+            closed = asyncio.Event()
+            conn.add_termination_listener(lambda _: closed.set())
+
+            # Mensajes perdidos mientras no había listener
+            self._reset_all()
+            logger.info("✅ Invalidation listener connected (channel: %s)", CHANNEL)
+
+            try:
+                while not closed.is_set():
+                    try:
+                        await asyncio.wait_for(closed.wait(), HEALTH_CHECK_INTERVAL)
+                    except asyncio.TimeoutError:
+                        # Detectar conexiones caídas que no avisaron
+                        await conn.execute("SELECT 1", timeout=5)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("⚠️ Invalidation listener lost connection: %s", e)
+            finally:
+                self._conn = None
+                if not conn.is_closed():
+                    conn.terminate()
+
+            if not self._stopping:
+                self._reset_all()
+                self.reconnects += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Estado y contadores del bus"""
+        return {
+            "running": self.running,
+            "connected": self.connected,
+            "channel": CHANNEL,
+            "namespaces": sorted(self._subscribers),
+            "published": self.published,
+            "received": self.received,
+            "reconnects": self.reconnects,
+            "resets": self.resets,
+        }
+
+
+# Instancia global
+invalidation_bus = InvalidationBus(db)
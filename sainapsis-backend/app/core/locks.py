@@ -0,0 +1,97 @@
+# File: app/core/locks.py
+
+"""
+Locks por clave dentro del proceso.
+
+Un pool fijo de asyncio.Lock: cada clave (p.ej. el id de una orden) usa el
+lock de su shard, elegido por hash, así la memoria no crece con el número de
+órdenes. Dos claves del mismo shard se serializan entre sí, lo que solo
+cuesta algo de espera, nunca consistencia. Entre workers la consistencia la
+da el compare-and-set en la base de datos; el lock evita que las peticiones
+de un mismo worker choquen en él.
+
+Los locks son reentrantes por contexto: si la tarea actual ya tiene el shard
+de una clave, hold() no lo vuelve a pedir. Así un llamador puede tomar el
+lock alrededor de lectura + reglas + escritura y apply_event tomarlo de
+nuevo sin bloquearse.
+"""
+
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from time import perf_counter_ns
+from typing import Any, AsyncIterator, Dict, FrozenSet, Hashable, Optional, Tuple
+
+# Número de locks del pool de órdenes
+ORDER_LOCK_SHARDS = int(os.getenv("ORDER_LOCK_SHARDS", "1024"))
+
+# Shards tomados por la tarea actual: (id del pool, shard)
+_held_shards: ContextVar[FrozenSet[Tuple[int, int]]] = ContextVar("held_shards", default=frozenset())
+
+
+class KeyedLocks:
+    """Pool fijo de asyncio.Lock indexado por hash de la clave"""
+
+    def __init__(self, shards: int):
+        self.shards = max(1, shards)
+        self._locks = [asyncio.Lock() for _ in range(self.shards)]
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+        # Contadores
+        self.acquisitions = 0
+        self.contended = 0
+        self.reentered = 0
+        self.wait_ns = 0
+
+    def shard(self, key: Hashable) -> int:
+        return hash(key) % self.shards
+
+    def _bind_loop(self):
+        """Los locks pertenecen a un event loop: recrearlos si cambió (p.ej. en tests)"""
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._locks = [asyncio.Lock() for _ in range(self.shards)]
+            self._loop = loop
+
+    @asynccontextmanager
+    async def hold(self, key: Hashable) -> AsyncIterator[None]:
+        """Serializar el bloque con los demás que usan el shard de la clave"""
+        shard = (id(self), self.shard(key))
+        held = _held_shards.get()
+        if shard in held:
+            self.reentered += 1
+            yield
+            return
+
+        self._bind_loop()
+        lock = self._locks[shard[1]]
+        if lock.locked():
+            self.contended += 1
+
+        started = perf_counter_ns()
+        async with lock:
+            self.acquisitions += 1
+            self.wait_ns += perf_counter_ns() - started
+            token = _held_shards.set(held | {shard})
+            try:
+                yield
+            finally:
+                _held_shards.reset(token)
+
+    def stats(self) -> Dict[str, Any]:
+        """Contadores del pool"""
+        return {
+            "shards": self.shards,
+            "locked": sum(1 for lock in self._locks if lock.locked()),
+            "acquisitions": self.acquisitions,
+            "contended": self.contended,
+            "reentered": self.reentered,
+            "avg_wait_us": (
+                round(self.wait_ns / self.acquisitions / 1000, 1) if self.acquisitions else None
+            ),
+        }
+
+
+# Instancia global: eventos de una misma orden
+order_locks = KeyedLocks(ORDER_LOCK_SHARDS)
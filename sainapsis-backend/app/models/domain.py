@@ -4,7 +4,7 @@ from enum import Enum
 from dataclasses import dataclass
 from datetime import datetime
 from uuid import UUID
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 
 
 class OrderState(str, Enum):
@@ -65,4 +65,35 @@ class SupportTicket:
     status: str
     metadata: Dict[str, Any]
     created_at: datetime
-    
+
+
+@dataclass
+class OrderTransition:
+    """Resultado de aplicar un evento: orden actualizada y estados involucrados"""
+    order: Order
+    old_state: OrderState
+    new_state: OrderState
+    support_ticket_ids: Optional[List[UUID]] = None
+
+
+@dataclass
+class EventResult:
+    """Resultado de un evento de un lote: transición aplicada o error"""
+    order_id: UUID
+    event_type: EventType
+    old_state: Optional[OrderState] = None
+    new_state: Optional[OrderState] = None
+    support_ticket_ids: Optional[List[UUID]] = None
+    error: Optional[str] = None
+    status_code: int = 200
+
+    @property
+    def applied(self) -> bool:
+        return self.error is None
+
+
+@dataclass
+class OrderPage:
+    """Página de órdenes y cursor opaco hacia la siguiente (None si no hay más)"""
+    orders: List[Order]
+    next_cursor: Optional[str] = None
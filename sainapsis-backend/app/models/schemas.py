@@ -7,6 +7,10 @@ from uuid import UUID
 from .domain import OrderState, EventType
 
 
+# Eventos por petición de lote como máximo
+MAX_BULK_EVENTS = 10000
+
+
 class CreateOrderRequest(BaseModel):
     product_ids: List[str] = Field(min_items=1)
     amount: float = Field(gt=0)
@@ -18,6 +22,17 @@ class ProcessEventRequest(BaseModel):
     metadata: Optional[Dict[str, Any]] = {}
 
 
+class BulkEventItem(BaseModel):
+    order_id: UUID
+    event_type: EventType
+    metadata: Optional[Dict[str, Any]] = {}
+
+
+class BulkProcessEventsRequest(BaseModel):
+    """Eventos a aplicar; los de una misma orden se aplican en este orden"""
+    events: List[BulkEventItem] = Field(min_items=1, max_items=MAX_BULK_EVENTS)
+
+
 class OrderResponse(BaseModel):
     id: UUID
     product_ids: List[str]
@@ -36,6 +51,26 @@ class EventResponse(BaseModel):
     processed_at: datetime
 
 
+class BulkEventResult(BaseModel):
+    """Resultado de un evento del lote (mismo índice que en la petición)"""
+    index: int
+    order_id: UUID
+    event_type: EventType
+    applied: bool
+    old_state: Optional[OrderState] = None
+    new_state: Optional[OrderState] = None
+    support_ticket_ids: List[UUID] = []
+    error: Optional[str] = None
+    status_code: int = 200
+
+
+class BulkProcessEventsResponse(BaseModel):
+    total: int
+    applied: int
+    failed: int
+    results: List[BulkEventResult]
+
+
 class SupportTicketResponse(BaseModel):
     """Respuesta de ticket de soporte"""
     id: UUID
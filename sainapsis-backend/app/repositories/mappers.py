@@ -0,0 +1,36 @@
+# app/repositories/mappers.py
+
+"""
+Mapeo directo de asyncpg.Record a entidades de dominio.
+Los repositories usan estas funciones en lugar de copiar cada fila a un dict.
+"""
+
+from asyncpg import Record
+
+from app.models.domain import Order, OrderState, SupportTicket
+
+
+def order_from_record(row: Record) -> Order:
+    """Construir Order desde una fila de la tabla orders"""
+    return Order(
+        id=row["id"],
+        product_ids=row["product_ids"],
+        amount=row["amount"],
+        state=OrderState(row["state"]),
+        metadata=row["metadata"],
+        created_at=row["created_at"],
+        updated_at=row["updated_at"],
+    )
+
+
+def ticket_from_record(row: Record) -> SupportTicket:
+    """Construir SupportTicket desde una fila de la tabla support_tickets"""
+    return SupportTicket(
+        id=row["id"],
+        order_id=row["order_id"],
+        reason=row["reason"],
+        amount=row["amount"],
+        status=row["status"],
+        metadata=row["metadata"],
+        created_at=row["created_at"],
+    )
@@ -6,19 +6,67 @@
     Maneja todas las operaciones de base de datos para órdenes, eventos y la creación de tickets de soporte.
 """
 
-import json
-from typing import Optional, List
+import copy
+import logging
+import os
+from typing import Optional, List, Tuple, Dict, Any
 from uuid import UUID, uuid4
 from datetime import datetime
 
 from app.models.domain import Order, OrderState, EventType
 from app.core.database import db
+from app.core.cache import LRUCache
+from app.core.invalidation import invalidation_bus
+from app.repositories.mappers import order_from_record
 from app.core.exceptions import OrderNotFound, DatabaseError
 
+logger = logging.getLogger(__name__)
+
 
 class OrderRepository:
     """Repository para manejo de órdenes en base de datos"""
 
+    def __init__(self):
+        # Cache read-through de órdenes por ID (opcional)
+        self.cache: Optional[LRUCache] = None
+        if os.getenv("ORDER_CACHE_ENABLED", "false").lower() in ("1", "true", "yes"):
+            self.cache = LRUCache(
+                max_size=int(os.getenv("ORDER_CACHE_MAX_SIZE", 10000)),
+                ttl_seconds=float(os.getenv("ORDER_CACHE_TTL_SECONDS", 30)),
+            )
+            # Escrituras de otros workers llegan por el bus de invalidación
+            invalidation_bus.subscribe(
+                "order",
+                lambda key: self.cache.invalidate(UUID(key)),
+                self.cache.clear,
+            )
+
+    def _cache_store(self, order: Order):
+        """Guardar orden en cache; dentro de una transacción solo tras el commit"""
+        if self.cache is not None:
+            order = copy.deepcopy(order)
+            db.on_commit(lambda: self.cache.set(order.id, order))
+
+    def _cache_invalidate(self, order_id: UUID):
+        """Invalidar orden ahora y de nuevo al confirmar la transacción actual"""
+        if self.cache is not None:
+            self.cache.invalidate(order_id)
+            # Otra petición pudo leer el valor anterior antes del commit
+            db.on_commit(lambda: self.cache.invalidate(order_id))
+
+    def _notify_args(self) -> Tuple[Optional[str], str]:
+        """
+        (canal, origen) para el CTE notified de las escrituras: la invalidación
+        sale en el mismo statement y solo si hay cache de órdenes (canal None)
+        """
+        return invalidation_bus.channel_for("order"), invalidation_bus.origin
+
+    def cache_stats(self) -> Dict[str, Any]:
+        """Contadores del cache de órdenes"""
+        if self.cache is None:
+            return {"enabled": False}
+        return {"enabled": True, **self.cache.stats()}
+
     async def create_order(
         self, product_ids: List[str], amount: float, metadata: dict
     ) -> Order:
@@ -31,31 +79,17 @@ class OrderRepository:
                 VALUES ($1, $2, $3, $4)
                 RETURNING id, product_ids, amount, state, metadata, created_at, updated_at
             """
+            metadata = metadata or {}
 
-            # Convertir metadata a JSON string
-            metadata_json = json.dumps(metadata) if metadata else "{}"
-
-            result = await db.execute_query(
-                query, order_id, product_ids, amount, metadata_json
+            row = await db.fetchrow(
+                query, order_id, product_ids, amount, metadata
             )
 
-            if not result:
+            if not row:
                 raise DatabaseError("Failed to create order")
-
-            row = result[0]
-            return Order(
-                id=row["id"],
-                product_ids=row["product_ids"],
-                amount=float(row["amount"]),
-                state=OrderState(row["state"]),
-                metadata=(
-                    row["metadata"]
-                    if isinstance(row["metadata"], dict)
-                    else json.loads(row["metadata"])
-                ),
-                created_at=row["created_at"],
-                updated_at=row["updated_at"],
-            )
+            order = order_from_record(row)
+            self._cache_store(order)
+            return order
 
         except Exception as e:
             if isinstance(e, DatabaseError):
@@ -63,102 +97,349 @@ class OrderRepository:
             raise DatabaseError(f"Error creating order: {str(e)}")
 
     async def get_order_by_id(self, order_id: UUID) -> Optional[Order]:
-        """Obtener orden por ID"""
+        """
+        Obtener orden por ID (desde el cache si está habilitado). Siempre
+        retorna una copia: el llamador puede modificarla sin afectar el cache.
+        """
+        generation = None
+        if self.cache is not None:
+            cached = self.cache.get(order_id)
+            if cached is not None:
+                return copy.deepcopy(cached)
+            # Si una escritura invalida la orden durante la lectura, la fila
+            # leída puede ser la anterior y no se guarda (ver LRUCache.set)
+            generation = self.cache.generation()
+
         try:
             query = "SELECT * FROM orders WHERE id = $1"
-            result = await db.execute_query(query, order_id)
+            row = await db.fetchrow(query, order_id)
 
-            if not result:
+            if not row:
                 return None
+            order = order_from_record(row)
 
-            row = result[0]
-            return Order(
-                id=row["id"],
-                product_ids=row["product_ids"],
-                amount=float(row["amount"]),
-                state=OrderState(row["state"]),
-                metadata=(
-                    row["metadata"]
-                    if isinstance(row["metadata"], dict)
-                    else json.loads(row["metadata"])
-                ),
-                created_at=row["created_at"],
-                updated_at=row["updated_at"],
-            )
+            # Dentro de una transacción la fila puede no estar confirmada
+            if self.cache is not None and not db.in_transaction():
+                self.cache.set(order_id, copy.deepcopy(order), generation)
+            return order
 
         except Exception as e:
             raise DatabaseError(f"Error fetching order {order_id}: {str(e)}")
 
+    async def get_orders_by_ids(self, order_ids: List[UUID]) -> Dict[UUID, Order]:
+        """Obtener varias órdenes en una sola consulta (las que no existen no aparecen)"""
+        try:
+            rows = await db.fetch("SELECT * FROM orders WHERE id = ANY($1::uuid[])", list(order_ids))
+            return {row["id"]: order_from_record(row) for row in rows}
+        except Exception as e:
+            raise DatabaseError(f"Error fetching {len(order_ids)} orders: {str(e)}")
+
     async def update_order_state(
         self, order_id: UUID, new_state: OrderState, metadata: dict
     ) -> Order:
         """Actualizar estado de orden"""
         try:
-            # Convertir metadata a JSON string
-            metadata_json = json.dumps(metadata) if metadata else "{}"
+            metadata = metadata or {}
+            self._cache_invalidate(order_id)
 
             query = """
-                UPDATE orders 
-                SET state = $2, metadata = $3, updated_at = NOW()
-                WHERE id = $1
-                RETURNING id, product_ids, amount, state, metadata, created_at, updated_at
+                WITH updated AS (
+                    UPDATE orders 
+                    SET state = $2, metadata = $3, updated_at = NOW()
+                    WHERE id = $1
+                    RETURNING id, product_ids, amount, state, metadata, created_at, updated_at
+                ),
+                notified AS (
+                    SELECT pg_notify($4, json_build_object('origin', $5::text, 'ns', 'order', 'key', id::text)::text)
+                    FROM updated
+                    WHERE $4::text IS NOT NULL
+                )
+                SELECT u.*, (SELECT count(*) FROM notified) AS notified
+                FROM updated u
             """
 
-            result = await db.execute_query(
-                query, order_id, new_state.value, metadata_json
+            row = await db.fetchrow(
+                query, order_id, new_state.value, metadata, *self._notify_args()
             )
 
-            if not result:
+            if not row:
                 raise OrderNotFound(str(order_id))
+            invalidation_bus.count_published(row["notified"])
 
-            row = result[0]
-            return Order(
-                id=row["id"],
-                product_ids=row["product_ids"],
-                amount=float(row["amount"]),
-                state=OrderState(row["state"]),
-                metadata=(
-                    row["metadata"]
-                    if isinstance(row["metadata"], dict)
-                    else json.loads(row["metadata"])
-                ),
-                created_at=row["created_at"],
-                updated_at=row["updated_at"],
-            )
+            order = order_from_record(row)
+            self._cache_store(order)
+            return order
 
         except OrderNotFound:
             raise
         except Exception as e:
             raise DatabaseError(f"Error updating order {order_id}: {str(e)}")
 
-    async def get_all_orders(self) -> List[Order]:
-        """Obtener todas las órdenes"""
+    async def transition_order_state(
+        self,
+        order_id: UUID,
+        expected_state: OrderState,
+        new_state: OrderState,
+        metadata: dict,
+        event_type: EventType,
+        event_metadata: dict,
+        support_tickets: Optional[List[dict]] = None,
+        expected_updated_at: Optional[datetime] = None,
+    ) -> Tuple[Optional[Order], List[UUID]]:
+        """
+        Transición atómica en un solo statement:
+        compare-and-set del estado, log del evento y tickets de soporte.
+
+        updated_at (lo fija el trigger en cada UPDATE) sirve de versión: con
+        expected_updated_at tampoco se pisa un cambio que dejó la orden en el
+        mismo estado (A -> B -> A, o solo metadata).
+
+        Retorna (None, []) si la orden ya no está en expected_state (o en
+        expected_updated_at).
+        """
         try:
-            query = "SELECT * FROM orders ORDER BY created_at DESC"
-            result = await db.execute_query(query)
-
-            orders = []
-            for row in result:
-                orders.append(
-                    Order(
-                        id=row["id"],
-                        product_ids=row["product_ids"],
-                        amount=float(row["amount"]),
-                        state=OrderState(row["state"]),
-                        metadata=(
-                            row["metadata"]
-                            if isinstance(row["metadata"], dict)
-                            else json.loads(row["metadata"])
-                        ),
-                        created_at=row["created_at"],
-                        updated_at=row["updated_at"],
-                    )
+            support_tickets = support_tickets or []
+            self._cache_invalidate(order_id)
+
+            query = """
+                WITH updated AS (
+                    UPDATE orders
+                    SET state = $3, metadata = $4, updated_at = NOW()
+                    WHERE id = $1 AND state = $2
+                      AND ($10::timestamptz IS NULL OR updated_at = $10)
+                    RETURNING id, product_ids, amount, state, metadata, created_at, updated_at
+                ),
+                logged AS (
+                    INSERT INTO order_events (order_id, event_type, old_state, new_state, metadata)
+                    SELECT id, $5::event_type, $2::order_state, state, $6::jsonb
+                    FROM updated
+                ),
+                tickets AS (
+                    INSERT INTO support_tickets (order_id, reason, amount, metadata)
+                    SELECT u.id, t.reason, t.amount, t.metadata
+                    FROM updated u,
+                         unnest($7::text[], $8::numeric[], $9::jsonb[])
+                             AS t(reason, amount, metadata)
+                    RETURNING id
+                ),
+                notified AS (
+                    SELECT pg_notify($11, json_build_object('origin', $12::text, 'ns', 'order', 'key', id::text)::text)
+                    FROM updated
+                    WHERE $11::text IS NOT NULL
                 )
+                SELECT u.*, ARRAY(SELECT id FROM tickets) AS ticket_ids,
+                       (SELECT count(*) FROM notified) AS notified
+                FROM updated u
+            """
+
+            row = await db.fetchrow(
+                query,
+                order_id,
+                expected_state.value,
+                new_state.value,
+                metadata or {},
+                event_type.value,
+                event_metadata or {},
+                [ticket["reason"] for ticket in support_tickets],
+                [ticket["amount"] for ticket in support_tickets],
+                [ticket.get("metadata") or {} for ticket in support_tickets],
+                expected_updated_at,
+                *self._notify_args(),
+            )
+
+            if not row:
+                return None, []
+            invalidation_bus.count_published(row["notified"])
 
+            order = order_from_record(row)
+            self._cache_store(order)
+            return order, list(row["ticket_ids"])
+
+        except Exception as e:
+            raise DatabaseError(f"Error transitioning order {order_id}: {str(e)}")
+
+    async def transition_orders(
+        self,
+        transitions: List[dict],
+        events: List[dict],
+        support_tickets: Optional[List[dict]] = None,
+    ) -> Dict[UUID, Order]:
+        """
+        Transición de muchas órdenes en un solo statement (ver transition_order_state).
+
+        - transitions: una por orden (order_id, expected_state,
+          expected_updated_at, new_state, metadata)
+        - events: eventos a registrar en el orden en que se aplicaron
+          (order_id, event_type, old_state, new_state, metadata)
+        - support_tickets: tickets con id generado por el llamador
+          (id, order_id, reason, amount, metadata)
+
+        Las órdenes que cambiaron desde la lectura (estado o updated_at) no
+        se modifican ni registran sus eventos o tickets; solo se retornan
+        las actualizadas.
+        """
+        try:
+            support_tickets = support_tickets or []
+            for transition in transitions:
+                self._cache_invalidate(transition["order_id"])
+
+            # Los eventos de una orden comparten NOW(): se insertan en el orden
+            # recibido, así order_events.seq conserva el orden del historial
+            query = """
+                WITH updated AS (
+                    UPDATE orders o
+                    SET state = t.new_state, metadata = t.metadata, updated_at = NOW()
+                    FROM unnest($1::uuid[], $2::order_state[], $3::order_state[], $4::jsonb[], $15::timestamptz[])
+                        AS t(id, expected_state, new_state, metadata, expected_updated_at)
+                    WHERE o.id = t.id AND o.state = t.expected_state
+                      AND o.updated_at = t.expected_updated_at
+                    RETURNING o.id, o.product_ids, o.amount, o.state, o.metadata, o.created_at, o.updated_at
+                ),
+                logged AS (
+                    INSERT INTO order_events (order_id, event_type, old_state, new_state, metadata)
+                    SELECT e.order_id, e.event_type, e.old_state, e.new_state, e.metadata
+                    FROM unnest($5::uuid[], $6::event_type[], $7::order_state[], $8::order_state[], $9::jsonb[])
+                        WITH ORDINALITY AS e(order_id, event_type, old_state, new_state, metadata, position)
+                    JOIN updated u ON u.id = e.order_id
+                    ORDER BY e.position
+                ),
+                tickets AS (
+                    INSERT INTO support_tickets (id, order_id, reason, amount, metadata)
+                    SELECT t.id, t.order_id, t.reason, t.amount, t.metadata
+                    FROM unnest($10::uuid[], $11::uuid[], $12::text[], $13::numeric[], $14::jsonb[])
+                        AS t(id, order_id, reason, amount, metadata)
+                    JOIN updated u ON u.id = t.order_id
+                ),
+                notified AS (
+                    SELECT pg_notify($16, json_build_object('origin', $17::text, 'ns', 'order', 'key', id::text)::text)
+                    FROM updated
+                    WHERE $16::text IS NOT NULL
+                )
+                SELECT u.*, (SELECT count(*) FROM notified) AS notified
+                FROM updated u
+            """
+
+            rows = await db.fetch(
+                query,
+                [t["order_id"] for t in transitions],
+                [t["expected_state"].value for t in transitions],
+                [t["new_state"].value for t in transitions],
+                [t["metadata"] or {} for t in transitions],
+                [e["order_id"] for e in events],
+                [e["event_type"].value for e in events],
+                [e["old_state"].value for e in events],
+                [e["new_state"].value for e in events],
+                [e["metadata"] or {} for e in events],
+                [ticket["id"] for ticket in support_tickets],
+                [ticket["order_id"] for ticket in support_tickets],
+                [ticket["reason"] for ticket in support_tickets],
+                [ticket["amount"] for ticket in support_tickets],
+                [ticket.get("metadata") or {} for ticket in support_tickets],
+                [t["expected_updated_at"] for t in transitions],
+                *self._notify_args(),
+            )
+
+            orders = {row["id"]: order_from_record(row) for row in rows}
+            if rows:
+                invalidation_bus.count_published(rows[0]["notified"])
+
+            for order in orders.values():
+                self._cache_store(order)
             return orders
 
         except Exception as e:
-            raise DatabaseError(f"Error fetching orders: {str(e)}")
+            raise DatabaseError(f"Error transitioning {len(transitions)} orders: {str(e)}")
+
+    async def list_orders(
+        self,
+        limit: int,
+        after: Optional[Tuple[datetime, UUID]] = None,
+        state: Optional[OrderState] = None,
+        min_amount: Optional[float] = None,
+        max_amount: Optional[float] = None,
+        created_after: Optional[datetime] = None,
+        created_before: Optional[datetime] = None,
+    ) -> List[Order]:
+        """
+        Listar órdenes (más recientes primero) con paginación keyset.
+
+        after es la clave (created_at, id) de la última orden de la página
+        anterior; el orden (created_at DESC, id DESC) lo resuelven los índices
+        idx_orders_created_at / idx_orders_state sin OFFSET ni ordenamiento.
+        """
+        try:
+            conditions = []
+            args = []
+
+            def param(value) -> str:
+                args.append(value)
+                return f"${len(args)}"
+
+            if after is not None:
+                after_created_at, after_id = after
+                conditions.append(
+                    f"(created_at, id) < ({param(after_created_at)}, {param(after_id)})"
+                )
+            if state is not None:
+                conditions.append(f"state = {param(state.value)}")
+            if min_amount is not None:
+                conditions.append(f"amount >= {param(min_amount)}")
+            if max_amount is not None:
+                conditions.append(f"amount <= {param(max_amount)}")
+            if created_after is not None:
+                conditions.append(f"created_at >= {param(created_after)}")
+            if created_before is not None:
+                conditions.append(f"created_at < {param(created_before)}")
+
+            where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+            query = f"""
+                SELECT id, product_ids, amount, state, metadata, created_at, updated_at
+                FROM orders
+                {where}
+                ORDER BY created_at DESC, id DESC
+                LIMIT {param(limit)}
+            """
+            rows = await db.fetch(query, *args)
+
+            return [order_from_record(row) for row in rows]
+
+        except Exception as e:
+            raise DatabaseError(f"Error listing orders: {str(e)}")
+
+    async def list_orders_pending_review(
+        self, limit: int, after: Optional[Tuple[datetime, UUID]] = None
+    ) -> List[Order]:
+        """
+        Cola de revisión: órdenes en 'reviewing', la más antigua primero.
+
+        Usa el índice parcial idx_orders_reviewing (updated_at, id), que solo
+        contiene las órdenes en revisión; after es la clave (updated_at, id)
+        de la última orden de la página anterior.
+        """
+        try:
+            if after is None:
+                query = """
+                    SELECT id, product_ids, amount, state, metadata, created_at, updated_at
+                    FROM orders
+                    WHERE state = 'reviewing'
+                    ORDER BY updated_at, id
+                    LIMIT $1
+                """
+                rows = await db.fetch(query, limit)
+            else:
+                query = """
+                    SELECT id, product_ids, amount, state, metadata, created_at, updated_at
+                    FROM orders
+                    WHERE state = 'reviewing' AND (updated_at, id) > ($2, $3)
+                    ORDER BY updated_at, id
+                    LIMIT $1
+                """
+                rows = await db.fetch(query, limit, after[0], after[1])
+
+            return [order_from_record(row) for row in rows]
+
+        except Exception as e:
+            raise DatabaseError(f"Error listing orders pending review: {str(e)}")
 
     async def log_event(
         self,
@@ -170,8 +451,7 @@ class OrderRepository:
     ):
         """Registrar evento en log"""
         try:
-            # Convertir metadata a JSON string
-            metadata_json = json.dumps(metadata) if metadata else "{}"
+            metadata = metadata or {}
 
             query = """
                 INSERT INTO order_events (order_id, event_type, old_state, new_state, metadata)
@@ -184,39 +464,19 @@ class OrderRepository:
                 event_type.value,
                 old_state.value,
                 new_state.value,
-                metadata_json,
+                metadata,
             )
 
         except Exception as e:
+            # Dentro de una transacción el error ya la abortó: propagarlo
+            if db.in_transaction():
+                raise DatabaseError(f"Error logging event for order {order_id}: {str(e)}")
             # Log error but don't fail the main operation
-            print(f"Warning: Failed to log event: {e}")
-
-    async def create_support_ticket(
-        self, order_id: UUID, reason: str, amount: float, metadata: dict
-    ):
-        """Crear ticket de soporte"""
-        try:
-            # Convertir metadata a JSON string
-            metadata_json = json.dumps(metadata) if metadata else "{}"
-
-            query = """
-                INSERT INTO support_tickets (order_id, reason, amount, metadata)
-                VALUES ($1, $2, $3, $4)
-                RETURNING id
-            """
-
-            result = await db.execute_query(
-                query, order_id, reason, amount, metadata_json
+            logger.warning(
+                "⚠️ Failed to log event for order %s: %s", order_id, e,
+                extra={"order_id": str(order_id)}
             )
 
-            if result:
-                print(f"✅ Support ticket created for order {order_id}: {reason}")
-                return result[0]["id"]
-
-        except Exception as e:
-            print(f"❌ Failed to create support ticket: {e}")
-            # Don't raise - support ticket creation shouldn't fail the main operation
-
 
 # Instancia global
 order_repository = OrderRepository()
@@ -0,0 +1,54 @@
+# app/repositories/rule_config_repository.py
+
+"""
+ El RuleConfigRepository guarda las configuraciones de reglas publicadas por la API.
+ Es la fuente compartida entre workers: cada uno carga la última guardada.
+"""
+
+from typing import Any, Dict, Optional
+
+from asyncpg import Record
+
+from app.core.database import db
+from app.core.exceptions import DatabaseError
+
+
+class RuleConfigRepository:
+    """Repository para las configuraciones de reglas compartidas"""
+
+    async def save_config(self, config: Dict[str, Any], source: str) -> int:
+        """Guardar una configuración; retorna su id (creciente)"""
+        try:
+            query = """
+                INSERT INTO business_rule_configs (config, source)
+                VALUES ($1, $2)
+                RETURNING id
+            """
+            row = await db.fetchrow(query, config, source)
+
+            if not row:
+                raise DatabaseError("Failed to save business rule config")
+            return row["id"]
+
+        except Exception as e:
+            if isinstance(e, DatabaseError):
+                raise
+            raise DatabaseError(f"Error saving business rule config: {str(e)}")
+
+    async def get_latest_config(self) -> Optional[Record]:
+        """Última configuración guardada (id, config, source, created_at) o None"""
+        try:
+            query = """
+                SELECT id, config, source, created_at
+                FROM business_rule_configs
+                ORDER BY id DESC
+                LIMIT 1
+            """
+            return await db.fetchrow(query)
+
+        except Exception as e:
+            raise DatabaseError(f"Error fetching business rule config: {str(e)}")
+
+
+# Instancia global
+rule_config_repository = RuleConfigRepository()
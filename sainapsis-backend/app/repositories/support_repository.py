@@ -6,13 +6,13 @@
 """
 
 
-import json
 from typing import List, Dict, Any, Optional
 from uuid import UUID, uuid4
 from datetime import datetime
 
 from app.models.domain import SupportTicket
 from app.core.database import db
+from app.repositories.mappers import ticket_from_record
 from app.core.exceptions import DatabaseError
 
 
@@ -25,9 +25,7 @@ class SupportRepository:
         """Crear ticket de soporte"""
         try:
             ticket_id = uuid4()
-            
-            # Convertir metadata a JSON string
-            metadata_json = json.dumps(metadata) if metadata else "{}"
+            metadata = metadata or {}
 
             query = """
                 INSERT INTO support_tickets (id, order_id, reason, amount, metadata)
@@ -35,27 +33,13 @@ class SupportRepository:
                 RETURNING id, order_id, reason, amount, status, metadata, created_at
             """
 
-            result = await db.execute_query(
-                query, ticket_id, order_id, reason, amount, metadata_json
+            row = await db.fetchrow(
+                query, ticket_id, order_id, reason, amount, metadata
             )
 
-            if not result:
+            if not row:
                 raise DatabaseError("Failed to create support ticket")
-
-            row = result[0]
-            return SupportTicket(
-                id=row["id"],
-                order_id=row["order_id"],
-                reason=row["reason"],
-                amount=float(row["amount"]),
-                status=row["status"],
-                metadata=(
-                    row["metadata"]
-                    if isinstance(row["metadata"], dict)
-                    else json.loads(row["metadata"])
-                ),
-                created_at=row["created_at"],
-            )
+            return ticket_from_record(row)
 
         except Exception as e:
             if isinstance(e, DatabaseError):
@@ -71,23 +55,11 @@ class SupportRepository:
                 ORDER BY created_at DESC
             """
             
-            result = await db.execute_query(query)
+            rows = await db.fetch(query)
             
             return [
-                SupportTicket(
-                    id=row["id"],
-                    order_id=row["order_id"],
-                    reason=row["reason"],
-                    amount=float(row["amount"]),
-                    status=row["status"],
-                    metadata=(
-                        row["metadata"]
-                        if isinstance(row["metadata"], dict)
-                        else json.loads(row["metadata"])
-                    ),
-                    created_at=row["created_at"],
-                )
-                for row in result
+                ticket_from_record(row)
+                for row in rows
             ]
 
         except Exception as e:
@@ -102,25 +74,11 @@ class SupportRepository:
                 WHERE id = $1
             """
             
-            result = await db.execute_query(query, ticket_id)
+            row = await db.fetchrow(query, ticket_id)
             
-            if not result:
+            if not row:
                 return None
-                
-            row = result[0]
-            return SupportTicket(
-                id=row["id"],
-                order_id=row["order_id"],
-                reason=row["reason"],
-                amount=float(row["amount"]),
-                status=row["status"],
-                metadata=(
-                    row["metadata"]
-                    if isinstance(row["metadata"], dict)
-                    else json.loads(row["metadata"])
-                ),
-                created_at=row["created_at"],
-            )
+            return ticket_from_record(row)
 
         except Exception as e:
             raise DatabaseError(f"Error fetching ticket {ticket_id}: {str(e)}")
@@ -135,69 +93,61 @@ class SupportRepository:
                 ORDER BY created_at DESC
             """
             
-            result = await db.execute_query(query, order_id)
+            rows = await db.fetch(query, order_id)
             
             return [
-                SupportTicket(
-                    id=row["id"],
-                    order_id=row["order_id"],
-                    reason=row["reason"],
-                    amount=float(row["amount"]),
-                    status=row["status"],
-                    metadata=(
-                        row["metadata"]
-                        if isinstance(row["metadata"], dict)
-                        else json.loads(row["metadata"])
-                    ),
-                    created_at=row["created_at"],
-                )
-                for row in result
+                ticket_from_record(row)
+                for row in rows
             ]
 
         except Exception as e:
             raise DatabaseError(f"Error fetching tickets for order {order_id}: {str(e)}")
 
+    async def count_open_tickets(self, order_id: UUID) -> int:
+        """Cantidad de tickets abiertos de una orden"""
+        try:
+            row = await db.fetchrow(
+                "SELECT count(*) AS total FROM support_tickets WHERE order_id = $1 AND status = 'open'",
+                order_id,
+            )
+            return row["total"]
+        except Exception as e:
+            raise DatabaseError(f"Error counting tickets for order {order_id}: {str(e)}")
+
     async def update_ticket_status(
         self, 
         ticket_id: UUID, 
         new_status: str, 
         metadata: Dict[str, Any]
-    ) -> SupportTicket:
-        """Actualizar estado del ticket"""
+    ) -> Optional[SupportTicket]:
+        """
+        Actualizar estado del ticket en un solo UPDATE: la metadata se combina
+        con la guardada y previous_status es el estado de la fila que se
+        reemplaza, así dos actualizaciones concurrentes no se pisan
+        """
         try:
-            # Convertir metadata a JSON string
-            metadata_json = json.dumps(metadata) if metadata else "{}"
+            metadata = metadata or {}
             
             query = """
                 UPDATE support_tickets 
-                SET status = $1, metadata = $2
-                WHERE id = $3
+                SET status = $1,
+                    metadata = metadata || $2::jsonb || jsonb_build_object(
+                        'status_updated_at', $3::text,
+                        'previous_status', status
+                    )
+                WHERE id = $4
                 RETURNING id, order_id, reason, amount, status, metadata, created_at
             """
             
-            result = await db.execute_query(query, new_status, metadata_json, ticket_id)
-            
-            if not result:
-                raise DatabaseError(f"Failed to update ticket {ticket_id}")
-                
-            row = result[0]
-            return SupportTicket(
-                id=row["id"],
-                order_id=row["order_id"],
-                reason=row["reason"],
-                amount=float(row["amount"]),
-                status=row["status"],
-                metadata=(
-                    row["metadata"]
-                    if isinstance(row["metadata"], dict)
-                    else json.loads(row["metadata"])
-                ),
-                created_at=row["created_at"],
+            row = await db.fetchrow(
+                query, new_status, metadata, datetime.utcnow().isoformat(), ticket_id
             )
+            
+            if not row:
+                return None
+            return ticket_from_record(row)
 
         except Exception as e:
-            if isinstance(e, DatabaseError):
-                raise
             raise DatabaseError(f"Error updating ticket {ticket_id}: {str(e)}")
 
 
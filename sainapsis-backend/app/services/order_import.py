@@ -0,0 +1,347 @@
+# app/services/order_import.py
+
+"""
+Creación masiva de órdenes con COPY.
+
+Lee órdenes de NDJSON (un objeto por línea) o CSV (encabezado con
+product_ids, amount y metadata opcional; product_ids separados por "|",
+metadata como JSON), las valida por lotes y carga cada lote en una sola
+transacción: COPY binario a una tabla temporal y desde ella las órdenes y
+sus eventos de creación. Mientras un lote se carga se valida el siguiente.
+Las filas inválidas se reportan por línea y no detienen la carga.
+
+Uso (desde sainapsis-backend/):
+
+    python -m app.services.order_import ordenes.ndjson
+    python -m app.services.order_import legado.csv --chunk-size 20000 --json
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import math
+import os
+import time
+from typing import Any, AsyncIterable, AsyncIterator, Dict, Iterable, List, Optional, Tuple, Union
+from uuid import UUID, uuid4
+
+from app.core.database import db
+from app.core.exceptions import InvalidOrderData
+from app.models.domain import OrderState, EventType
+from app.services.state_machine import STATE_MACHINE_VERSION_KEY, state_machine_registry
+
+
+# Órdenes por lote (una transacción por lote)
+ORDER_IMPORT_CHUNK_SIZE = int(os.getenv("ORDER_IMPORT_CHUNK_SIZE", "10000"))
+
+# Lotes cargándose a la vez (cada uno con su conexión del pool)
+ORDER_IMPORT_WORKERS = int(os.getenv("ORDER_IMPORT_WORKERS", "2"))
+
+# Rechazos incluidos en el reporte (el resto solo se cuenta)
+MAX_REPORTED_REJECTIONS = 1000
+
+# Mayor monto que admite orders.amount (numeric(12,2))
+MAX_AMOUNT = 9999999999.99
+
+FORMATS = ("ndjson", "csv")
+
+# numeric usa un codec de texto y COPY binario no lo admite: el lote entra a
+# una tabla temporal con amount double precision y se convierte al insertar
+STAGING_TABLE = "order_import_staging"
+
+CREATE_STAGING_TABLE = f"""
+    CREATE TEMP TABLE {STAGING_TABLE} (
+        id uuid,
+        product_ids text[],
+        amount double precision,
+        metadata jsonb
+    ) ON COMMIT DROP
+"""
+
+INSERT_ORDERS = f"""
+    INSERT INTO orders (id, product_ids, amount, metadata)
+    SELECT id, product_ids, amount::numeric(12,2), metadata
+    FROM {STAGING_TABLE}
+"""
+
+# Mismo evento de creación que OrderService.create_order
+INSERT_CREATION_EVENTS = f"""
+    INSERT INTO order_events (order_id, event_type, old_state, new_state, metadata)
+    SELECT id, '{EventType.ORDER_CANCELLED.value}', '{OrderState.PENDING.value}',
+           '{OrderState.PENDING.value}', '{{"action": "order_created"}}'::jsonb
+    FROM {STAGING_TABLE}
+"""
+
+OrderRecord = Tuple[UUID, List[str], float, Dict[str, Any]]
+
+
+# ============================================================================
+# LECTURA Y VALIDACIÓN
+# ============================================================================
+
+async def iter_byte_lines(chunks: AsyncIterable[bytes]) -> AsyncIterator[str]:
+    """Líneas de un stream de bytes (p.ej. el cuerpo de una petición)"""
+    buffer = b""
+    async for data in chunks:
+        buffer += data
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line.decode("utf-8", errors="replace")
+    if buffer:
+        yield buffer.decode("utf-8", errors="replace")
+
+
+async def _aiter_lines(lines: Union[Iterable[str], AsyncIterable[str]]) -> AsyncIterator[str]:
+    if hasattr(lines, "__aiter__"):
+        async for line in lines:
+            yield line
+    else:
+        for line in lines:
+            yield line
+
+
+def _parse_ndjson(line: str) -> Dict[str, Any]:
+    try:
+        row = json.loads(line)
+    except ValueError as e:
+        raise InvalidOrderData(f"Invalid JSON: {e}")
+    if not isinstance(row, dict):
+        raise InvalidOrderData("Each line must be a JSON object")
+    return row
+
+
+class _CsvRowParser:
+    """Filas CSV como dict según el encabezado (primera línea)"""
+
+    REQUIRED = ("product_ids", "amount")
+
+    def __init__(self, header: str):
+        self.columns = [column.strip() for column in next(csv.reader([header]))]
+        missing = [column for column in self.REQUIRED if column not in self.columns]
+        if missing:
+            raise InvalidOrderData(f"CSV header is missing columns: {missing}")
+
+    def __call__(self, line: str) -> Dict[str, Any]:
+        values = next(csv.reader([line]))
+        if len(values) != len(self.columns):
+            raise InvalidOrderData(f"Expected {len(self.columns)} columns, got {len(values)}")
+        row: Dict[str, Any] = dict(zip(self.columns, values))
+
+        row["product_ids"] = [p.strip() for p in row["product_ids"].split("|") if p.strip()]
+        try:
+            row["amount"] = float(row["amount"])
+        except ValueError:
+            raise InvalidOrderData(f"Invalid amount '{row['amount']}'")
+        if row.get("metadata"):
+            try:
+                row["metadata"] = json.loads(row["metadata"])
+            except ValueError as e:
+                raise InvalidOrderData(f"Invalid metadata JSON: {e}")
+        else:
+            row.pop("metadata", None)
+        return row
+
+
+def validate_order_row(row: Dict[str, Any], state_machine_version: int) -> OrderRecord:
+    """Mismas validaciones que OrderService.create_order; registro listo para COPY"""
+    product_ids = row.get("product_ids")
+    if (
+        not isinstance(product_ids, list)
+        or not product_ids
+        or not all(isinstance(product_id, str) and product_id for product_id in product_ids)
+    ):
+        raise InvalidOrderData("Product IDs must be a non-empty list of strings")
+
+    amount = row.get("amount")
+    if isinstance(amount, bool) or not isinstance(amount, (int, float)) or not math.isfinite(amount):
+        raise InvalidOrderData("Amount must be a number")
+    if amount <= 0:
+        raise InvalidOrderData("Amount must be greater than 0")
+    if round(amount, 2) > MAX_AMOUNT:
+        raise InvalidOrderData(f"Amount must not exceed {MAX_AMOUNT}")
+
+    metadata = row.get("metadata") or {}
+    if not isinstance(metadata, dict):
+        raise InvalidOrderData("Metadata must be an object")
+
+    metadata = {
+        **metadata,
+        "created_by": "order_import",
+        "initial_state": OrderState.PENDING.value,
+        STATE_MACHINE_VERSION_KEY: state_machine_version,
+    }
+    return uuid4(), product_ids, float(amount), metadata
+
+
+# ============================================================================
+# CARGA
+# ============================================================================
+
+async def _copy_chunk(records: List[OrderRecord]):
+    """Cargar un lote en una transacción: tabla temporal, órdenes y eventos de creación"""
+    # Los lotes se cargan a la vez: cada uno toma su propia conexión
+    with db.detached():
+        async with db.unit_of_work(transactional=True) as conn:
+            await conn.execute(CREATE_STAGING_TABLE)
+            await conn.copy_records_to_table(
+                STAGING_TABLE,
+                records=records,
+                columns=("id", "product_ids", "amount", "metadata"),
+            )
+            await conn.execute(INSERT_ORDERS)
+            await conn.execute(INSERT_CREATION_EVENTS)
+
+
+async def run_order_import(
+    lines: Union[Iterable[str], AsyncIterable[str]],
+    fmt: str = "ndjson",
+    chunk_size: int = ORDER_IMPORT_CHUNK_SIZE,
+    workers: int = ORDER_IMPORT_WORKERS,
+) -> Dict[str, Any]:
+    """
+    Crear las órdenes de `lines` (NDJSON o CSV) y reportar creadas,
+    rechazadas (con línea y motivo) y throughput.
+    """
+    if fmt not in FORMATS:
+        raise InvalidOrderData(f"Unsupported format '{fmt}', expected one of {FORMATS}")
+
+    started = time.perf_counter()
+    chunk_size = max(1, chunk_size)
+    state_machine_version = state_machine_registry.current().version
+
+    received = 0
+    created = 0
+    rejected = 0
+    chunks = 0
+    rejections: List[Dict[str, Any]] = []
+
+    def reject(line_number: Optional[int], error: str):
+        nonlocal rejected
+        rejected += 1
+        if len(rejections) < MAX_REPORTED_REJECTIONS:
+            rejections.append({"line": line_number, "error": error})
+
+    in_flight: Dict[asyncio.Task, List[int]] = {}
+
+    async def collect(done):
+        nonlocal created
+        for task in done:
+            line_numbers = in_flight.pop(task)
+            try:
+                task.result()
+                created += len(line_numbers)
+            except Exception as e:
+                # La transacción del lote se revirtió completa
+                for line_number in line_numbers:
+                    reject(line_number, f"Chunk failed: {e}")
+
+    async def flush(records: List[OrderRecord], line_numbers: List[int]):
+        nonlocal chunks
+        while len(in_flight) >= max(1, workers):
+            done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            await collect(done)
+        chunks += 1
+        in_flight[asyncio.create_task(_copy_chunk(records))] = line_numbers
+
+    parse = _parse_ndjson if fmt == "ndjson" else None
+    records: List[OrderRecord] = []
+    line_numbers: List[int] = []
+    line_number = 0
+
+    try:
+        async for line in _aiter_lines(lines):
+            line_number += 1
+            line = line.strip()
+            if not line:
+                continue
+
+            if parse is None:
+                try:
+                    parse = _CsvRowParser(line)
+                except (InvalidOrderData, csv.Error) as e:
+                    reject(line_number, e.message if isinstance(e, InvalidOrderData) else str(e))
+                    break
+                continue
+
+            received += 1
+            try:
+                records.append(validate_order_row(parse(line), state_machine_version))
+                line_numbers.append(line_number)
+            except InvalidOrderData as e:
+                reject(line_number, e.message)
+                continue
+            except csv.Error as e:
+                reject(line_number, f"Invalid CSV: {e}")
+                continue
+
+            if len(records) >= chunk_size:
+                await flush(records, line_numbers)
+                records, line_numbers = [], []
+                # Ceder el loop para que avance la carga en vuelo
+                await asyncio.sleep(0)
+
+        if records:
+            await flush(records, line_numbers)
+        while in_flight:
+            done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            await collect(done)
+    finally:
+        for task in in_flight:
+            task.cancel()
+
+    elapsed = time.perf_counter() - started
+    return {
+        "format": fmt,
+        "received": received,
+        "created": created,
+        "rejected": rejected,
+        "chunks": chunks,
+        "chunk_size": chunk_size,
+        "elapsed_seconds": round(elapsed, 3),
+        "orders_per_second": round(created / elapsed, 1) if elapsed > 0 else None,
+        "rejections": rejections,
+        "rejections_truncated": rejected > len(rejections),
+    }
+
+
+def detect_format(path: str) -> str:
+    return "csv" if path.lower().endswith(".csv") else "ndjson"
+
+
+async def main(args):
+    fmt = args.format or detect_format(args.path)
+
+    await db.connect()
+    try:
+        with open(args.path, "r", encoding="utf-8", newline="") as source:
+            report = await run_order_import(
+                source, fmt, chunk_size=args.chunk_size, workers=args.workers
+            )
+    finally:
+        await db.disconnect()
+
+    if args.json:
+        print(json.dumps(report, indent=2, default=str))
+        return
+
+    print(
+        f"\n📦 Order import ({fmt}): {report['created']} created, {report['rejected']} rejected "
+        f"in {report['elapsed_seconds']}s ({report['orders_per_second']} orders/s, "
+        f"{report['chunks']} chunks)"
+    )
+    for rejection in report["rejections"][:20]:
+        print(f"   ❌ line {rejection['line']}: {rejection['error']}")
+    if report["rejected"] > 20:
+        print(f"   ... {report['rejected'] - 20} more")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("path", help="NDJSON or CSV file with one order per line")
+    parser.add_argument("--format", choices=FORMATS, help="Defaults to the file extension")
+    parser.add_argument("--chunk-size", type=int, default=ORDER_IMPORT_CHUNK_SIZE)
+    parser.add_argument("--workers", type=int, default=ORDER_IMPORT_WORKERS)
+    parser.add_argument("--json", action="store_true", help="Print the full report as JSON")
+
+    asyncio.run(main(parser.parse_args()))
@@ -6,16 +6,88 @@ Coordina toda la lógica de negocio, orquesta los repositories y valida las tran
 """
 
 
-from typing import List, Dict, Any
-from uuid import UUID
+import asyncio
+import base64
+import binascii
+import logging
+import os
+from dataclasses import replace
+from typing import List, Dict, Any, Optional, Sequence, Tuple
+from uuid import UUID, uuid4
 from datetime import datetime
 
-from app.models.domain import Order, OrderState, EventType
+from app.models.domain import Order, OrderState, EventType, OrderTransition, OrderPage, EventResult
+from app.core.database import db
 from app.repositories.order_repository import order_repository
-from app.services.state_machine import StateMachine
-from app.core.exceptions import OrderNotFound, InvalidTransition, InvalidOrderData
+from app.services.state_machine import (
+    StateMachine,
+    STATE_MACHINE_VERSION_KEY,
+    state_machine_registry,
+)
+from app.core.invalidation import invalidation_bus
+from app.core.locks import order_locks
+from app.core.exceptions import (
+    OrderNotFound,
+    InvalidTransition,
+    InvalidOrderData,
+    OrderConflict,
+    OrderException,
+    DatabaseError,
+)
 from app.repositories.support_repository import support_repository  
 
+logger = logging.getLogger(__name__)
+
+# Límites de tamaño de página para los listados
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+# Claves de metadata que solo escribe el servicio: la metadata de un evento
+# no puede pisarlas
+RESERVED_METADATA_KEYS = frozenset({STATE_MACHINE_VERSION_KEY})
+
+# Reintentos de apply_event cuando otro worker cambió la orden
+EVENT_CONFLICT_RETRIES = 1
+
+# Lotes de eventos: órdenes por statement y statements en paralelo en todo
+# el proceso (cada uno usa una conexión del pool)
+BULK_EVENT_CHUNK_SIZE = int(os.getenv("BULK_EVENT_CHUNK_SIZE", "500"))
+BULK_EVENT_WORKERS = max(1, int(os.getenv("BULK_EVENT_WORKERS", "4")))
+
+_bulk_event_slots: Optional[asyncio.Semaphore] = None
+_bulk_event_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def _bulk_slots() -> asyncio.Semaphore:
+    """
+    Semáforo compartido por todos los lotes del proceso: varias peticiones
+    bulk a la vez no toman más de BULK_EVENT_WORKERS conexiones. Se recrea
+    si cambió el event loop (p.ej. en tests)
+    """
+    global _bulk_event_slots, _bulk_event_loop
+    loop = asyncio.get_running_loop()
+    if loop is not _bulk_event_loop:
+        _bulk_event_slots = asyncio.Semaphore(BULK_EVENT_WORKERS)
+        _bulk_event_loop = loop
+    return _bulk_event_slots
+
+
+def _encode_cursor(timestamp: datetime, order_id: UUID) -> str:
+    """Cursor opaco a partir de la clave keyset (timestamp, id)"""
+    raw = f"{timestamp.isoformat()}|{order_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> Tuple[datetime, UUID]:
+    """Clave keyset (timestamp, id) desde un cursor opaco"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        timestamp, order_id = base64.urlsafe_b64decode(padded).decode().split("|")
+        return datetime.fromisoformat(timestamp), UUID(order_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise InvalidOrderData("Invalid pagination cursor")
+
+
 class OrderService:
     """Servicio principal para lógica de negocio de órdenes"""
 
@@ -23,49 +95,50 @@ class OrderService:
         self.repository = order_repository
         self.support_repository = support_repository 
         self.state_machine = StateMachine()
+        # Nuevas versiones de la máquina publicadas por otros workers
+        invalidation_bus.subscribe(
+            "state_machine",
+            lambda key: state_machine_registry.refresh(),
+            state_machine_registry.refresh,
+        )
 
-    async def _apply_business_logic(
+    def _build_support_tickets(
         self, order: Order, event_type: EventType, metadata: Dict[str, Any]
-    ):
-        """Aplicar reglas de negocio específicas"""
+    ) -> List[Dict[str, Any]]:
+        """Aplicar reglas de negocio específicas: tickets a crear junto con la transición"""
+        tickets = []
 
         # REGLA 1: paymentFailed con monto > 1000 USD
         if event_type == EventType.PAYMENT_FAILED and order.amount > 1000:
-           
-            ticket = await self.support_repository.create_support_ticket(
-                order_id=order.id,
-                reason=f"High amount payment failure: ${order.amount}",
-                amount=order.amount,
-                metadata={
+            tickets.append({
+                "reason": f"High amount payment failure: ${order.amount}",
+                "amount": order.amount,
+                "metadata": {
                     "event_type": event_type.value,
                     "original_metadata": metadata,
                     "auto_created": True,
                     "created_by": "order_service",
                     "priority": "high" if order.amount > 2000 else "medium"
                 },
-            )
-            print(
-                f"🎫 Support ticket created: {ticket.id} for high-value payment failure: Order {order.id}"
-            )
+            })
 
-         # Órdenes > $5000 requieren revisión manual
-        
+        # Órdenes > $5000 requieren revisión manual
         if event_type == EventType.PAYMENT_SUCCESSFUL and order.amount > 5000:
             # En lugar de procesar automáticamente, crear ticket para revisión
-            ticket = await self.support_repository.create_support_ticket(
-                order_id=order.id,
-                reason=f"High value order requires manual review: ${order.amount}",
-                amount=order.amount,
-                metadata={
+            tickets.append({
+                "reason": f"High value order requires manual review: ${order.amount}",
+                "amount": order.amount,
+                "metadata": {
                     "event_type": "manual_review_required",
                     "priority": "urgent",
                     "auto_created": True,
                     "review_type": "high_value_order",
                     "requires_manager_approval": order.amount > 10000
                 },
-            )
-            print(f"🔍 Review ticket created: {ticket.id} for order {order.id}")      
-            
+            })
+
+        return tickets
+
     async def create_order(
         self, product_ids: List[str], amount: float, metadata: Dict[str, Any] = None
     ) -> Order:
@@ -81,64 +154,299 @@ class OrderService:
         metadata = metadata or {}
         metadata["created_by"] = "order_service"
         metadata["initial_state"] = OrderState.PENDING.value
+        # La orden sigue con esta versión de la máquina hasta el final
+        metadata[STATE_MACHINE_VERSION_KEY] = self.state_machine.current().version
 
-        order = await self.repository.create_order(product_ids, amount, metadata)
+        # Orden y evento de creación en la misma transacción
+        async with db.unit_of_work(transactional=True):
+            order = await self.repository.create_order(product_ids, amount, metadata)
 
-        # Log evento de creación
-        await self.repository.log_event(
-            order_id=order.id,
-            event_type=EventType.ORDER_CANCELLED,  # Usamos uno existente para el log
-            old_state=OrderState.PENDING,
-            new_state=OrderState.PENDING,
-            metadata={"action": "order_created"},
-        )
+            # Log evento de creación
+            await self.repository.log_event(
+                order_id=order.id,
+                event_type=EventType.ORDER_CANCELLED,  # Usamos uno existente para el log
+                old_state=OrderState.PENDING,
+                new_state=OrderState.PENDING,
+                metadata={"action": "order_created"},
+            )
 
         return order
 
-    async def process_event(
-        self, order_id: UUID, event_type: EventType, metadata: Dict[str, Any] = None
-    ) -> Order:
-        """Procesar evento en una orden - CORE DEL SISTEMA"""
-        # 1. Obtener orden actual
-        order = await self.repository.get_order_by_id(order_id)
-        if not order:
-            raise OrderNotFound(str(order_id))
-
-        # 2. Validar transición usando máquina de estados
+    def _prepare_transition(
+        self, order: Order, event_type: EventType, metadata: Optional[Dict[str, Any]]
+    ) -> Tuple[OrderState, Dict[str, Any], List[Dict[str, Any]]]:
+        """
+        Validar el evento con la máquina de estados de la orden y preparar
+        (sin escribir) el estado nuevo, la metadata actualizada y los tickets
+        """
         old_state = order.state
-        try:
-            new_state = self.state_machine.get_next_state(old_state, event_type)
-        except InvalidTransition as e:
-            raise e
-
-        # 3. Aplicar lógica de negocio específica ANTES de cambiar estado
-        await self._apply_business_logic(order, event_type, metadata or {})
-        
-       
-        # 4. Actualizar estado en base de datos
+        new_state = self.state_machine.for_order(order).get_next_state(old_state, event_type)
+
+        # Lógica de negocio específica: tickets que acompañan la transición
+        support_tickets = self._build_support_tickets(order, event_type, metadata or {})
+
         updated_metadata = order.metadata.copy()
-        
+
         if metadata:
-            updated_metadata.update(metadata)
+            updated_metadata.update(
+                (key, value) for key, value in metadata.items() if key not in RESERVED_METADATA_KEYS
+            )
 
         updated_metadata["last_event"] = event_type.value
         updated_metadata["last_transition"] = f"{old_state.value} -> {new_state.value}"
         updated_metadata["processed_at"] = datetime.utcnow().isoformat()
 
-        updated_order = await self.repository.update_order_state(
-            order_id, new_state, updated_metadata
-        )
+        return new_state, updated_metadata, support_tickets
+
+    async def apply_event(
+        self,
+        order_id: UUID,
+        event_type: EventType,
+        metadata: Dict[str, Any] = None,
+        order: Optional[Order] = None,
+        extra_support_tickets: Optional[List[Dict[str, Any]]] = None,
+        extra_metadata_updates: Optional[Dict[str, Any]] = None,
+    ) -> OrderTransition:
+        """
+        Aplicar evento en una orden - CORE DEL SISTEMA
+
+        extra_support_tickets y extra_metadata_updates (p.ej. de las reglas de
+        negocio) se escriben junto con la transición.
+
+        Los eventos de una misma orden se serializan dentro del worker con
+        order_locks. La actualización, el log del evento y los tickets se
+        escriben en un solo statement con compare-and-set sobre el estado y
+        updated_at leídos. Si otro worker cambió la orden entre medio:
 
-        # 5. Log del evento
-        await self.repository.log_event(
-            order_id=order_id,
-            event_type=event_type,
+        - con order, extra_support_tickets o extra_metadata_updates del
+          llamador (evaluó reglas sobre esa orden) se lanza OrderConflict de
+          inmediato y el llamador decide si vuelve a evaluar;
+        - si no, se relee y se valida de nuevo (EVENT_CONFLICT_RETRIES veces).
+          Si el evento ya no es válido o vuelve a chocar, se lanza OrderConflict.
+        """
+        caller_evaluated = order is not None or extra_support_tickets or extra_metadata_updates
+        retries = 0 if caller_evaluated else EVENT_CONFLICT_RETRIES
+        lost_state: Optional[OrderState] = None
+
+        async with order_locks.hold(order_id):
+            for attempt in range(retries + 1):
+                # 1. Obtener orden actual (el llamador puede pasarla si ya la tiene)
+                if order is None:
+                    order = await self.repository.get_order_by_id(order_id)
+                if not order:
+                    raise OrderNotFound(str(order_id))
+
+                # 2. Validar transición, tickets de la lógica de negocio y metadata nueva
+                old_state = order.state
+                try:
+                    new_state, updated_metadata, support_tickets = self._prepare_transition(
+                        order, event_type, metadata
+                    )
+                except InvalidTransition:
+                    # Tras perder la carrera el resultado sigue siendo un conflicto
+                    if lost_state is not None:
+                        raise OrderConflict(str(order_id), lost_state.value)
+                    raise
+                if extra_support_tickets:
+                    support_tickets.extend(extra_support_tickets)
+                if extra_metadata_updates:
+                    updated_metadata.update(
+                        (key, value) for key, value in extra_metadata_updates.items()
+                        if key not in RESERVED_METADATA_KEYS
+                    )
+
+                # 3. Actualizar estado + log del evento + tickets en un solo round trip
+                updated_order, ticket_ids = await self.repository.transition_order_state(
+                    order_id=order_id,
+                    expected_state=old_state,
+                    expected_updated_at=order.updated_at,
+                    new_state=new_state,
+                    metadata=updated_metadata,
+                    event_type=event_type,
+                    event_metadata=metadata or {},
+                    support_tickets=support_tickets,
+                )
+                if updated_order is not None:
+                    break
+
+                # Otro worker (o una copia vieja del cache) cambió la orden
+                logger.info(
+                    "🔁 Order %s changed concurrently (attempt %d)", order_id, attempt + 1,
+                    extra={"order_id": str(order_id)}
+                )
+                if lost_state is None:
+                    lost_state = old_state
+                order = None
+            else:
+                raise OrderConflict(str(order_id), lost_state.value)
+
+        for ticket_id in ticket_ids:
+            logger.info(
+                "🎫 Support ticket created: %s for order %s", ticket_id, order_id,
+                extra={"order_id": str(order_id), "ticket_id": str(ticket_id)}
+            )
+
+        return OrderTransition(
+            order=updated_order,
             old_state=old_state,
             new_state=new_state,
-            metadata=metadata or {},
+            support_ticket_ids=ticket_ids,
         )
 
-        return updated_order
+    async def process_event(
+        self, order_id: UUID, event_type: EventType, metadata: Dict[str, Any] = None
+    ) -> Order:
+        """Procesar evento en una orden"""
+        transition = await self.apply_event(order_id, event_type, metadata)
+        return transition.order
+
+    async def process_events(
+        self,
+        events: Sequence[Tuple[UUID, EventType, Optional[Dict[str, Any]]]],
+        chunk_size: int = BULK_EVENT_CHUNK_SIZE,
+    ) -> List[EventResult]:
+        """
+        Aplicar un lote de eventos (order_id, event_type, metadata).
+
+        Los eventos de una misma orden se aplican en el orden recibido. Las
+        órdenes se reparten en grupos de chunk_size que se procesan en
+        paralelo, hasta BULK_EVENT_WORKERS a la vez en todo el proceso y cada
+        uno con su conexión: cada grupo lee sus órdenes en una consulta y
+        escribe estados, eventos y tickets en un solo statement con
+        compare-and-set. Un evento inválido no detiene a los demás, y un grupo
+        que falla (p.ej. sin conexión disponible) solo marca sus propios
+        eventos; retorna un resultado por evento, en el orden de entrada.
+
+        No toma order_locks: cada grupo tendría cientos de shards y los grupos
+        se serializarían entre sí. Un cambio concurrente sobre una orden del
+        lote lo detecta el compare-and-set y sus eventos se reportan con 409.
+        """
+        results: List[Optional[EventResult]] = [None] * len(events)
+        indexes_by_order: Dict[UUID, List[int]] = {}
+        for index, (order_id, _, _) in enumerate(events):
+            indexes_by_order.setdefault(order_id, []).append(index)
+
+        order_ids = list(indexes_by_order)
+        chunk_size = max(1, chunk_size)
+        slots = _bulk_slots()
+
+        async def run(chunk: List[UUID]):
+            async with slots:
+                try:
+                    # Los grupos corren a la vez: cada uno toma su propia conexión
+                    with db.detached():
+                        async with db.unit_of_work():
+                            await self._process_event_chunk(chunk, indexes_by_order, events, results)
+                    return
+                except OrderException as e:
+                    error, status_code = e.message, e.status_code
+                except Exception as e:
+                    # Fuera del DatabaseError del repository (p.ej. timeout al
+                    # tomar la conexión): los demás grupos pudieron confirmar
+                    logger.error("❌ Bulk event chunk of %d orders failed: %s", len(chunk), e)
+                    error, status_code = f"Internal server error: {str(e)}", 500
+
+            # Nada del grupo se escribió (un solo statement)
+            for order_id in chunk:
+                for index in indexes_by_order[order_id]:
+                    results[index] = EventResult(
+                        order_id, events[index][1], error=error, status_code=status_code
+                    )
+
+        await asyncio.gather(*(
+            run(order_ids[start:start + chunk_size])
+            for start in range(0, len(order_ids), chunk_size)
+        ))
+
+        applied = sum(1 for result in results if result.applied)
+        logger.info(
+            "📦 Bulk events processed: %d applied, %d failed, %d orders",
+            applied, len(results) - applied, len(order_ids)
+        )
+        return results
+
+    async def _process_event_chunk(
+        self,
+        order_ids: List[UUID],
+        indexes_by_order: Dict[UUID, List[int]],
+        events: Sequence[Tuple[UUID, EventType, Optional[Dict[str, Any]]]],
+        results: List[Optional[EventResult]],
+    ):
+        """Aplicar en memoria los eventos de un grupo de órdenes y escribirlos juntos"""
+        orders = await self.repository.get_orders_by_ids(order_ids)
+
+        transitions: List[Dict[str, Any]] = []
+        logged_events: List[Dict[str, Any]] = []
+        support_tickets: List[Dict[str, Any]] = []
+
+        for order_id in order_ids:
+            order = orders.get(order_id)
+            if order is None:
+                error = OrderNotFound(str(order_id))
+                for index in indexes_by_order[order_id]:
+                    results[index] = EventResult(
+                        order_id, events[index][1], error=error.message, status_code=error.status_code
+                    )
+                continue
+
+            expected_state = order.state
+            expected_updated_at = order.updated_at
+            changed = False
+            for index in indexes_by_order[order_id]:
+                _, event_type, metadata = events[index]
+                old_state = order.state
+                try:
+                    new_state, updated_metadata, tickets = self._prepare_transition(
+                        order, event_type, metadata
+                    )
+                except OrderException as e:
+                    results[index] = EventResult(
+                        order_id, event_type, old_state=old_state, error=e.message, status_code=e.status_code
+                    )
+                    continue
+
+                ticket_ids = []
+                for ticket in tickets:
+                    ticket_ids.append(uuid4())
+                    support_tickets.append({**ticket, "id": ticket_ids[-1], "order_id": order_id})
+                logged_events.append({
+                    "order_id": order_id,
+                    "event_type": event_type,
+                    "old_state": old_state,
+                    "new_state": new_state,
+                    "metadata": metadata or {},
+                })
+                results[index] = EventResult(
+                    order_id, event_type, old_state, new_state, support_ticket_ids=ticket_ids
+                )
+                order = replace(order, state=new_state, metadata=updated_metadata)
+                changed = True
+
+            if changed:
+                transitions.append({
+                    "order_id": order_id,
+                    "expected_state": expected_state,
+                    "expected_updated_at": expected_updated_at,
+                    "new_state": order.state,
+                    "metadata": order.metadata,
+                })
+
+        if not transitions:
+            return
+
+        updated = await self.repository.transition_orders(transitions, logged_events, support_tickets)
+
+        # Órdenes que otra petición cambió entre la lectura y la escritura:
+        # sus eventos se evaluaron sobre un estado viejo y no se aplicó ninguno
+        for transition in transitions:
+            order_id = transition["order_id"]
+            if order_id in updated:
+                continue
+            conflict = OrderConflict(str(order_id), transition["expected_state"].value)
+            for index in indexes_by_order[order_id]:
+                results[index] = EventResult(
+                    order_id, events[index][1], error=conflict.message, status_code=conflict.status_code
+                )
 
     async def get_order(self, order_id: UUID) -> Order:
         """Obtener orden por ID"""
@@ -147,17 +455,84 @@ class OrderService:
             raise OrderNotFound(str(order_id))
         return order
 
-    async def get_all_orders(self) -> List[Order]:
-        """Obtener todas las órdenes"""
-        return await self.repository.get_all_orders()
+    async def list_orders(
+        self,
+        limit: int = DEFAULT_PAGE_SIZE,
+        cursor: Optional[str] = None,
+        state: Optional[OrderState] = None,
+        min_amount: Optional[float] = None,
+        max_amount: Optional[float] = None,
+        created_after: Optional[datetime] = None,
+        created_before: Optional[datetime] = None,
+    ) -> OrderPage:
+        """Obtener una página de órdenes (más recientes primero) con filtros"""
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            raise InvalidOrderData(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+        if min_amount is not None and max_amount is not None and min_amount > max_amount:
+            raise InvalidOrderData("min_amount cannot be greater than max_amount")
 
-    async def get_allowed_events(self, order_id: UUID) -> List[EventType]:
-        """Obtener eventos permitidos para una orden"""
-        order = await self.repository.get_order_by_id(order_id)
+        # Se pide una fila de más para saber si existe una página siguiente
+        orders = await self.repository.list_orders(
+            limit=limit + 1,
+            after=_decode_cursor(cursor) if cursor else None,
+            state=state,
+            min_amount=min_amount,
+            max_amount=max_amount,
+            created_after=created_after,
+            created_before=created_before,
+        )
+
+        next_cursor = None
+        if len(orders) > limit:
+            orders = orders[:limit]
+            last = orders[-1]
+            next_cursor = _encode_cursor(last.created_at, last.id)
+
+        return OrderPage(orders=orders, next_cursor=next_cursor)
+
+    async def list_pending_reviews(
+        self, limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None
+    ) -> OrderPage:
+        """Obtener una página de la cola de revisión (más antiguas primero)"""
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            raise InvalidOrderData(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+
+        orders = await self.repository.list_orders_pending_review(
+            limit=limit + 1,
+            after=_decode_cursor(cursor) if cursor else None,
+        )
+
+        next_cursor = None
+        if len(orders) > limit:
+            orders = orders[:limit]
+            last = orders[-1]
+            next_cursor = _encode_cursor(last.updated_at, last.id)
+
+        return OrderPage(orders=orders, next_cursor=next_cursor)
+
+    async def get_allowed_events(
+        self, order_id: UUID, order: Optional[Order] = None
+    ) -> List[EventType]:
+        """
+        Obtener eventos permitidos para una orden (el llamador puede pasarla
+        si ya la tiene). Retorna una lista nueva que el llamador puede modificar
+        """
+        if order is None:
+            order = await self.repository.get_order_by_id(order_id)
         if not order:
             raise OrderNotFound(str(order_id))
 
-        return self.state_machine.get_allowed_events(order.state)
+        return list(self.state_machine.for_order(order).get_allowed_events(order.state))
+
+    async def reload_state_machines(self) -> Dict[str, Any]:
+        """
+        Releer las definiciones de la máquina de estados y avisar a los demás
+        workers. Una definición inválida lanza StateMachineConfigError y deja
+        todo como estaba
+        """
+        machine = state_machine_registry.load()
+        await invalidation_bus.publish("state_machine", machine.version)
+        return state_machine_registry.stats()
 
     async def get_order_history(self, order_id: UUID) -> List[Dict[str, Any]]:
         """Obtener historial de eventos de una orden"""
@@ -172,11 +547,9 @@ class OrderService:
                 SELECT event_type, old_state, new_state, metadata, created_at
                 FROM order_events 
                 WHERE order_id = $1 
-                ORDER BY created_at ASC
+                ORDER BY created_at ASC, seq ASC
             """
-            from app.core.database import db
-
-            result = await db.execute_query(query, order_id)
+            rows = await db.fetch(query, order_id)
 
             return [
                 {
@@ -186,11 +559,10 @@ class OrderService:
                     "metadata": row["metadata"],
                     "created_at": row["created_at"],
                 }
-                for row in result
+                for row in rows
             ]
         except Exception as e:
-            print(f"Warning: Could not fetch order history: {e}")
-            return []
+            raise DatabaseError(f"Error fetching history for order {order_id}: {str(e)}")
 
 
 # Instancia global
@@ -1,108 +1,396 @@
-from typing import Dict, Tuple, List
-from app.models.domain import OrderState, EventType
-from app.core.exceptions import InvalidTransition
+"""
+Máquina de estados para órdenes.
+
+Las definiciones viven en archivos YAML/JSON (app/services/state_machines o
+el directorio de STATE_MACHINE_DIR), una versión por archivo. Al cargarse se
+validan (estados inalcanzables, estados sin salida) y se compilan a tablas
+indexadas por enteros. Conviven varias versiones: cada orden guarda en
+metadata["state_machine_version"] la versión con la que se creó y la sigue
+usando; las órdenes nuevas usan la versión más alta cargada.
+"""
+
+import json
+import logging
+import os
+import threading
+from collections import deque
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+try:
+    import yaml
+except ImportError:  # pragma: no cover - PyYAML es opcional
+    yaml = None
+
+from app.models.domain import Order, OrderState, EventType
+from app.core.exceptions import InvalidTransition, UnknownStateMachineVersion
+
+logger = logging.getLogger(__name__)
+
+
+# Directorio de definiciones por defecto
+DEFAULT_STATE_MACHINE_DIR = os.path.join(os.path.dirname(__file__), "state_machines")
+
+# Clave de metadata con la versión de la máquina de cada orden
+STATE_MACHINE_VERSION_KEY = "state_machine_version"
+
+# Versión de las órdenes creadas antes de versionar la máquina
+LEGACY_VERSION = 1
+
+# Estado en que se crean las órdenes (default de la tabla orders)
+INITIAL_STATE = OrderState.PENDING
+
+DEFINITION_KEYS = {"version", "description", "final_states", "non_cancellable_states", "transitions"}
+
+
+class StateMachineConfigError(Exception):
+    """Definición de máquina de estados inválida: las versiones cargadas no se modifican"""
+    pass
+
+
+class CompiledStateMachine:
+    """
+    Una versión de la máquina de estados, compilada una sola vez.
+
+    Estados y eventos se codifican como enteros (su posición en el enum);
+    next_state es una matriz densa [estado][evento] -> estado destino (None si
+    la transición no es válida) que ya incluye la cancelación por usuario, y
+    allowed_events guarda por estado la tupla de eventos permitidos en orden
+    de declaración. Las consultas no asignan memoria.
+    """
+
+    __slots__ = (
+        "version", "description", "transitions", "final_states", "non_cancellable_states",
+        "states", "events", "state_index", "event_index",
+        "next_state", "allowed_events", "allowed_event_sets",
+    )
+
+    def __init__(
+        self,
+        version: int,
+        transitions: Dict[Tuple[OrderState, EventType], OrderState],
+        non_cancellable_states: Iterable[OrderState],
+        final_states: Iterable[OrderState],
+        description: str = "",
+    ):
+        self.version = version
+        self.description = description
+        self.transitions = dict(transitions)
+        self.final_states: FrozenSet[OrderState] = frozenset(final_states)
+        self.non_cancellable_states: FrozenSet[OrderState] = frozenset(non_cancellable_states)
+
+        self.states: Tuple[OrderState, ...] = tuple(OrderState)
+        self.events: Tuple[EventType, ...] = tuple(EventType)
+        self.state_index: Dict[OrderState, int] = {state: i for i, state in enumerate(self.states)}
+        self.event_index: Dict[EventType, int] = {event: i for i, event in enumerate(self.events)}
+
+        matrix = [[None] * len(self.events) for _ in self.states]
+        allowed = [[] for _ in self.states]
+        for (state, event), new_state in self.transitions.items():
+            row = self.state_index[state]
+            matrix[row][self.event_index[event]] = new_state
+            if event not in allowed[row]:
+                allowed[row].append(event)
+
+        # Regla especial: cancelación por usuario desde cualquier estado cancelable
+        cancel = self.event_index[EventType.ORDER_CANCELLED_BY_USER]
+        for state in self.states:
+            row = self.state_index[state]
+            if state in self.non_cancellable_states or matrix[row][cancel] is not None:
+                continue
+            matrix[row][cancel] = OrderState.CANCELLED
+            allowed[row].append(EventType.ORDER_CANCELLED_BY_USER)
+
+        self.next_state: Tuple[Tuple[Optional[OrderState], ...], ...] = tuple(tuple(row) for row in matrix)
+        self.allowed_events: Tuple[Tuple[EventType, ...], ...] = tuple(tuple(events) for events in allowed)
+        self.allowed_event_sets: Tuple[FrozenSet[EventType], ...] = tuple(frozenset(events) for events in allowed)
+
+    def get_next_state(self, current_state: OrderState, event: EventType) -> OrderState:
+        """Obtener siguiente estado (incluye la cancelación por usuario)"""
+        new_state = self.next_state[self.state_index[current_state]][self.event_index[event]]
+        if new_state is None:
+            raise InvalidTransition(current_state.value, event.value)
+        return new_state
+
+    def get_allowed_events(self, current_state: OrderState) -> Tuple[EventType, ...]:
+        """
+        Eventos permitidos para un estado, en orden de declaración y con la
+        cancelación por usuario al final. La tupla es compartida: copiarla a
+        una lista para modificarla.
+        """
+        return self.allowed_events[self.state_index[current_state]]
+
+    def is_allowed(self, current_state: OrderState, event: EventType) -> bool:
+        """Indica si el evento es válido en el estado"""
+        return event in self.allowed_event_sets[self.state_index[current_state]]
+
+    def is_final_state(self, state: OrderState) -> bool:
+        """Verificar si un estado es final"""
+        return state in self.final_states
+
+    def to_definition(self) -> Dict[str, Any]:
+        """Definición equivalente (formato de los archivos)"""
+        transitions: Dict[str, Dict[str, str]] = {}
+        for (state, event), new_state in self.transitions.items():
+            transitions.setdefault(state.value, {})[event.value] = new_state.value
+        return {
+            "version": self.version,
+            "description": self.description,
+            "final_states": sorted(state.value for state in self.final_states),
+            "non_cancellable_states": sorted(state.value for state in self.non_cancellable_states),
+            "transitions": transitions,
+        }
+
+
+# ============================================================================
+# CARGA Y VALIDACIÓN
+# ============================================================================
+
+def _parse_member(enum_class, value: Any, field: str, version: Any):
+    try:
+        return enum_class(value)
+    except ValueError:
+        raise StateMachineConfigError(f"State machine v{version}: unknown {field} '{value}'")
+
+
+def _parse_states(definition: Dict[str, Any], field: str, version: Any) -> List[OrderState]:
+    values = definition.get(field) or []
+    if not isinstance(values, list):
+        raise StateMachineConfigError(f"State machine v{version}: '{field}' must be a list")
+    return [_parse_member(OrderState, value, "state", version) for value in values]
+
+
+def _validate_graph(machine: CompiledStateMachine):
+    """Todo estado debe ser alcanzable desde el inicial y, si no es final, tener salida hacia uno final"""
+    version = machine.version
+
+    edges: Dict[OrderState, set] = {}
+    for state in machine.states:
+        edges[state] = {machine.get_next_state(state, event) for event in machine.get_allowed_events(state)}
+
+    # Estados que participan en la definición
+    used = {INITIAL_STATE} | set(machine.final_states)
+    for (state, _), new_state in machine.transitions.items():
+        used.update((state, new_state))
+
+    reachable = {INITIAL_STATE}
+    pending = deque([INITIAL_STATE])
+    while pending:
+        for target in edges[pending.popleft()]:
+            if target not in reachable:
+                reachable.add(target)
+                pending.append(target)
+
+    unreachable = used - reachable
+    if unreachable:
+        raise StateMachineConfigError(
+            f"State machine v{version}: unreachable states {sorted(s.value for s in unreachable)}"
+        )
+
+    # Estados desde los que no se llega a ningún estado final
+    if not machine.final_states:
+        raise StateMachineConfigError(f"State machine v{version}: 'final_states' must not be empty")
+    finishing = set(machine.final_states)
+    changed = True
+    while changed:
+        changed = False
+        for state in reachable - finishing:
+            if edges[state] & finishing:
+                finishing.add(state)
+                changed = True
+
+    dead_ends = reachable - finishing
+    if dead_ends:
+        raise StateMachineConfigError(
+            f"State machine v{version}: dead-end states (no path to a final state) "
+            f"{sorted(s.value for s in dead_ends)}"
+        )
+
+
+def compile_state_machine(definition: Dict[str, Any]) -> CompiledStateMachine:
+    """Validar una definición y compilarla"""
+    if not isinstance(definition, dict):
+        raise StateMachineConfigError("State machine definition must be a mapping")
+
+    version = definition.get("version")
+    if not isinstance(version, int) or isinstance(version, bool) or version < 1:
+        raise StateMachineConfigError(f"State machine 'version' must be a positive integer, got {version!r}")
+
+    unknown = set(definition) - DEFINITION_KEYS
+    if unknown:
+        raise StateMachineConfigError(f"State machine v{version}: unknown keys {sorted(unknown)}")
+
+    raw_transitions = definition.get("transitions")
+    if not isinstance(raw_transitions, dict) or not raw_transitions:
+        raise StateMachineConfigError(f"State machine v{version}: 'transitions' must be a non-empty mapping")
+
+    transitions: Dict[Tuple[OrderState, EventType], OrderState] = {}
+    for state_name, events in raw_transitions.items():
+        state = _parse_member(OrderState, state_name, "state", version)
+        if not isinstance(events, dict):
+            raise StateMachineConfigError(
+                f"State machine v{version}: transitions of '{state_name}' must be a mapping"
+            )
+        for event_name, target_name in events.items():
+            event = _parse_member(EventType, event_name, "event", version)
+            transitions[(state, event)] = _parse_member(OrderState, target_name, "state", version)
+
+    machine = CompiledStateMachine(
+        version=version,
+        transitions=transitions,
+        non_cancellable_states=_parse_states(definition, "non_cancellable_states", version),
+        final_states=_parse_states(definition, "final_states", version),
+        description=str(definition.get("description", "")),
+    )
+    _validate_graph(machine)
+    return machine
+
+
+def load_state_machine_file(path: str) -> Dict[str, Any]:
+    """Leer una definición desde un archivo YAML o JSON"""
+    with open(path, "r", encoding="utf-8") as definition_file:
+        if path.endswith((".yaml", ".yml")):
+            if yaml is None:
+                raise StateMachineConfigError("PyYAML is required to load YAML state machines")
+            try:
+                return yaml.safe_load(definition_file)
+            except yaml.YAMLError as e:
+                raise StateMachineConfigError(f"Invalid YAML in {path}: {e}")
+        try:
+            return json.load(definition_file)
+        except ValueError as e:
+            raise StateMachineConfigError(f"Invalid JSON in {path}: {e}")
+
+
+# ============================================================================
+# REGISTRO DE VERSIONES
+# ============================================================================
+
+class StateMachineRegistry:
+    """
+    Versiones cargadas de la máquina de estados.
+
+    Las lecturas toman referencias sin bloqueos; load() compila el directorio
+    completo y publica un diccionario nuevo. Las versiones ya cargadas se
+    conservan aunque su archivo desaparezca, así las órdenes en curso nunca
+    pierden su máquina.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._machines: Dict[int, CompiledStateMachine] = {}
+        self._current: Optional[CompiledStateMachine] = None
+        self._lock = threading.Lock()
+        self.loads = 0
+
+    def load(self) -> CompiledStateMachine:
+        """Compilar todas las definiciones del directorio y publicarlas"""
+        if not os.path.isdir(self.directory):
+            raise StateMachineConfigError(f"State machine directory not found: {self.directory}")
+
+        compiled: Dict[int, CompiledStateMachine] = {}
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith((".yaml", ".yml", ".json")):
+                continue
+            machine = compile_state_machine(load_state_machine_file(os.path.join(self.directory, name)))
+            if machine.version in compiled:
+                raise StateMachineConfigError(f"State machine v{machine.version} is defined more than once")
+            compiled[machine.version] = machine
+
+        if not compiled:
+            raise StateMachineConfigError(f"No state machine definitions in {self.directory}")
+
+        with self._lock:
+            previous = self._current.version if self._current is not None else None
+            self._machines = {**self._machines, **compiled}
+            self._current = compiled[max(compiled)]
+            self.loads += 1
+
+        if self._current.version != previous:
+            logger.info("🔀 State machine v%s is now current (loaded: %s)", self._current.version, self.versions())
+        return self._current
+
+    def refresh(self):
+        """load() para avisos de otros workers: un error se registra y se conserva lo cargado"""
+        try:
+            self.load()
+        except (StateMachineConfigError, OSError) as e:
+            logger.error("❌ Could not reload state machines: %s", e)
+
+    def current(self) -> CompiledStateMachine:
+        """Versión para órdenes nuevas"""
+        return self._current
+
+    def get(self, version: Optional[int] = None) -> CompiledStateMachine:
+        """
+        Una versión concreta (None = la vigente). No relee el directorio: las
+        versiones nuevas llegan con load() (recarga explícita o aviso del bus)
+        """
+        if version is None:
+            return self._current
+        machine = self._machines.get(version)
+        if machine is None:
+            raise StateMachineConfigError(f"State machine v{version} is not available")
+        return machine
+
+    def for_order(self, order: Order) -> CompiledStateMachine:
+        """Máquina con la que se creó la orden"""
+        version = (order.metadata or {}).get(STATE_MACHINE_VERSION_KEY, LEGACY_VERSION)
+        machine = None
+        if isinstance(version, int) and not isinstance(version, bool):
+            machine = self._machines.get(version)
+        if machine is None:
+            raise UnknownStateMachineVersion(str(order.id), version)
+        return machine
+
+    def versions(self) -> List[int]:
+        return sorted(self._machines)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "directory": self.directory,
+            "current_version": self._current.version if self._current is not None else None,
+            "versions": self.versions(),
+            "loads": self.loads,
+        }
+
+
+# Instancia global (se carga al importar: sin definiciones válidas no hay servicio)
+state_machine_registry = StateMachineRegistry(os.getenv("STATE_MACHINE_DIR", DEFAULT_STATE_MACHINE_DIR))
+state_machine_registry.load()
 
 
 class StateMachine:
-    """Máquina de estados para órdenes"""
-
-    # Matriz de transiciones: (estado_actual, evento) -> nuevo_estado
-    TRANSITIONS: Dict[Tuple[OrderState, EventType], OrderState] = {
-        # Desde PENDING
-        (OrderState.PENDING, EventType.PENDING_BIOMETRICAL_VERIFICATION): OrderState.ON_HOLD,
-        (OrderState.PENDING, EventType.NO_VERIFICATION_NEEDED): OrderState.PENDING_PAYMENT,
-        (OrderState.PENDING, EventType.PAYMENT_FAILED): OrderState.CANCELLED,
-        (OrderState.PENDING, EventType.ORDER_CANCELLED): OrderState.CANCELLED,
-
-        # Desde ON_HOLD
-        (OrderState.ON_HOLD, EventType.BIOMETRICAL_VERIFICATION_SUCCESSFUL): OrderState.PENDING_PAYMENT,
-        (OrderState.ON_HOLD, EventType.VERIFICATION_FAILED): OrderState.CANCELLED,
-        (OrderState.ON_HOLD, EventType.ORDER_CANCELLED_BY_USER): OrderState.CANCELLED,
-
-        # Desde PENDING_PAYMENT
-        (OrderState.PENDING_PAYMENT, EventType.PAYMENT_SUCCESSFUL): OrderState.CONFIRMED,
-        (OrderState.PENDING_PAYMENT, EventType.ORDER_CANCELLED_BY_USER): OrderState.CANCELLED,
-
-        # Desde CONFIRMED
-        (OrderState.CONFIRMED, EventType.PREPARING_SHIPMENT): OrderState.PROCESSING,
-        (OrderState.CONFIRMED, EventType.ORDER_CANCELLED_BY_USER): OrderState.CANCELLED,
-
-        # De CONFIRMED a REVIEWING cuando se requiere revisión
-        (OrderState.CONFIRMED, EventType.MANUAL_REVIEW_REQUIRED): OrderState.REVIEWING,
-        
-        # Desde REVIEWING puede rechazar o aprobar
-        (OrderState.REVIEWING, EventType.REVIEW_APPROVED): OrderState.PROCESSING,
-        (OrderState.REVIEWING, EventType.REVIEW_REJECTED): OrderState.CANCELLED,
-        
-        # Tambien se puede cancelar desde REVIEWING
-        (OrderState.REVIEWING, EventType.ORDER_CANCELLED_BY_USER): OrderState.CANCELLED,
-        
-        # Desde PROCESSING
-        (OrderState.PROCESSING, EventType.ITEM_DISPATCHED): OrderState.SHIPPED,
-        (OrderState.PROCESSING, EventType.ORDER_CANCELLED_BY_USER): OrderState.CANCELLED,
-
-        # Desde SHIPPED
-        (OrderState.SHIPPED, EventType.ITEM_RECEIVED_BY_CUSTOMER): OrderState.DELIVERED,
-        (OrderState.SHIPPED, EventType.DELIVERY_ISSUE): OrderState.ON_HOLD,
-        (OrderState.SHIPPED, EventType.ORDER_CANCELLED_BY_USER): OrderState.CANCELLED,
-
-        # Desde DELIVERED
-        (OrderState.DELIVERED, EventType.RETURN_INITIATED_BY_CUSTOMER): OrderState.RETURNING,
-
-        # Desde RETURNING
-        (OrderState.RETURNING, EventType.ITEM_RECEIVED_BACK): OrderState.RETURNED,
-
-        # Desde RETURNED
-        (OrderState.RETURNED, EventType.REFUND_PROCESSED): OrderState.REFUNDED,
-    }
-
-    # Estados desde los cuales NO se puede cancelar
-    NON_CANCELLABLE_STATES = {
-        OrderState.DELIVERED,
-        OrderState.RETURNED,
-        OrderState.CANCELLED,
-    }
+    """
+    Máquina de estados para órdenes.
+
+    Los métodos de clase usan la versión vigente; for_order da la versión con
+    la que se creó una orden (la que deben usar sus transiciones).
+    """
+
+    @staticmethod
+    def for_order(order: Order) -> CompiledStateMachine:
+        return state_machine_registry.for_order(order)
+
+    @staticmethod
+    def current() -> CompiledStateMachine:
+        return state_machine_registry.current()
 
     @classmethod
     def get_next_state(cls, current_state: OrderState, event: EventType) -> OrderState:
-        """Obtener siguiente estado"""
-        # Verificar transición específica
-        transition_key = (current_state, event)
-        if transition_key in cls.TRANSITIONS:
-            return cls.TRANSITIONS[transition_key]
-
-        # Regla especial: cancelación por usuario
-        if (
-            event == EventType.ORDER_CANCELLED_BY_USER
-            and current_state not in cls.NON_CANCELLABLE_STATES
-        ):
-            return OrderState.CANCELLED
-
-        # Si no hay transición válida
-        raise InvalidTransition(current_state.value, event.value)
+        """Obtener siguiente estado (versión vigente)"""
+        return state_machine_registry.current().get_next_state(current_state, event)
 
     @classmethod
-    def get_allowed_events(cls, current_state: OrderState) -> List[EventType]:
-        """Obtener eventos permitidos para un estado"""
-        allowed_events = []
-
-        # Buscar eventos específicos
-        for (state, event), _ in cls.TRANSITIONS.items():
-            if state == current_state:
-                allowed_events.append(event)
+    def get_allowed_events(cls, current_state: OrderState) -> Tuple[EventType, ...]:
+        """Eventos permitidos para un estado (versión vigente, tupla compartida)"""
+        return state_machine_registry.current().get_allowed_events(current_state)
 
-        # Agregar cancelación por usuario si es permitida
-        if current_state not in cls.NON_CANCELLABLE_STATES:
-            allowed_events.append(EventType.ORDER_CANCELLED_BY_USER)
-
-        return list(set(allowed_events))
+    @classmethod
+    def is_allowed(cls, current_state: OrderState, event: EventType) -> bool:
+        """Indica si el evento es válido en el estado (versión vigente)"""
+        return state_machine_registry.current().is_allowed(current_state, event)
 
     @classmethod
     def is_final_state(cls, state: OrderState) -> bool:
-        """Verificar si un estado es final"""
-        final_states = {
-            OrderState.DELIVERED,
-            OrderState.REFUNDED,
-            OrderState.CANCELLED,
-        }
-        return state in final_states
\ No newline at end of file
+        """Verificar si un estado es final (versión vigente)"""
+        return state_machine_registry.current().is_final_state(state)
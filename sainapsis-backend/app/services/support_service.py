@@ -1,12 +1,16 @@
 # app/services/support_service.py
+import logging
 from typing import List, Dict, Any, Optional
 from uuid import UUID
 from datetime import datetime
 
 from app.models.domain import SupportTicket
+from app.core.database import db
 from app.repositories.support_repository import support_repository
 from app.core.exceptions import TicketNotFound
 
+logger = logging.getLogger(__name__)
+
 
 class SupportService:
     """Servicio para gestión de tickets de soporte"""
@@ -35,32 +39,15 @@ class SupportService:
         new_status: str, 
         metadata: Optional[Dict[str, Any]] = None
     ) -> SupportTicket:
-        """Actualizar estado del ticket"""
-        # Verificar que el ticket existe
-        ticket = await self.repository.get_ticket_by_id(ticket_id)
+        """Actualizar estado del ticket (previous_status lo registra el mismo UPDATE)"""
+        ticket = await self.repository.update_ticket_status(ticket_id, new_status, metadata)
         if not ticket:
             raise TicketNotFound(str(ticket_id))
-
-        # Preparar metadata actualizada
-        updated_metadata = ticket.metadata.copy()
-        if metadata:
-            updated_metadata.update(metadata)
-        
-        updated_metadata["status_updated_at"] = datetime.utcnow().isoformat()
-        updated_metadata["previous_status"] = ticket.status
-
-        # Actualizar en base de datos
-        return await self.repository.update_ticket_status(
-            ticket_id, 
-            new_status, 
-            updated_metadata
-        )
+        return ticket
 
     async def get_tickets_summary(self) -> Dict[str, Any]:
         """Obtener resumen estadístico de tickets"""
         try:
-            from app.core.database import db
-            
             # Query simple para estadísticas básicas
             query = """
                 SELECT 
@@ -72,13 +59,13 @@ class SupportService:
                 ORDER BY count DESC
             """
             
-            result = await db.execute_query(query)
+            rows = await db.fetch(query)
             
             # Procesar resultados
             stats_by_status = {}
             total_tickets = 0
             
-            for row in result:
+            for row in rows:
                 status = row["status"]
                 count = row["count"]
                 stats_by_status[status] = {
@@ -94,7 +81,7 @@ class SupportService:
             }
             
         except Exception as e:
-            print(f"Error generating ticket summary: {e}")
+            logger.error("❌ Error generating ticket summary: %s", e)
             return {
                 "total_tickets": 0,
                 "by_status": {},
@@ -0,0 +1,163 @@
+# test_bulk_events.py
+
+"""
+Eventos en lote (process_events): orden de aplicación por orden, conflictos
+con compare-and-set (409) y fallas de un grupo sin perder los resultados de
+los demás.
+"""
+
+import asyncio
+
+import pytest
+
+from app.models.domain import EventResult, EventType, OrderState
+
+try:
+    from app.repositories.order_repository import order_repository
+    from app.services import order_service as order_service_module
+    from app.services.order_service import order_service
+except ValueError as e:  # sin credenciales de base de datos
+    pytest.skip(f"Database not configured: {e}", allow_module_level=True)
+
+FLOW = [
+    EventType.NO_VERIFICATION_NEEDED,
+    EventType.PAYMENT_SUCCESSFUL,
+    EventType.ORDER_CANCELLED_BY_USER,
+]
+
+
+async def _create(created, amount=50.0):
+    order = await order_repository.create_order(["product"], amount, {"created_by": "test"})
+    created.append(order.id)
+    return order
+
+
+def test_bulk_applies_events_of_one_order_in_submitted_order(run_db):
+    """Los eventos de una orden se aplican y quedan en el historial en el orden recibido"""
+    async def test(created):
+        first, second = await _create(created), await _create(created)
+        events = [(first.id, FLOW[0], {"step": 0}), (second.id, FLOW[0], {})]
+        events += [(first.id, event_type, {"step": step}) for step, event_type in enumerate(FLOW[1:], 1)]
+
+        results = await order_service.process_events(events)
+
+        assert [(r.order_id, r.event_type) for r in results] == [(o, e) for o, e, _ in events]
+        assert all(r.applied for r in results)
+        assert [r.new_state for r in results if r.order_id == first.id] == [
+            OrderState.PENDING_PAYMENT, OrderState.CONFIRMED, OrderState.CANCELLED,
+        ]
+
+        history = await order_service.get_order_history(first.id)
+        assert [h["event_type"] for h in history] == [e.value for e in FLOW]
+        assert [h["metadata"]["step"] for h in history] == [0, 1, 2]
+        assert (await order_service.get_order(first.id)).state == OrderState.CANCELLED
+        assert (await order_service.get_order(second.id)).state == OrderState.PENDING_PAYMENT
+
+    run_db(test)
+
+
+def test_bulk_invalid_event_fails_only_itself(run_db):
+    """Un evento que no aplica en el estado de la orden falla solo; los siguientes continúan"""
+    async def test(created):
+        order = await _create(created)
+
+        results = await order_service.process_events([
+            (order.id, EventType.PAYMENT_SUCCESSFUL, {}),
+            (order.id, EventType.NO_VERIFICATION_NEEDED, {}),
+        ])
+
+        assert [r.applied for r in results] == [False, True]
+        assert results[0].status_code == 400
+        assert (await order_service.get_order(order.id)).state == OrderState.PENDING_PAYMENT
+
+    run_db(test)
+
+
+def test_bulk_reports_concurrent_change_as_conflict(run_db, monkeypatch):
+    """Si otra petición cambió la orden tras la lectura, sus eventos son 409 y no se escriben"""
+    async def test(created):
+        stale, other = await _create(created), await _create(created)
+        stale_orders = await order_repository.get_orders_by_ids([stale.id])
+        await order_service.apply_event(stale.id, EventType.NO_VERIFICATION_NEEDED)
+
+        get_orders_by_ids = order_repository.get_orders_by_ids
+
+        async def read(order_ids):
+            orders = await get_orders_by_ids(order_ids)
+            orders.update({k: v for k, v in stale_orders.items() if k in orders})
+            return orders
+
+        monkeypatch.setattr(order_repository, "get_orders_by_ids", read)
+
+        results = await order_service.process_events([
+            (stale.id, EventType.NO_VERIFICATION_NEEDED, {}),
+            (stale.id, EventType.PAYMENT_SUCCESSFUL, {}),
+            (other.id, EventType.NO_VERIFICATION_NEEDED, {}),
+        ])
+
+        assert [r.status_code for r in results[:2]] == [409, 409]
+        assert not any(r.applied for r in results[:2])
+        assert results[2].applied
+
+        history = await order_service.get_order_history(stale.id)
+        assert [h["event_type"] for h in history] == [EventType.NO_VERIFICATION_NEEDED.value]
+        assert (await order_service.get_order(stale.id)).state == OrderState.PENDING_PAYMENT
+
+    run_db(test)
+
+
+def test_bulk_failed_chunk_keeps_other_results(run_db, monkeypatch):
+    """Un error fuera del repository (p.ej. timeout del pool) da 500 solo a los eventos de su grupo"""
+    async def test(created):
+        failing, ok = await _create(created), await _create(created)
+        get_orders_by_ids = order_repository.get_orders_by_ids
+
+        async def read(order_ids):
+            if failing.id in order_ids:
+                raise asyncio.TimeoutError("pool acquire timed out")
+            return await get_orders_by_ids(order_ids)
+
+        monkeypatch.setattr(order_repository, "get_orders_by_ids", read)
+
+        results = await order_service.process_events(
+            [(failing.id, EventType.NO_VERIFICATION_NEEDED, {}), (ok.id, EventType.NO_VERIFICATION_NEEDED, {})],
+            chunk_size=1,
+        )
+
+        assert not results[0].applied
+        assert results[0].status_code == 500
+        assert results[1].applied
+        assert (await order_service.get_order(ok.id)).state == OrderState.PENDING_PAYMENT
+
+    run_db(test)
+
+
+def test_bulk_chunks_share_process_wide_limit(run_db, monkeypatch):
+    """Varias peticiones a la vez no procesan más de BULK_EVENT_WORKERS grupos en paralelo"""
+    async def test(created):
+        orders = [await _create(created) for _ in range(6)]
+        running, peak = 0, 0
+
+        async def chunk(self, order_ids, indexes_by_order, events, results):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            for order_id in order_ids:
+                for index in indexes_by_order[order_id]:
+                    results[index] = EventResult(order_id, events[index][1])
+
+        monkeypatch.setattr(order_service_module, "BULK_EVENT_WORKERS", 2)
+        monkeypatch.setattr(order_service_module, "_bulk_event_loop", None)
+        monkeypatch.setattr(type(order_service), "_process_event_chunk", chunk)
+
+        requests = [
+            [(order.id, EventType.NO_VERIFICATION_NEEDED, {}) for order in orders[i:i + 3]]
+            for i in (0, 3)
+        ]
+        await asyncio.gather(*(order_service.process_events(r, chunk_size=1) for r in requests))
+
+        assert peak == 2
+
+    run_db(test)
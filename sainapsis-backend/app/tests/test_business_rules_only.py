@@ -365,14 +365,14 @@ def test_rule_enable_disable():
         initial_state = rule.is_enabled()
         print(f"   📊 Initial state of {test_rule_id}: {'ENABLED' if initial_state else 'DISABLED'}")
         
-        # Deshabilitar
+        # Deshabilitar (publica una nueva versión: volver a leer la regla)
         disable_rule(test_rule_id)
-        after_disable = rule.is_enabled()
+        after_disable = registry.get_rule(test_rule_id).is_enabled()
         print(f"   🔴 After disable: {'ENABLED' if after_disable else 'DISABLED'}")
         
         # Habilitar
         enable_rule(test_rule_id)
-        after_enable = rule.is_enabled()
+        after_enable = registry.get_rule(test_rule_id).is_enabled()
         print(f"   🟢 After enable: {'ENABLED' if after_enable else 'DISABLED'}")
         
         # Restaurar estado original
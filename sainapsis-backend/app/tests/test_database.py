@@ -0,0 +1,39 @@
+# test_database.py
+
+"""
+Verificación del schema al iniciar: una columna requerida que falta detiene
+la app con la migración pendiente en lugar de fallar después en silencio.
+"""
+
+import pytest
+
+try:
+    from app.core import database
+    from app.core.database import db
+except ValueError as e:  # sin credenciales de base de datos
+    pytest.skip(f"Database not configured: {e}", allow_module_level=True)
+
+
+def test_check_schema_accepts_current_schema(run_db):
+    """La base de pruebas tiene todas las columnas requeridas"""
+    async def test(created):
+        await db.check_schema()
+
+    run_db(test)
+
+
+def test_check_schema_reports_missing_column_with_migration(run_db, monkeypatch):
+    """Si falta una columna el error incluye la migración a aplicar"""
+    migration = "ALTER TABLE order_events ADD COLUMN not_there INT;"
+    monkeypatch.setattr(database, "REQUIRED_COLUMNS", {
+        **database.REQUIRED_COLUMNS,
+        ("order_events", "not_there"): migration,
+    })
+
+    async def test(created):
+        with pytest.raises(RuntimeError) as error:
+            await db.check_schema()
+        assert migration in str(error.value)
+        assert "seq" not in str(error.value)
+
+    run_db(test)
@@ -0,0 +1,98 @@
+# test_order_cache.py
+
+"""
+Cache read-through de órdenes: una lectura que corre junto a una escritura
+no deja la fila anterior en el cache, y las órdenes retornadas son copias.
+"""
+
+import pytest
+
+from app.core.cache import LRUCache
+from app.models.domain import EventType, OrderState
+
+try:
+    from app.core.database import db
+    from app.repositories.order_repository import order_repository
+    from app.services.order_service import order_service
+except ValueError as e:  # sin credenciales de base de datos
+    pytest.skip(f"Database not configured: {e}", allow_module_level=True)
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = LRUCache(max_size=100, ttl_seconds=30)
+    monkeypatch.setattr(order_repository, "cache", cache)
+    return cache
+
+
+async def _create(created, amount=50.0):
+    order = await order_repository.create_order(["product"], amount, {"created_by": "test"})
+    created.append(order.id)
+    return order
+
+
+def test_set_skips_value_read_before_invalidation():
+    """Un valor leído antes de invalidar la clave (o de vaciar el cache) no se guarda"""
+    cache = LRUCache(max_size=2, ttl_seconds=30)
+
+    generation = cache.generation()
+    cache.invalidate("a")
+    cache.set("a", "stale", generation)
+    cache.set("b", "fresh", generation)
+    assert cache.get("a") is None
+    assert cache.get("b") == "fresh"
+
+    generation = cache.generation()
+    cache.clear()
+    cache.set("b", "stale", generation)
+    assert cache.get("b") is None
+
+    # Claves descartadas del registro de generaciones: se asume invalidada
+    generation = cache.generation()
+    for key in ("a", "b", "c"):
+        cache.invalidate(key)
+    cache.set("a", "stale", generation)
+    assert cache.get("a") is None
+
+
+def test_read_racing_a_write_does_not_cache_old_row(run_db, cache, monkeypatch):
+    """Si la orden se escribe mientras se lee, la fila leída no queda en el cache"""
+    async def test(created):
+        order = await _create(created)
+        cache.invalidate(order.id)
+        fetchrow = db.fetchrow
+
+        async def read_then_write(query, *args):
+            row = await fetchrow(query, *args)
+            # La escritura confirma después de la lectura pero antes del set
+            monkeypatch.setattr(db, "fetchrow", fetchrow)
+            await order_service.apply_event(order.id, EventType.NO_VERIFICATION_NEEDED)
+            return row
+
+        monkeypatch.setattr(db, "fetchrow", read_then_write)
+        stale = await order_repository.get_order_by_id(order.id)
+
+        assert stale.state == OrderState.PENDING
+        cached = cache.get(order.id)
+        assert cached is None or cached.state == OrderState.PENDING_PAYMENT
+        assert (await order_repository.get_order_by_id(order.id)).state == OrderState.PENDING_PAYMENT
+
+    run_db(test)
+
+
+def test_get_order_returns_copy_of_cached_order(run_db, cache):
+    """Modificar la orden retornada no cambia la que está en el cache"""
+    async def test(created):
+        order = await _create(created)
+        order.metadata["mutated"] = True
+
+        first = await order_repository.get_order_by_id(order.id)
+        first.metadata["mutated"] = True
+        first.state = OrderState.CANCELLED
+
+        second = await order_repository.get_order_by_id(order.id)
+        assert cache.hits >= 1
+        assert "mutated" not in second.metadata
+        assert second.state == OrderState.PENDING
+
+    run_db(test)
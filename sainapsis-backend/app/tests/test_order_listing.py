@@ -0,0 +1,211 @@
+# test_order_listing.py
+
+"""
+Listado de órdenes con paginación keyset: cursor opaco, empates en
+(created_at, id) y cada combinación de filtros del SQL dinámico.
+"""
+
+import asyncio
+import itertools
+import random
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
+
+import pytest
+
+from app.core.exceptions import InvalidOrderData
+from app.models.domain import OrderState
+
+try:
+    from app.core.database import db
+    from app.repositories.order_repository import order_repository
+    from app.services.order_service import (
+        MAX_PAGE_SIZE, _decode_cursor, _encode_cursor, order_service,
+    )
+except ValueError as e:  # sin credenciales de base de datos
+    pytest.skip(f"Database not configured: {e}", allow_module_level=True)
+
+
+def _window_start() -> datetime:
+    """Ventana de fechas propia para que otras órdenes no entren en el listado"""
+    return datetime(2001, 1, 1, tzinfo=timezone.utc) + timedelta(days=random.randrange(3650))
+
+
+async def _seed(created, rows):
+    """Crear órdenes con (created_at, state, amount) fijos"""
+    orders = []
+    for created_at, state, amount in rows:
+        order = await order_repository.create_order(["product"], amount, {"created_by": "test"})
+        created.append(order.id)
+        await db.execute_command(
+            "UPDATE orders SET created_at = $2, state = $3 WHERE id = $1",
+            order.id, created_at, state.value,
+        )
+        if order_repository.cache is not None:
+            order_repository.cache.invalidate(order.id)
+        orders.append((order.id, created_at, state, amount))
+    return orders
+
+
+async def _all_pages(limit, max_pages=100, **filters):
+    """Recorrer todas las páginas siguiendo next_cursor"""
+    ids, cursor = [], None
+    for pages in range(1, max_pages + 1):
+        page = await order_service.list_orders(limit=limit, cursor=cursor, **filters)
+        ids.extend(order.id for order in page.orders)
+        if page.next_cursor is None:
+            return ids, pages
+        assert len(page.orders) == limit
+        assert page.next_cursor != cursor, "cursor did not advance"
+        cursor = page.next_cursor
+    raise AssertionError(f"pagination did not finish in {max_pages} pages")
+
+
+# ============================================================================
+# CURSOR
+# ============================================================================
+
+def test_cursor_round_trip():
+    """El cursor devuelve la misma clave (timestamp con zona y microsegundos, id)"""
+    for timestamp in (
+        datetime(2024, 2, 29, 23, 59, 59, 999999, tzinfo=timezone.utc),
+        datetime(2024, 6, 1, 8, 0, tzinfo=timezone(timedelta(hours=-5))),
+    ):
+        order_id = uuid4()
+        cursor = _encode_cursor(timestamp, order_id)
+
+        assert "=" not in cursor
+        assert _decode_cursor(cursor) == (timestamp, order_id)
+        assert _decode_cursor(cursor)[0].utcoffset() == timestamp.utcoffset()
+
+
+@pytest.mark.parametrize("cursor", [
+    "not-a-cursor!",
+    "YWJj",                                                      # "abc": sin separador
+    _encode_cursor(datetime(2024, 1, 1, tzinfo=timezone.utc), uuid4())[:-3],
+    "bm90LWEtZGF0ZXwxMjM0",                                      # "not-a-date|1234"
+    "MjAyNC0wMS0wMVQwMDowMDowMHxub3QtYS11dWlk",                  # fecha|no-uuid
+    "MjAyNHwxfDI",                                               # dos separadores
+    "__8",                                                       # bytes no UTF-8
+])
+def test_decode_cursor_rejects_invalid(cursor):
+    """Cursores corruptos son datos inválidos (400), nunca un 500"""
+    with pytest.raises(InvalidOrderData) as error:
+        _decode_cursor(cursor)
+    assert error.value.status_code == 400
+
+
+def test_list_orders_bad_cursor_returns_400(client):
+    """GET /orders/ con cursor inválido responde 400"""
+    response = client.get("/orders/", params={"cursor": "not-a-cursor!"})
+
+    assert response.status_code == 400
+    assert "cursor" in response.json()["detail"].lower()
+
+
+# ============================================================================
+# PAGINACIÓN
+# ============================================================================
+
+def test_pagination_breaks_created_at_ties_by_id(run_db):
+    """Órdenes con el mismo created_at salen una sola vez, por id descendente"""
+    async def test(created):
+        start = _window_start()
+        tied = start + timedelta(hours=1)
+        rows = [(tied, OrderState.PENDING, 10.0)] * 7 + [(start, OrderState.PENDING, 10.0)]
+        orders = await _seed(created, rows)
+
+        window = {"created_after": start, "created_before": start + timedelta(days=1)}
+        for limit in (1, 2, 3, 7, 8, 50):
+            ids, pages = await _all_pages(limit, **window)
+
+            tied_ids = sorted((order_id for order_id, at, _, _ in orders if at == tied), reverse=True)
+            assert ids == tied_ids + [orders[-1][0]]
+            assert pages == -(-len(orders) // limit)
+
+    run_db(test)
+
+
+def test_pagination_cursor_skips_rows_before_key(run_db):
+    """El cursor de una orden devuelve solo las posteriores a su clave (created_at, id)"""
+    async def test(created):
+        start = _window_start()
+        tied = start + timedelta(minutes=30)
+        orders = await _seed(created, [(tied, OrderState.PENDING, 10.0)] * 4)
+        ordered = sorted((order_id for order_id, _, _, _ in orders), reverse=True)
+
+        window = {"created_after": start, "created_before": start + timedelta(days=1)}
+        page = await order_service.list_orders(
+            limit=10, cursor=_encode_cursor(tied, ordered[1]), **window
+        )
+
+        assert [order.id for order in page.orders] == ordered[2:]
+        assert page.next_cursor is None
+
+    run_db(test)
+
+
+def test_list_orders_every_filter_combination(run_db):
+    """Cada combinación de filtros arma un SQL válido y devuelve las órdenes esperadas"""
+    async def test(created):
+        start = _window_start()
+        states = [OrderState.PENDING, OrderState.CONFIRMED, OrderState.CANCELLED]
+        rows = [
+            (start + timedelta(minutes=i // 2), states[i % len(states)], float(10 * (i + 1)))
+            for i in range(18)
+        ]
+        orders = await _seed(created, rows)
+        end = start + timedelta(days=1)
+
+        options = {
+            "state": OrderState.CONFIRMED,
+            "min_amount": 40.0,
+            "max_amount": 150.0,
+            "created_after": start + timedelta(minutes=2),
+            "created_before": start + timedelta(minutes=7),
+        }
+
+        def expected(filters):
+            after = filters.get("created_after", start)
+            before = filters.get("created_before", end)
+            return [
+                order_id
+                for order_id, created_at, state, amount in sorted(
+                    orders, key=lambda o: (o[1], o[0]), reverse=True
+                )
+                if after <= created_at < before
+                and filters.get("state", state) == state
+                and amount >= filters.get("min_amount", amount)
+                and amount <= filters.get("max_amount", amount)
+            ]
+
+        names = list(options)
+        for size in range(len(names) + 1):
+            for combination in itertools.combinations(names, size):
+                filters = {"created_after": start, "created_before": end}
+                filters.update((name, options[name]) for name in combination)
+
+                ids, _ = await _all_pages(2, **filters)
+                assert ids == expected(filters), combination
+
+                # Sin la ventana de fechas el SQL cambia; la primera página sigue siendo válida
+                unwindowed = {name: options[name] for name in combination}
+                page = await order_service.list_orders(limit=5, **unwindowed)
+                for order in page.orders:
+                    assert order.state == unwindowed.get("state", order.state)
+                    assert order.amount >= unwindowed.get("min_amount", order.amount)
+                    assert order.amount <= unwindowed.get("max_amount", order.amount)
+
+    run_db(test)
+
+
+@pytest.mark.parametrize("kwargs", [
+    {"limit": 0},
+    {"limit": MAX_PAGE_SIZE + 1},
+    {"min_amount": 10.0, "max_amount": 5.0},
+])
+def test_list_orders_rejects_invalid_arguments(kwargs):
+    """limit fuera de rango o rango de montos invertido es 400 antes de ir a la base"""
+    with pytest.raises(InvalidOrderData) as error:
+        asyncio.run(order_service.list_orders(**kwargs))
+    assert error.value.status_code == 400
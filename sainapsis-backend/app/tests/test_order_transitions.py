@@ -0,0 +1,277 @@
+# test_order_transitions.py
+
+"""
+Transición atómica de órdenes (compare-and-set) contra la base de datos:
+una carrera perdida no retorna fila y no escribe evento ni tickets.
+"""
+
+import pytest
+
+from app.core.exceptions import OrderConflict
+from app.models.domain import EventType, OrderState
+
+try:
+    from app.business_rules.adapters.order_adapter import sainapsis_order_adapter
+    from app.core.database import db
+    from app.repositories.order_repository import order_repository
+    from app.services.order_service import order_service
+except ValueError as e:  # sin credenciales de base de datos
+    pytest.skip(f"Database not configured: {e}", allow_module_level=True)
+
+TICKETS = [
+    {"reason": "Test ticket", "amount": 150.0, "metadata": {"source": "test"}},
+    {"reason": "Second ticket", "amount": 20.5, "metadata": {}},
+]
+
+
+async def _create(created, amount=50.0):
+    order = await order_repository.create_order(["product"], amount, {"created_by": "test"})
+    created.append(order.id)
+    return order
+
+
+async def _written(order_id):
+    events = await db.fetch("SELECT * FROM order_events WHERE order_id = $1", order_id)
+    tickets = await db.fetch("SELECT * FROM support_tickets WHERE order_id = $1", order_id)
+    return events, tickets
+
+
+def _transition(order, expected_state, **kwargs):
+    return order_repository.transition_order_state(
+        order_id=order.id,
+        expected_state=expected_state,
+        new_state=OrderState.PENDING_PAYMENT,
+        metadata={**order.metadata, "step": 1},
+        event_type=EventType.NO_VERIFICATION_NEEDED,
+        event_metadata={"source": "test"},
+        support_tickets=TICKETS,
+        **kwargs,
+    )
+
+
+def test_transition_writes_order_event_and_tickets(run_db):
+    """La transición ganada actualiza la orden y escribe su evento y tickets"""
+    async def test(created):
+        order = await _create(created)
+
+        updated, ticket_ids = await _transition(
+            order, OrderState.PENDING, expected_updated_at=order.updated_at
+        )
+
+        assert updated is not None
+        assert updated.state == OrderState.PENDING_PAYMENT
+        assert updated.metadata["step"] == 1
+        assert updated.updated_at >= order.updated_at
+
+        events, tickets = await _written(order.id)
+        assert len(events) == 1
+        assert events[0]["event_type"] == EventType.NO_VERIFICATION_NEEDED.value
+        assert events[0]["old_state"] == OrderState.PENDING.value
+        assert events[0]["new_state"] == OrderState.PENDING_PAYMENT.value
+        assert events[0]["metadata"] == {"source": "test"}
+
+        assert sorted(ticket_ids) == sorted(ticket["id"] for ticket in tickets)
+        assert sorted((t["reason"], float(t["amount"])) for t in tickets) == [
+            ("Second ticket", 20.5),
+            ("Test ticket", 150.0),
+        ]
+
+    run_db(test)
+
+
+def test_transition_lost_race_on_state_writes_nothing(run_db):
+    """Si la orden ya no está en el estado esperado no hay fila, evento ni tickets"""
+    async def test(created):
+        order = await _create(created)
+
+        updated, ticket_ids = await _transition(order, OrderState.ON_HOLD)
+
+        assert updated is None
+        assert ticket_ids == []
+        events, tickets = await _written(order.id)
+        assert events == []
+        assert tickets == []
+
+        row = await db.fetchrow("SELECT state, updated_at FROM orders WHERE id = $1", order.id)
+        assert row["state"] == OrderState.PENDING.value
+        assert row["updated_at"] == order.updated_at
+
+    run_db(test)
+
+
+def test_transition_lost_race_on_updated_at_writes_nothing(run_db):
+    """Mismo estado pero otra versión (A -> B -> A o solo metadata): no se pisa el cambio"""
+    async def test(created):
+        order = await _create(created)
+        await db.execute_command(
+            "UPDATE orders SET metadata = metadata || '{\"other\": 1}'::jsonb WHERE id = $1", order.id
+        )
+
+        updated, ticket_ids = await _transition(
+            order, OrderState.PENDING, expected_updated_at=order.updated_at
+        )
+
+        assert updated is None
+        assert ticket_ids == []
+        events, tickets = await _written(order.id)
+        assert events == []
+        assert tickets == []
+
+        row = await db.fetchrow("SELECT state, metadata FROM orders WHERE id = $1", order.id)
+        assert row["state"] == OrderState.PENDING.value
+        assert row["metadata"]["other"] == 1
+        assert "step" not in row["metadata"]
+
+    run_db(test)
+
+
+def test_transition_second_writer_loses(run_db):
+    """Dos escrituras desde la misma lectura: solo la primera gana"""
+    async def test(created):
+        order = await _create(created)
+
+        first, _ = await _transition(order, OrderState.PENDING, expected_updated_at=order.updated_at)
+        second, second_tickets = await _transition(
+            order, OrderState.PENDING, expected_updated_at=order.updated_at
+        )
+
+        assert first is not None
+        assert second is None
+        assert second_tickets == []
+        events, tickets = await _written(order.id)
+        assert len(events) == 1
+        assert len(tickets) == len(TICKETS)
+
+    run_db(test)
+
+
+def test_apply_event_with_stale_order_raises_conflict(run_db):
+    """Con la orden del llamador (p.ej. reglas evaluadas sobre ella) no se reintenta: 409"""
+    async def test(created):
+        order = await _create(created)
+        stale = await order_service.get_order(order.id)
+        await order_service.apply_event(order.id, EventType.NO_VERIFICATION_NEEDED)
+
+        try:
+            await order_service.apply_event(
+                order.id, EventType.NO_VERIFICATION_NEEDED, order=stale,
+                extra_support_tickets=TICKETS[:1],
+            )
+        except OrderConflict as e:
+            assert e.status_code == 409
+        else:
+            raise AssertionError("Expected OrderConflict")
+
+        events, tickets = await _written(order.id)
+        assert [e["event_type"] for e in events] == [EventType.NO_VERIFICATION_NEEDED.value]
+        assert tickets == []
+
+    run_db(test)
+
+
+def test_apply_event_reports_lost_race_as_conflict(run_db, monkeypatch):
+    """Sin orden del llamador se relee; si el evento ya no aplica tras la carrera es 409, no 400"""
+    async def test(created):
+        order = await _create(created)
+        stale = await order_service.get_order(order.id)
+        await order_service.apply_event(order.id, EventType.NO_VERIFICATION_NEEDED)
+
+        # La primera lectura ve la orden de antes del cambio de "otro worker"
+        reads = []
+        get_order_by_id = order_repository.get_order_by_id
+
+        async def read(order_id):
+            reads.append(order_id)
+            return stale if len(reads) == 1 else await get_order_by_id(order_id)
+
+        monkeypatch.setattr(order_repository, "get_order_by_id", read)
+
+        try:
+            await order_service.apply_event(order.id, EventType.NO_VERIFICATION_NEEDED)
+        except OrderConflict as e:
+            assert e.status_code == 409
+        else:
+            raise AssertionError("Expected OrderConflict")
+
+        assert len(reads) == 2
+        events, _ = await _written(order.id)
+        assert len(events) == 1
+
+    run_db(test)
+
+
+def test_apply_event_retries_lost_race_when_still_valid(run_db, monkeypatch):
+    """Sin orden del llamador, si el evento sigue siendo válido tras releer se aplica"""
+    async def test(created):
+        order = await _create(created)
+        stale = await order_service.get_order(order.id)
+        await db.execute_command(
+            "UPDATE orders SET metadata = metadata || '{\"other\": 1}'::jsonb WHERE id = $1", order.id
+        )
+
+        reads = []
+        get_order_by_id = order_repository.get_order_by_id
+
+        async def read(order_id):
+            reads.append(order_id)
+            return stale if len(reads) == 1 else await get_order_by_id(order_id)
+
+        monkeypatch.setattr(order_repository, "get_order_by_id", read)
+        # El cache podría tener la copia vieja: la relectura debe ir a la base
+        if order_repository.cache is not None:
+            order_repository.cache.invalidate(order.id)
+
+        transition = await order_service.apply_event(order.id, EventType.NO_VERIFICATION_NEEDED)
+
+        assert len(reads) == 2
+        assert transition.new_state == OrderState.PENDING_PAYMENT
+        assert transition.order.metadata["other"] == 1
+
+    run_db(test)
+
+
+def test_apply_event_persists_rule_metadata_updates(run_db):
+    """La metadata de las reglas se guarda con la transición, sin tocar las claves reservadas"""
+    async def test(created):
+        order = await _create(created)
+        await db.execute_command(
+            "UPDATE orders SET metadata = metadata || '{\"state_machine_version\": 1}'::jsonb WHERE id = $1",
+            order.id,
+        )
+        if order_repository.cache is not None:
+            order_repository.cache.invalidate(order.id)
+
+        transition = await order_service.apply_event(
+            order.id, EventType.NO_VERIFICATION_NEEDED,
+            extra_metadata_updates={"requires_support_follow_up": True, "state_machine_version": 99},
+        )
+
+        row = await db.fetchrow("SELECT metadata FROM orders WHERE id = $1", order.id)
+        assert row["metadata"]["requires_support_follow_up"] is True
+        assert row["metadata"]["state_machine_version"] == 1
+        assert transition.order.metadata == row["metadata"]
+
+    run_db(test)
+
+
+def test_adapter_persists_metadata_only_from_opt_in_rules(run_db):
+    """Solo las reglas con persist_metadata escriben en la orden; las informativas no"""
+    async def test(created):
+        order = await _create(created)
+        await order_service.apply_event(
+            order.id, EventType.NO_VERIFICATION_NEEDED, extra_support_tickets=TICKETS[:1],
+        )
+
+        await sainapsis_order_adapter.process_event_with_business_rules(order.id, EventType.PAYMENT_SUCCESSFUL)
+        row = await db.fetchrow("SELECT metadata FROM orders WHERE id = $1", order.id)
+        assert row["metadata"]["requires_support_follow_up"] is True
+
+        for event_type in (EventType.MANUAL_REVIEW_REQUIRED, EventType.REVIEW_APPROVED):
+            await sainapsis_order_adapter.process_event_with_business_rules(order.id, event_type)
+
+        row = await db.fetchrow("SELECT state, metadata FROM orders WHERE id = $1", order.id)
+        assert row["state"] == OrderState.PROCESSING.value
+        assert "in_review_state" not in row["metadata"]
+        assert "available_review_actions" not in row["metadata"]
+
+    run_db(test)
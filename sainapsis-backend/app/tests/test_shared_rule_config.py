@@ -0,0 +1,85 @@
+# test_shared_rule_config.py
+
+"""
+Conjunto de reglas compartido: lo que publica un worker (guardado en
+business_rule_configs) lo carga otro con su propio registro.
+"""
+
+import pytest
+
+try:
+    from app.business_rules import DEFAULT_RULES_CONFIG
+    from app.business_rules.engine import BusinessRuleRegistry
+    from app.business_rules.rules.sainapsis_rules import SAINAPSIS_RULE_CATALOG
+    from app.business_rules.shared_config import SharedRuleConfig
+    from app.core.database import db
+    from app.repositories.rule_config_repository import rule_config_repository
+except ValueError as e:  # sin credenciales de base de datos
+    pytest.skip(f"Database not configured: {e}", allow_module_level=True)
+
+SMALL_ORDER_RULE = "sainapsis_small_order_no_verification"
+
+
+def _worker() -> SharedRuleConfig:
+    """Registro propio, como el de otro proceso, cargado desde el archivo"""
+    registry = BusinessRuleRegistry()
+    for rule_class in SAINAPSIS_RULE_CATALOG.values():
+        registry.register_rule_class(rule_class)
+    registry.load_config_file(DEFAULT_RULES_CONFIG)
+    return SharedRuleConfig(registry)
+
+
+def _run_with_cleanup(run_db, test):
+    async def wrapped(created):
+        before = await db.fetchrow("SELECT coalesce(max(id), 0) AS id FROM business_rule_configs")
+        try:
+            await test()
+        finally:
+            await db.execute_command("DELETE FROM business_rule_configs WHERE id > $1", before["id"])
+
+    run_db(wrapped)
+
+
+def test_other_worker_loads_shared_change(run_db):
+    """Un toggle y un cambio de parámetros publicados en un worker llegan al otro"""
+    async def test():
+        publisher, other = _worker(), _worker()
+        await other.refresh()
+
+        publisher.registry.update_rule_params(SMALL_ORDER_RULE, threshold=10.0)
+        publisher.registry.set_rule_enabled(SMALL_ORDER_RULE, False)
+        config_id = await publisher.share(publisher.registry.current())
+
+        rule_set = await other.refresh()
+
+        assert rule_set is not None
+        assert rule_set.source == f"shared:{config_id}"
+        assert other.loaded_id == config_id
+        assert not rule_set.get_rule(SMALL_ORDER_RULE).is_enabled()
+        assert rule_set.get_rule(SMALL_ORDER_RULE).threshold == 10.0
+        assert rule_set.to_config()["rules"] == publisher.registry.current().to_config()["rules"]
+
+        # Sin cambios nuevos no se vuelve a publicar
+        assert await other.refresh() is None
+
+    _run_with_cleanup(run_db, test)
+
+
+def test_refresh_keeps_newer_config_and_skips_invalid(run_db):
+    """No se vuelve a una configuración anterior; una inválida deja el conjunto vigente"""
+    async def test():
+        publisher, other = _worker(), _worker()
+        first = await publisher.share(publisher.registry.current())
+        await other.refresh()
+        version = other.registry.version
+
+        other.loaded_id = first + 100
+        assert await other.refresh() is None
+
+        other.loaded_id = first
+        await rule_config_repository.save_config({"rules": [{"rule": "NoSuchRule"}]}, "test")
+        assert await other.refresh() is None
+        assert other.registry.version == version
+        assert other.loaded_id == first
+
+    _run_with_cleanup(run_db, test)
@@ -0,0 +1,307 @@
+# test_state_machine.py
+
+"""
+Máquina de estados compilada: la versión 1 equivale a la tabla TRANSITIONS
+original, las definiciones inválidas se rechazan al cargar y el registro
+conserva las versiones de las órdenes en curso.
+"""
+
+import copy
+import json
+from datetime import datetime, timezone
+from uuid import uuid4
+
+import pytest
+
+from app.core.exceptions import InvalidTransition, UnknownStateMachineVersion
+from app.models.domain import EventType, Order, OrderState
+from app.services.state_machine import (
+    DEFAULT_STATE_MACHINE_DIR,
+    LEGACY_VERSION,
+    STATE_MACHINE_VERSION_KEY,
+    StateMachineConfigError,
+    StateMachineRegistry,
+    compile_state_machine,
+)
+
+
+# ============================================================================
+# REFERENCIA: tabla y reglas de la máquina de estados antes de compilarla
+# ============================================================================
+
+LEGACY_TRANSITIONS = {
+    (OrderState.PENDING, EventType.PENDING_BIOMETRICAL_VERIFICATION): OrderState.ON_HOLD,
+    (OrderState.PENDING, EventType.NO_VERIFICATION_NEEDED): OrderState.PENDING_PAYMENT,
+    (OrderState.PENDING, EventType.PAYMENT_FAILED): OrderState.CANCELLED,
+    (OrderState.PENDING, EventType.ORDER_CANCELLED): OrderState.CANCELLED,
+    (OrderState.ON_HOLD, EventType.BIOMETRICAL_VERIFICATION_SUCCESSFUL): OrderState.PENDING_PAYMENT,
+    (OrderState.ON_HOLD, EventType.VERIFICATION_FAILED): OrderState.CANCELLED,
+    (OrderState.ON_HOLD, EventType.ORDER_CANCELLED_BY_USER): OrderState.CANCELLED,
+    (OrderState.PENDING_PAYMENT, EventType.PAYMENT_SUCCESSFUL): OrderState.CONFIRMED,
+    (OrderState.PENDING_PAYMENT, EventType.ORDER_CANCELLED_BY_USER): OrderState.CANCELLED,
+    (OrderState.CONFIRMED, EventType.PREPARING_SHIPMENT): OrderState.PROCESSING,
+    (OrderState.CONFIRMED, EventType.ORDER_CANCELLED_BY_USER): OrderState.CANCELLED,
+    (OrderState.CONFIRMED, EventType.MANUAL_REVIEW_REQUIRED): OrderState.REVIEWING,
+    (OrderState.REVIEWING, EventType.REVIEW_APPROVED): OrderState.PROCESSING,
+    (OrderState.REVIEWING, EventType.REVIEW_REJECTED): OrderState.CANCELLED,
+    (OrderState.REVIEWING, EventType.ORDER_CANCELLED_BY_USER): OrderState.CANCELLED,
+    (OrderState.PROCESSING, EventType.ITEM_DISPATCHED): OrderState.SHIPPED,
+    (OrderState.PROCESSING, EventType.ORDER_CANCELLED_BY_USER): OrderState.CANCELLED,
+    (OrderState.SHIPPED, EventType.ITEM_RECEIVED_BY_CUSTOMER): OrderState.DELIVERED,
+    (OrderState.SHIPPED, EventType.DELIVERY_ISSUE): OrderState.ON_HOLD,
+    (OrderState.SHIPPED, EventType.ORDER_CANCELLED_BY_USER): OrderState.CANCELLED,
+    (OrderState.DELIVERED, EventType.RETURN_INITIATED_BY_CUSTOMER): OrderState.RETURNING,
+    (OrderState.RETURNING, EventType.ITEM_RECEIVED_BACK): OrderState.RETURNED,
+    (OrderState.RETURNED, EventType.REFUND_PROCESSED): OrderState.REFUNDED,
+}
+
+LEGACY_NON_CANCELLABLE_STATES = {OrderState.DELIVERED, OrderState.RETURNED, OrderState.CANCELLED}
+
+LEGACY_FINAL_STATES = {OrderState.DELIVERED, OrderState.REFUNDED, OrderState.CANCELLED}
+
+
+def legacy_next_state(state: OrderState, event: EventType):
+    """get_next_state original: tabla y luego cancelación por usuario"""
+    if (state, event) in LEGACY_TRANSITIONS:
+        return LEGACY_TRANSITIONS[(state, event)]
+    if event == EventType.ORDER_CANCELLED_BY_USER and state not in LEGACY_NON_CANCELLABLE_STATES:
+        return OrderState.CANCELLED
+    return None
+
+
+def legacy_allowed_events(state: OrderState):
+    """get_allowed_events original (sin orden: se construía con un set)"""
+    allowed = {event for (from_state, event) in LEGACY_TRANSITIONS if from_state == state}
+    if state not in LEGACY_NON_CANCELLABLE_STATES:
+        allowed.add(EventType.ORDER_CANCELLED_BY_USER)
+    return allowed
+
+
+def _v1():
+    registry = StateMachineRegistry(DEFAULT_STATE_MACHINE_DIR)
+    registry.load()
+    return registry.get(LEGACY_VERSION)
+
+
+def _definition(**overrides):
+    """Definición mínima válida: pending -> confirmed -> delivered"""
+    definition = {
+        "version": 2,
+        "final_states": ["delivered", "cancelled"],
+        "non_cancellable_states": ["delivered", "cancelled"],
+        "transitions": {
+            "pending": {"paymentSuccessful": "confirmed"},
+            "confirmed": {"itemReceivedByCustomer": "delivered"},
+        },
+    }
+    definition.update(overrides)
+    return definition
+
+
+def _order(version) -> Order:
+    now = datetime.now(timezone.utc)
+    metadata = {} if version is None else {STATE_MACHINE_VERSION_KEY: version}
+    return Order(
+        id=uuid4(), product_ids=["product"], amount=10.0, state=OrderState.PENDING,
+        metadata=metadata, created_at=now, updated_at=now,
+    )
+
+
+# ============================================================================
+# EQUIVALENCIA v1
+# ============================================================================
+
+def test_v1_next_state_matches_legacy_table():
+    """Cada (estado, evento) lleva al mismo destino o es inválido en ambas"""
+    machine = _v1()
+
+    for state in OrderState:
+        for event in EventType:
+            expected = legacy_next_state(state, event)
+            if expected is None:
+                with pytest.raises(InvalidTransition):
+                    machine.get_next_state(state, event)
+                assert not machine.is_allowed(state, event)
+            else:
+                assert machine.get_next_state(state, event) == expected, (state, event)
+                assert machine.is_allowed(state, event)
+
+
+def test_v1_allowed_events_match_legacy():
+    """Mismos eventos permitidos por estado, sin repetidos"""
+    machine = _v1()
+
+    for state in OrderState:
+        allowed = machine.get_allowed_events(state)
+        assert set(allowed) == legacy_allowed_events(state), state
+        assert len(allowed) == len(set(allowed))
+
+
+def test_v1_final_and_non_cancellable_states_match_legacy():
+    machine = _v1()
+
+    assert {state for state in OrderState if machine.is_final_state(state)} == LEGACY_FINAL_STATES
+    assert machine.non_cancellable_states == LEGACY_NON_CANCELLABLE_STATES
+    assert machine.transitions == LEGACY_TRANSITIONS
+
+
+def test_definition_round_trip():
+    """to_definition compila a la misma máquina"""
+    machine = _v1()
+    recompiled = compile_state_machine(json.loads(json.dumps(machine.to_definition())))
+
+    assert recompiled.next_state == machine.next_state
+    assert recompiled.allowed_events == machine.allowed_events
+    assert recompiled.final_states == machine.final_states
+
+
+# ============================================================================
+# DEFINICIONES INVÁLIDAS
+# ============================================================================
+
+def test_minimal_definition_compiles():
+    machine = compile_state_machine(_definition())
+
+    assert machine.version == 2
+    assert machine.get_next_state(OrderState.PENDING, EventType.PAYMENT_SUCCESSFUL) == OrderState.CONFIRMED
+    assert machine.get_next_state(OrderState.CONFIRMED, EventType.ORDER_CANCELLED_BY_USER) == OrderState.CANCELLED
+
+
+def test_unreachable_state_is_rejected():
+    """Un estado con transiciones al que no se llega desde pending"""
+    transitions = copy.deepcopy(_definition()["transitions"])
+    transitions["returning"] = {"itemReceivedBack": "delivered"}
+
+    with pytest.raises(StateMachineConfigError, match="unreachable states \\['returning'\\]"):
+        compile_state_machine(_definition(transitions=transitions))
+
+
+def test_unreachable_final_state_is_rejected():
+    """Un estado final declarado al que ninguna transición lleva"""
+    with pytest.raises(StateMachineConfigError, match="unreachable states \\['refunded'\\]"):
+        compile_state_machine(_definition(final_states=["delivered", "cancelled", "refunded"]))
+
+
+def test_dead_end_state_is_rejected():
+    """Un estado no final sin transiciones (ni cancelación) no puede terminar"""
+    transitions = copy.deepcopy(_definition()["transitions"])
+    transitions["confirmed"]["deliveryIssue"] = "on_hold"
+
+    with pytest.raises(StateMachineConfigError, match="dead-end states .*'on_hold'"):
+        compile_state_machine(_definition(
+            transitions=transitions,
+            non_cancellable_states=["delivered", "cancelled", "on_hold"],
+        ))
+
+
+def test_cycle_without_exit_is_a_dead_end():
+    """Estados que solo se llaman entre sí, sin camino a un estado final"""
+    transitions = {
+        "pending": {"paymentSuccessful": "confirmed", "orderCancelled": "cancelled"},
+        "confirmed": {"manualReviewRequired": "reviewing"},
+        "reviewing": {"reviewApproved": "confirmed"},
+    }
+
+    with pytest.raises(StateMachineConfigError, match="dead-end states .*\\['confirmed', 'reviewing'\\]"):
+        compile_state_machine(_definition(
+            transitions=transitions,
+            final_states=["cancelled"],
+            non_cancellable_states=["cancelled", "confirmed", "reviewing"],
+        ))
+
+
+def test_user_cancellation_is_an_exit():
+    """La cancelación por usuario cuenta como salida de un estado cancelable"""
+    transitions = copy.deepcopy(_definition()["transitions"])
+    transitions["confirmed"]["deliveryIssue"] = "on_hold"
+
+    machine = compile_state_machine(_definition(transitions=transitions))
+
+    assert machine.get_allowed_events(OrderState.ON_HOLD) == (EventType.ORDER_CANCELLED_BY_USER,)
+
+
+@pytest.mark.parametrize("definition", [
+    None,
+    [],
+    _definition(version=0),
+    _definition(version="2"),
+    _definition(version=True),
+    _definition(transitions={}),
+    _definition(transitions={"pending": ["confirmed"]}),
+    _definition(transitions={"pending": {"paymentSuccessful": "paid"}}),
+    _definition(transitions={"pending": {"paid": "confirmed"}}),
+    _definition(transitions={"limbo": {"paymentSuccessful": "confirmed"}}),
+    _definition(final_states="delivered"),
+    _definition(final_states=[]),
+    _definition(non_cancellable_states=["limbo"]),
+    _definition(initial_state="pending"),
+])
+def test_malformed_definitions_are_rejected(definition):
+    with pytest.raises(StateMachineConfigError):
+        compile_state_machine(definition)
+
+
+# ============================================================================
+# REGISTRO DE VERSIONES
+# ============================================================================
+
+def _write(directory, name, definition):
+    (directory / name).write_text(json.dumps(definition), encoding="utf-8")
+
+
+def test_registry_keeps_versions_and_resolves_orders(tmp_path):
+    """La versión más alta es la vigente; cada orden usa la suya, aunque su archivo desaparezca"""
+    v1 = _v1().to_definition()
+    _write(tmp_path, "v1.json", v1)
+    _write(tmp_path, "v2.json", _definition())
+    registry = StateMachineRegistry(str(tmp_path))
+
+    assert registry.load().version == 2
+    assert registry.for_order(_order(None)).version == LEGACY_VERSION
+    assert registry.for_order(_order(1)).version == 1
+    assert registry.for_order(_order(2)).version == 2
+
+    (tmp_path / "v2.json").unlink()
+    registry.load()
+    assert registry.versions() == [1, 2]
+    assert registry.for_order(_order(2)).version == 2
+
+
+@pytest.mark.parametrize("version", [3, "1", 1.0, True, None, [1]])
+def test_registry_unknown_order_version(tmp_path, version):
+    """Una versión no cargada o de otro tipo es un conflicto (409), sin releer el directorio"""
+    _write(tmp_path, "v1.json", _v1().to_definition())
+    registry = StateMachineRegistry(str(tmp_path))
+    registry.load()
+    loads = registry.loads
+
+    order = _order(version)
+    if version is None:
+        order.metadata[STATE_MACHINE_VERSION_KEY] = None
+
+    with pytest.raises(UnknownStateMachineVersion) as error:
+        registry.for_order(order)
+    assert error.value.status_code == 409
+    assert registry.loads == loads
+
+
+def test_registry_rejects_bad_directory(tmp_path):
+    """Directorio vacío, versiones duplicadas o una definición inválida: no se publica nada"""
+    registry = StateMachineRegistry(str(tmp_path))
+    with pytest.raises(StateMachineConfigError):
+        registry.load()
+
+    _write(tmp_path, "a.json", _definition())
+    _write(tmp_path, "b.json", _definition())
+    with pytest.raises(StateMachineConfigError, match="more than once"):
+        registry.load()
+    assert registry.current() is None
+
+    (tmp_path / "b.json").unlink()
+    assert registry.load().version == 2
+
+    _write(tmp_path, "c.json", _definition(version=3, final_states=[]))
+    with pytest.raises(StateMachineConfigError):
+        registry.load()
+    assert registry.current().version == 2
+    assert registry.versions() == [2]
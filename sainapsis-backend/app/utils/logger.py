@@ -0,0 +1,160 @@
+# app/utils/logger.py
+
+"""
+Sistema de logging de la aplicación.
+
+Los módulos usan logging.getLogger(__name__) y registran con formato
+perezoso (logger.debug("... %s", valor)): si el nivel está deshabilitado el
+mensaje nunca se construye. configure_logging() conecta el logger "app" a un
+QueueHandler acotado; un hilo QueueListener formatea y escribe, así el event
+loop nunca espera a stdout. Si la cola se llena los registros se descartan
+y se cuentan.
+
+Para puntos calientes que no deben registrar cada llamada, sampler() da un
+muestreo 1 de cada N por punto del código:
+
+    _log_high_risk = sampler()
+
+    if _log_high_risk():
+        logger.info("🚨 High-risk country %s", country_code)
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+
+# Nivel de los loggers de la aplicación (DEBUG, INFO, WARNING, ERROR)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+# text | json (una línea JSON por registro)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+
+# Registros pendientes como máximo antes de descartar
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+# Muestreo por defecto de sampler(): 1 de cada N llamadas (1 = sin muestreo)
+LOG_SAMPLE_EVERY = int(os.getenv("LOG_SAMPLE_EVERY", "100"))
+
+# Logger raíz de la aplicación: todos los módulos de app.* cuelgan de él
+APP_LOGGER = "app"
+
+# Atributos estándar de LogRecord (el resto son campos de extra=)
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Un objeto JSON por registro, con los campos pasados en extra="""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler que no formatea ni bloquea en el hilo que registra: el
+    registro se encola tal cual (lo formatea el listener) y, si la cola está
+    llena, se descarta.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class Sampler:
+    """Muestreo 1 de cada N llamadas para un punto del código"""
+
+    __slots__ = ("every", "calls")
+
+    def __init__(self, every: int):
+        self.every = max(1, every)
+        self.calls = 0
+
+    def __call__(self) -> bool:
+        self.calls += 1
+        return self.every == 1 or self.calls % self.every == 1
+
+
+def sampler(every: Optional[int] = None) -> Sampler:
+    """Sampler para un punto del código (por defecto LOG_SAMPLE_EVERY)"""
+    return Sampler(LOG_SAMPLE_EVERY if every is None else every)
+
+
+_handler: Optional[NonBlockingQueueHandler] = None
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def configure_logging(level: Optional[str] = None, fmt: Optional[str] = None):
+    """Conectar los loggers de la aplicación al QueueHandler (idempotente)"""
+    global _handler, _listener
+
+    app_logger = logging.getLogger(APP_LOGGER)
+    app_logger.setLevel(level or LOG_LEVEL)
+    if _handler is not None:
+        return
+
+    stream = logging.StreamHandler(sys.stdout)
+    if (fmt or LOG_FORMAT) == "json":
+        stream.setFormatter(JsonFormatter())
+    else:
+        stream.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+    log_queue: queue.Queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    _handler = NonBlockingQueueHandler(log_queue)
+    _listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=True)
+    _listener.start()
+
+    app_logger.addHandler(_handler)
+    app_logger.propagate = False
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """Vaciar la cola y detener el listener"""
+    global _handler, _listener
+
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    if _handler is not None:
+        logging.getLogger(APP_LOGGER).removeHandler(_handler)
+        _handler = None
+
+
+def logging_stats() -> Dict[str, Any]:
+    """Estado del logging asíncrono"""
+    return {
+        "level": logging.getLevelName(logging.getLogger(APP_LOGGER).getEffectiveLevel()),
+        "format": LOG_FORMAT,
+        "queued": _handler.queue.qsize() if _handler is not None else 0,
+        "queue_max_size": LOG_QUEUE_SIZE,
+        "dropped": _handler.dropped if _handler is not None else 0,
+        "sample_every": LOG_SAMPLE_EVERY,
+    }
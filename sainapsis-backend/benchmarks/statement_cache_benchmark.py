@@ -0,0 +1,122 @@
+# benchmarks/statement_cache_benchmark.py
+
+"""
+Benchmark de los queries calientes del OrderRepository en cada modo de cache
+de statements (disabled / direct / pooler).
+
+Uso (desde sainapsis-backend/, con el .env apuntando a una base de pruebas):
+
+    python -m benchmarks.statement_cache_benchmark --iterations 2000
+
+Crea una orden de prueba, ejecuta get_order_by_id, update_order_state y
+log_event N veces por modo y la elimina al terminar. Cada query se mide
+tomando una conexión del pool por llamada (pool) y dentro de un solo
+unit-of-work (uow). El cache de órdenes en proceso se desactiva:
+get_order_by_id debe llegar siempre a la base.
+"""
+
+import argparse
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List
+
+from app.core.database import db, STATEMENT_CACHE_MODES
+from app.models.domain import OrderState, EventType
+from app.repositories.order_repository import order_repository
+
+
+async def _time_operation(name: str, iterations: int, operation) -> List[Dict[str, Any]]:
+    """Ejecutar una operación N veces por scope (pool / uow) y medir latencia"""
+    results = []
+    for scope in ("pool", "uow"):
+        async with (db.unit_of_work() if scope == "uow" else _no_unit_of_work()):
+            # Warm-up: la primera ejecución prepara el statement
+            await operation()
+
+            started = time.perf_counter()
+            for _ in range(iterations):
+                await operation()
+            elapsed = time.perf_counter() - started
+
+        results.append({
+            "operation": name,
+            "scope": scope,
+            "ops_per_sec": iterations / elapsed,
+            "avg_ms": elapsed / iterations * 1000,
+        })
+    return results
+
+
+@asynccontextmanager
+async def _no_unit_of_work():
+    """Cada query toma y devuelve su propia conexión del pool"""
+    yield
+
+
+async def run_mode(mode: str, iterations: int):
+    """Ejecutar los queries calientes con un modo de cache específico"""
+    db.statement_cache_mode = mode
+    # Con ORDER_CACHE_ENABLED las lecturas saldrían del LRU y no del statement
+    order_repository.cache = None
+    await db.connect()
+
+    try:
+        order = await order_repository.create_order(
+            ["BENCH-PRODUCT"], 42.0, {"benchmark": True}
+        )
+
+        results = [
+            *await _time_operation(
+                "get_order_by_id",
+                iterations,
+                lambda: order_repository.get_order_by_id(order.id),
+            ),
+            *await _time_operation(
+                "update_order_state",
+                iterations,
+                lambda: order_repository.update_order_state(
+                    order.id, OrderState.PENDING, {"benchmark": True}
+                ),
+            ),
+            *await _time_operation(
+                "log_event",
+                iterations,
+                lambda: order_repository.log_event(
+                    order.id,
+                    EventType.ORDER_CANCELLED,
+                    OrderState.PENDING,
+                    OrderState.PENDING,
+                    {"benchmark": True},
+                ),
+            ),
+        ]
+
+        await db.execute_command("DELETE FROM orders WHERE id = $1", order.id)
+        return results
+
+    finally:
+        await db.disconnect()
+
+
+async def main(modes, iterations: int):
+    print(f"📊 Statement cache benchmark ({iterations} iterations per query)")
+    print(f"{'mode':<10} {'operation':<20} {'scope':<6} {'ops/sec':>10} {'avg ms':>10}")
+
+    for mode in modes:
+        for result in await run_mode(mode, iterations):
+            print(
+                f"{mode:<10} {result['operation']:<20} {result['scope']:<6} "
+                f"{result['ops_per_sec']:>10.0f} {result['avg_ms']:>10.3f}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=1000)
+    parser.add_argument(
+        "--modes", nargs="+", default=list(STATEMENT_CACHE_MODES), choices=STATEMENT_CACHE_MODES
+    )
+    args = parser.parse_args()
+
+    asyncio.run(main(args.modes, args.iterations))
@@ -4,7 +4,19 @@ from contextlib import asynccontextmanager
 import uvicorn
 from datetime import datetime
 
+from app.utils.logger import configure_logging, logging_stats
+
+# Logging asíncrono antes de importar los módulos que registran al cargarse
+configure_logging()
+
 from app.core.database import db
+from app.core.invalidation import invalidation_bus
+from app.repositories.order_repository import order_repository
+from app.business_rules.engine import business_rule_evaluator
+from app.business_rules.shadow import shadow_evaluator
+from app.business_rules.shared_config import shared_rule_config
+from app.services.state_machine import state_machine_registry
+from app.core.locks import order_locks
 from app.controllers.order_controller import router, health_router
 from app.controllers.support_controller import router as support_router 
 from app.controllers.review_controller import router as review_router
@@ -16,12 +28,19 @@ async def lifespan(app: FastAPI):
     # Startup
     print("🚀 Starting Sainapsis Order Management API...")
     await db.connect()
+    await db.check_schema()
     print("✅ Database connected successfully")
+    # Último conjunto de reglas publicado por la API (si hay) en lugar del archivo
+    await shared_rule_config.refresh()
+    await invalidation_bus.start()
+    await shadow_evaluator.start()
 
     yield
 
     # Shutdown
     print("🛑 Shutting down Sainapsis Order Management API...")
+    await shadow_evaluator.stop()
+    await invalidation_bus.stop()
     await db.disconnect()
     print("✅ Database disconnected successfully")
 
@@ -41,6 +60,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 # Registrar routers básicos
@@ -155,6 +175,15 @@ async def system_status():
     
     return {
         "timestamp": datetime.utcnow().isoformat(),
+        "caches": {
+            "orders": order_repository.cache_stats(),
+            "event_filter": business_rule_evaluator.filter_cache_stats(),
+            "invalidation_bus": invalidation_bus.stats(),
+        },
+        "shadow_rules": shadow_evaluator.stats(),
+        "state_machine": state_machine_registry.stats(),
+        "order_locks": order_locks.stats(),
+        "logging": logging_stats(),
         "components": {
             "database": db_status,
             "original_api": "active",
@@ -11,7 +11,7 @@ import {
   SupportTicketStats, 
   FilteredEventsResponse
 } from './types'
-import { API_ENDPOINTS } from './constants'
+import { API_ENDPOINTS, ORDERS_PAGE_SIZE } from './constants'
 
 // Configurar axios
 const api = axios.create({
@@ -51,9 +51,19 @@ export const orderApi = {
   healthCheck: (): Promise<AxiosResponse> => 
     api.get(API_ENDPOINTS.HEALTH),
 
-  // Get all orders
-  getAll: (): Promise<AxiosResponse<Order[]>> => 
-    api.get(API_ENDPOINTS.ORDERS),
+  // Get all orders, following X-Next-Cursor until the last page
+  getAll: async (): Promise<AxiosResponse<Order[]>> => {
+    const params = { limit: ORDERS_PAGE_SIZE }
+    let response = await api.get<Order[]>(API_ENDPOINTS.ORDERS, { params })
+    const orders = [...response.data]
+    let cursor = response.headers['x-next-cursor']
+    while (cursor) {
+      response = await api.get<Order[]>(API_ENDPOINTS.ORDERS, { params: { ...params, cursor } })
+      orders.push(...response.data)
+      cursor = response.headers['x-next-cursor']
+    }
+    return { ...response, data: orders }
+  },
 
   // Get order by ID
   getById: (id: string): Promise<AxiosResponse<Order>> => 
@@ -250,6 +250,9 @@ export const SUPPORT_TICKET_STATUS_CONFIG: Record<SupportTicketStatus, {
   }
 }
 
+// Orders listing page size (backend maximum per page)
+export const ORDERS_PAGE_SIZE = 500
+
 // API Endpoints
 export const API_ENDPOINTS = {
   // Orders